@@ -50,8 +50,40 @@ The output of this program is created in the sample folder in the 'data' folder
 		'sample_name'_specdata.txt
 		'sample_name'_specdatafull_LAM.txt
 		'sample_name'_specdatahalf.txt
+		'sample_name'_colordata.txt (lambda max, FWHM, CIE xy, u'v' and colour shift delta u'v' against normal for every angle)
+		'sample_name'_effdata_LAM_bands.txt and 'sample_name'_effdata_NONLAM_bands.txt (2.5, 50 and 97.5 percentiles of J, L, EQE, LE, CE and PoD
+		from a Monte-Carlo of the input tolerances, only if uncertainty_samples is above 0, see uncertainty.py)
+		('sample_name'_specmap.npy while a run is analysed in blocks, see below)
+		('sample_name'_factors.npz, the low-rank factors of the spectra with their error bound, only if denoise_rank is set, see below)
 		and
 		7 PNG files containing some of the comparison between NONLAM and LAM.
+    - adds a summary row of the run (peak efficiencies, CIE, eFACTOR/vFACTOR, ...) to 'data/results_index.sqlite', see results_index.py
+    - if columnar_directory is set (e.g. 'data/columnar'), writes the run summary, the efficiency data (LAM and NONLAM), lamdata and
+      the normalised map as typed Parquet tables partitioned by sample and date, see columnar_export.py (needs pyarrow)
+
+Runs that would need more memory than memory_limit (MB) in the analysis, e.g. 0.1deg steps with many pixels, are
+analysed in blocks of angles with the spectra stored as float32 map on disk, see chunked_analysis.py. The results are
+the same, the map and spectra plots show at most 360 angles.
+
+A run with several source values at every angle ('raw'/setpoints.txt, see goniometer_run.py) is analysed once per
+setpoint into 'processedEL'/'setpoint1', ... (the IVL scan is shared). 'sample_name'_setpoints.txt in 'processedEL'
+lists current, voltage, eFACTOR/vFACTOR, CIE and lambda max of every setpoint, and 'sample_name'_effdata_NONLAM.txt
+and 'sample_name'_effdata_LAM.txt there are roll-off corrected: every point of the IVL scan uses the angular emission
+and perpendicular spectrum of its current, interpolated by log current between the setpoints (the lowest and highest
+setpoint below and above them). The results index and the columnar tables hold these corrected efficiencies.
+
+If denoise_rank is set (a rank or 'auto'), the processed spectra are replaced by their truncated SVD (see low_rank.py)
+before the integrals, the colour, the plots and the _specdata files are calculated; the compact factors are kept.
+
+If profiling is True, the wall time, CPU time and peak memory of every stage of every run (library loading at import,
+setup, parsing, spectra, denoising, integrals, efficiency, figures, export, uncertainty, index) are recorded and the
+summary of the batch is printed and saved to 'data'/'profiles', see stage_profiler.py. The stages in profile_stages
+(e.g. ['figures'], '*' for all) are also profiled function by function ('sample' or 'deterministic', profile_mode).
+Runs analysed in blocks of angles read their spectrum files in the spectra stage.
+
+Running this file analyses all runs in the 'batch' folder. A single run can be analysed from other code with
+analyse_run(sample, datetime); the raw data is read through GoniometerRun (goniometer_run.py), also from runs that
+were packed into 'raw.npz' (see run_archive.py).
 
 Important parameters for the analysis:    
     - distance PD to OLED: fixed in EL setup to 0.115m
@@ -63,10 +95,27 @@ Important parameters for the analysis:
 "IMPORTING REQUIRED MODULES"
 # General Modules
 import os, shutil
-import re, string
+import re
 import numpy as np
 import matplotlib.pyplot as mpl
 import datetime as dt
+# Results index
+import results_index
+# Run data model
+import goniometer_run
+from goniometer_run import GoniometerRun
+# Colorimetry
+import colorimetry
+# Confidence bands of the efficiency data
+import uncertainty
+# Analysis of long runs in blocks of angles
+import chunked_analysis
+# Typed columnar outputs
+import columnar_export
+# Low-rank denoising of the spectra
+import low_rank
+# Stage-level profiling
+import stage_profiler
 
 "FUNCTIONS AND DEFAULT SETTINGS"
 def movingaverage(interval, window_size):
@@ -129,6 +178,7 @@ def set_gain(gain):
 now = dt.datetime.now() # Set the start time
 start_time = str(now.strftime("%Y-%m-%d %H:%M").replace(" ","").replace(":","").replace("-",""))
 
+library_start = stage_profiler.snapshot() # loading the library files is the first stage of the batch profile
 # Loading the V(λ) and R(λ) spectra against wavelength
 wavelength = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','Photopic_response.txt'))[:,0]
 Vlambda = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','Photopic_response.txt'))[:,1]
@@ -138,11 +188,13 @@ Rlambda = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','Responsiv
 XCIE = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','NormCurves_400-800.txt'))[:,2]
 YCIE = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','NormCurves_400-800.txt'))[:,3]
 ZCIE = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','NormCurves_400-800.txt'))[:,4]
+CMF = np.stack((XCIE, YCIE, ZCIE), axis=1) # colour matching functions as one matrix for all angles
 
 # Loading the spectrometer calibration factors -  this converts the counts/nm/sr into W/nm/sr (responsivity function of the spectrometer and transmission of the fibre)
 calibrationwvl = np.array(np.loadtxt(os.path.join(os.path.dirname(__file__),'library','CalibrationData.txt'))[:,0])
 calibration = np.array(np.loadtxt(os.path.join(os.path.dirname(__file__),'library','CalibrationData.txt'))[:,1])
 calibration = np.interp(wavelength, calibrationwvl, calibration) # interpolate calibration factor onto correct axis
+library_load = stage_profiler.elapsed(library_start)
 
 # Setting Variables
 OLEDwidth = 2e-3 # OLED width or height in m; 
@@ -158,319 +210,423 @@ Km = 683 # Peak response in lm/W
 h = 6.62606896e-34 # Planck's Constant in Js
 c = 299792458 # Speed of Light in m/s
 e = 1.602176462e-19 # Magnitude of fundamental charge in As
+uncertainty_samples = 0 # Monte-Carlo samples for the confidence bands of the efficiency data (see uncertainty.py), 0 to skip
+memory_limit = 1024 # MB, runs that need more are analysed in blocks of angles (see chunked_analysis.py), None for never
+columnar_directory = None # folder of the Parquet outputs (see columnar_export.py), e.g. columnar_export.COLUMNAR_DIRECTORY, None to skip
+denoise_rank = None # rank of the approximation that denoises the spectra (see low_rank.py), 'auto' from the noise level, None to skip
+profiling = False # time and peak memory of the stages of every run, summary of the batch in 'data'/'profiles' (see stage_profiler.py)
+profile_stages = [] # stages that are also profiled function by function, e.g. ['figures'], '*' for all
+profile_mode = 'sample' # 'sample' (low overhead) or 'deterministic' (cProfile)
 
-batch = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'batch'))
-print os.listdir(batch)
-for sample in os.listdir(batch):         
-    for datetime in os.listdir(os.path.abspath(os.path.join(batch, sample))): 
-        sampledirectory = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', sample, datetime))
-        rawdirectory = os.path.abspath(os.path.join(sampledirectory, 'raw')) 
-        if os.path.isdir(rawdirectory):
-            pass
-        else:
-            print "No data found for this measurement code."
-            os.sys.exit()
-
-        "SETTING DIRECTORY FOR EXPORTING DATA"
-        processdirectory = os.path.abspath(os.path.join(sampledirectory, 'processedEL')) 
-        process = True
-        while process == True:
-            if os.path.isdir(processdirectory):
-                cont = 'Y' # str(raw_input("Processed data already exists for this measurement code. Proceed with analysis? (Y/N)  "))
+datadirectory = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
+
+"ANALYSIS OF ONE RUN"
+def analyse_run(sample, datetime, datadirectory=datadirectory, index=None, uncertainty_samples=uncertainty_samples, memory_limit=memory_limit,
+                columnar_directory=columnar_directory, denoise_rank=denoise_rank, setpoint=None, profiler=None):
+    """
+    Analyse one run, i.e. the 'raw' folder of datadirectory/sample/datetime, and write the results to its 'processedEL' folder.
+    A run with several setpoints per angle is analysed with analyse_setpoints().
+
+    sample: str
+        sample name (folder in the data directory).
+    datetime: str
+        measurement time (folder in the sample folder).
+    datadirectory: str
+        the 'data' folder, by default next to this file.
+    index: sqlite3.Connection
+        results index (see results_index.py) to which the summary row of the run is added, None to skip.
+    uncertainty_samples: int
+        number of Monte-Carlo samples for the confidence bands of the efficiency data, 0 to skip.
+    memory_limit: float
+        memory (MB) above which the spectra are analysed in blocks of angles, None to always analyse them in memory.
+    columnar_directory: str
+        folder of the typed columnar outputs (Parquet, partitioned by sample and date), None to skip.
+    denoise_rank: int or str
+        rank of the low-rank approximation that replaces the spectra, 'auto' for the rank from the noise level, None to
+        analyse the measured spectra.
+    setpoint: int
+        setpoint (1, 2, ...) of a run with several setpoints per angle, analysed into 'processedEL'/'setpoint<k>'.
+    profiler: stage_profiler.StageProfiler
+        records the stages of the run, None to skip.
+
+    returns:
+        results: dict
+            efficiency data, lamdata, eFACTOR/vFACTOR, CIE coordinates and maximum of the perpendicular spectrum
+            (and the confidence bands 'bands_LAM'/'bands_NONLAM' if uncertainty_samples is above 0).
+    """
+    sampledirectory = os.path.abspath(os.path.join(datadirectory, sample, datetime))
+    rawdirectory = os.path.abspath(os.path.join(sampledirectory, 'raw')) 
+    if os.path.isdir(rawdirectory) or os.path.isfile(rawdirectory + '.npz'): # 'raw' folder or packed run (see run_archive.py)
+        pass
+    else:
+        print "No data found for this measurement code."
+        os.sys.exit()
+
+    if columnar_directory is not None and not columnar_export.available():
+        print "pyarrow is not installed, the columnar outputs are skipped."
+        columnar_directory = None
+
+    run = GoniometerRun(rawdirectory, setpoint=setpoint) # files are only read when they are used
+    if setpoint is None and run.setpoints is not None:
+        return analyse_setpoints(sample, datetime, datadirectory, index, uncertainty_samples, memory_limit, columnar_directory, denoise_rank, profiler)
+    if profiler is None:
+        profiler = stage_profiler.NO_PROFILER
+    profiler.run(sample + ' ' + datetime + ('' if setpoint is None else ' setpoint ' + str(setpoint)))
+    profiler.stage('setup')
+
+    "SETTING DIRECTORY FOR EXPORTING DATA"
+    processdirectory = os.path.abspath(os.path.join(sampledirectory, 'processedEL')) 
+    if setpoint is not None:
+        processdirectory = os.path.join(processdirectory, goniometer_run.setpoint_folder(setpoint))
+    process = True
+    while process == True:
+        if os.path.isdir(processdirectory):
+            cont = 'Y' # str(raw_input("Processed data already exists for this measurement code. Proceed with analysis? (Y/N)  "))
+            if cont == str('Y'):
+                cont =  'Y' # str(raw_input("Do you wish to overwrite current analysis data? (Y/N)   "))
                 if cont == str('Y'):
-                    cont =  'Y' # str(raw_input("Do you wish to overwrite current analysis data? (Y/N)   "))
-                    if cont == str('Y'):
-                        s = open(os.path.join(processdirectory,'_specdata.txt'), 'w')
-                        s.close() # Makes sure the file is closed before deleting the folder
-                        shutil.rmtree(processdirectory)
-                        os.mkdir(processdirectory)
-                        process = False
-                        break
-                    elif cont == str('N'):
-                        for n in range(1,5,1): # Makes a new directory with a different name so the old one isn't overwritten
-                            process = 'processed' + str(n)
-                            processdirectory = os.path.abspath(os.path.join(sampledirectory, process)) 
-                            if not os.path.isdir(processdirectory):
-                                os.mkdir(processdirectory)
-                                process = False
-                                break                
-                    else:
-                        print "Invalid input."
+                    s = open(os.path.join(processdirectory,'_specdata.txt'), 'w')
+                    s.close() # Makes sure the file is closed before deleting the folder
+                    shutil.rmtree(processdirectory)
+                    os.mkdir(processdirectory)
+                    process = False
+                    break
                 elif cont == str('N'):
-                        print "Finished. No analysis performed."
-                        os.sys.exit()
+                    for n in range(1,5,1): # Makes a new directory with a different name so the old one isn't overwritten
+                        process = 'processed' + str(n)
+                        processdirectory = os.path.abspath(os.path.join(sampledirectory, process)) 
+                        if not os.path.isdir(processdirectory):
+                            os.mkdir(processdirectory)
+                            process = False
+                            break                
                 else:
                     print "Invalid input."
+            elif cont == str('N'):
+                    print "Finished. No analysis performed."
+                    os.sys.exit()
             else:
-                os.makedirs(processdirectory)
-                process = False
-                break
-        
-        "FINDING EXISTING DATA AND PERFORMING ANALYSIS"        
-        mayafilepath = 'spectrumdata' # setting spectra directory        
-        keithleyfilepath = 'keithleydata' # setting keithley directory
-        mayafilepath = os.path.abspath(os.path.join(rawdirectory, mayafilepath))
-        keithleyfilepath = os.path.abspath(os.path.join(rawdirectory, keithleyfilepath))
-        spec_header = 11 
-        voltage_header = 11        
-        print "Spectrum files found for this measurement :   ", os.listdir(mayafilepath)
-        print "Keithley files found for this measurement :   ", os.listdir(keithleyfilepath)
-        
-        print "\nIMPORTING DATA..."                    
-
-        # Importing spectrum data
-        mayadata = os.listdir(mayafilepath) # lists all files in folder spectrum data
-        spectrumdata = [ a for a in mayadata if a.startswith('Angle') ]
-        background = [ a for a in mayadata if not a.startswith('Angle') ]
-        spectrumdata.sort(key = lambda x : (float(x.split("Angle")[1].split(".txt")[0]), x))
-        print "\nSpectrum files in use are: ", spectrumdata
-        print "\nBackground file in use is:", background                                                        
-        # Background spectrum
-        bgwvl = np.array(np.loadtxt(os.path.join(mayafilepath, background[0]),skiprows=spec_header)[:,0]) # Loading background spectrum
-        bginte = np.array(np.loadtxt(os.path.join(mayafilepath, background[0]),skiprows=spec_header)[:,1]) # Loading background spectrum
-        bginte = np.interp(wavelength, bgwvl, bginte) # interpolate background onto correct axis
-        print "\nBackground spectrum loaded..."        
-        # Selecting which angle which will be read first
-        first_angle = float(string.split(str(string.split(spectrumdata[0],'.txt')[0]),'Angle')[1]) # gets the string 'Angle_' from the filename
-        print "\nThe first angle to be analysed is:   "+str(first_angle)+"..."
-        # Saving the data for the forward spectrum
-        try:
-            specwvl = np.array(np.loadtxt(os.path.join(mayafilepath,'Angle0.0.txt'), skiprows=spec_header)[:,0])
-            rawspecinte = np.array(np.loadtxt(os.path.join(mayafilepath,'Angle0.0.txt'), skiprows=spec_header)[:,1]) # load wavelengths and raw intensity               
-            rawspecinte = np.interp(wavelength, specwvl, rawspecinte) # interpolate spectrum onto correct axis            
-            spec = np.array(rawspecinte) - np.array(bginte) # subtract background intensity
-            intensity = spec * calibration # multiply by spectrometer calibration factor to get intensity in W/nm/sr
-            perp_intensity = movingaverage(intensity,10)
-            print "\nPerpendicular spectrum loaded..."
-        except:
-            try:
-                specwvl = np.array(np.loadtxt(os.path.join(mayafilepath,'Angle000.txt'), skiprows=spec_header)[:,0])
-                rawspecinte = np.array(np.loadtxt(os.path.join(mayafilepath,'Angle000.txt'), skiprows=spec_header)[:,1]) # load wavelengths and raw intensity               
-                rawspecinte = np.interp(wavelength, specwvl, rawspecinte) # interpolate spectrum onto correct axis            
-                spec = np.array(rawspecinte) - np.array(bginte) # subtract background intensity
-                intensity = spec * calibration # multiply by spectrometer calibration factor to get intensity in W/nm/sr
-                perp_intensity = movingaverage(intensity,10)
-                print "\nPerpendicular spectrum loaded..."
-            except:
-                print("No perpendicular spectrum. Unable to perform analysis.")
-                os.sys.exit() 
-        
-        # Importing current-voltage-luminance data
-        angles = np.array(np.loadtxt(os.path.join(keithleyfilepath,'keithleyOLEDvoltages.txt'), skiprows=voltage_header)[:,0])
-        OLEDvoltage_spec = np.array(np.loadtxt(os.path.join(keithleyfilepath,'keithleyOLEDvoltages.txt'), skiprows=voltage_header)[:,1])
-        OLEDcurrent_spec = np.array(np.loadtxt(os.path.join(keithleyfilepath,'keithleyOLEDvoltages.txt'), skiprows=voltage_header)[:,2])                        
-        # Loading the Keithley data
-        currentdata = os.listdir(keithleyfilepath)
-        currentdata.sort()
-        OLEDdata = currentdata[0]
-        PDdata = currentdata[1]
-        print "\nOLED Current and Voltage file in use is:", OLEDdata
-        print "\nPhotodiode Voltage file in use is:", PDdata
-        # Current / Voltage / Luminance IVL Readings from Photodiode
-        OLEDvoltage = np.array(np.loadtxt(os.path.join(keithleyfilepath,'keithleyPDvoltages.txt'), skiprows=voltage_header)[:,0])
-        OLEDcurrent_mA = np.array(np.loadtxt(os.path.join(keithleyfilepath,'keithleyPDvoltages.txt'), skiprows=voltage_header)[:,1])
-        OLEDcurrent = OLEDcurrent_mA * 1e-3
-        PDvoltage = np.array(np.loadtxt(os.path.join(keithleyfilepath,'keithleyPDvoltages.txt'), skiprows=voltage_header)[:,2])
-        # This checks for 180 or 90 degree measurement
-        n = len(angles)-1
-        min_angle = angles[0]
-        max_angle = angles[n]
-        step_angle = (max_angle - min_angle)/n
-        print "\nSpectra taken for the following angles : ",angles
-        
-        print "\nPicking out the perpendicular (0 degree) reading... "
-        if max_angle == 90:
-            try:
-                min_index = 0.0
-                max_index = 90.0
-            except ValueError:
-               print "Can't find perpendicular reading"
-        elif max_angle == 180:
-            try:
-                min_index = 90.0
-                max_index = 180.0
-            except ValueError:
-               print "Can't find perpendicular reading"
+                print "Invalid input."
         else:
-            print "\nCheck angle range of data."
-        
-        "Setting all empty arrays for later data collection"
-        ints = {}  # Dictionary for every spectrum at each angle      
-        intensities = [] # 2d array of all intensities across all angles and for all wavelengths     
-        Integral1 = []
-        Integral2 = []
-        Integral3 = []
-        Integral4 = []
-        eFACTOR = []
-        vFACTOR = []
-        RI = []
-        LI = []        
-        eCoeff = np.zeros(PDvoltage.shape)
-        vCoeff = np.zeros(PDvoltage.shape)  
-        EQE = np.zeros(PDvoltage.shape)
-        Lum = np.zeros(PDvoltage.shape)
-        LE = np.zeros(PDvoltage.shape)
-        CE = np.zeros(PDvoltage.shape)
-        POW = np.zeros(PDvoltage.shape) 
-        
-        # LOADING ALL OF THE SPECTRUM DATA AND FORMATTING
-        for title in spectrumdata:
-            name = str(string.split(title,'.txt')[0]) # gets the string 'Angle_' from the filename
-            angle = float(string.split(name,'Angle')[1]) # gets the string 'Angle_' from the filename
+            os.makedirs(processdirectory)
+            process = False
+            break
+    
+    "FINDING EXISTING DATA AND PERFORMING ANALYSIS"        
+    profiler.stage('parsing')
+    print "Spectrum files found for this measurement :   ", run.spectrum_files + run.background_files
+    print "Keithley files found for this measurement :   ", run.keithley_files
+    
+    print "\nIMPORTING DATA..."                    
+
+    # Importing spectrum data
+    spectrumdata = run.spectrum_files
+    background = run.background_files
+    print "\nSpectrum files in use are: ", spectrumdata
+    print "\nBackground file in use is:", background                                                        
+    # Background spectrum
+    bginte = np.interp(wavelength, run.background_wavelengths, run.background) # interpolate background onto correct axis
+    print "\nBackground spectrum loaded..."        
+    # Selecting which angle which will be read first
+    first_angle = run.angles[0]
+    print "\nThe first angle to be analysed is:   "+str(first_angle)+"..."
+    # Saving the data for the forward spectrum
+    specwvl = run.wavelengths
+    try:
+        rawspecinte = np.interp(wavelength, specwvl, run.spectrum(0.0)) # interpolate spectrum onto correct axis            
+        spec = np.array(rawspecinte) - np.array(bginte) # subtract background intensity
+        intensity = spec * calibration # multiply by spectrometer calibration factor to get intensity in W/nm/sr
+        perp_intensity = movingaverage(intensity,10)
+        print "\nPerpendicular spectrum loaded..."
+    except KeyError:
+        print("No perpendicular spectrum. Unable to perform analysis.")
+        os.sys.exit() 
+    
+    # Importing current-voltage-luminance data
+    angles = run.oled_table[:,0]
+    OLEDvoltage_spec = run.oled_table[:,1]
+    OLEDcurrent_spec = run.oled_table[:,2]
+    # Loading the Keithley data
+    OLEDdata = run.keithley_files[0]
+    PDdata = run.keithley_files[1]
+    print "\nOLED Current and Voltage file in use is:", OLEDdata
+    print "\nPhotodiode Voltage file in use is:", PDdata
+    # Current / Voltage / Luminance IVL Readings from Photodiode
+    OLEDvoltage = run.pd_table[:,0]
+    OLEDcurrent_mA = run.pd_table[:,1]
+    OLEDcurrent = OLEDcurrent_mA * 1e-3
+    PDvoltage = run.pd_table[:,2]
+    # This checks for 180 or 90 degree measurement
+    n = len(angles)-1
+    min_angle = angles[0]
+    max_angle = angles[n]
+    step_angle = (max_angle - min_angle)/n
+    print "\nSpectra taken for the following angles : ",angles
+    
+    print "\nPicking out the perpendicular (0 degree) reading... "
+    if max_angle == 90:
+        try:
+            min_index = 0.0
+            max_index = 90.0
+        except ValueError:
+           print "Can't find perpendicular reading"
+    elif max_angle == 180:
+        try:
+            min_index = 90.0
+            max_index = 180.0
+        except ValueError:
+           print "Can't find perpendicular reading"
+    else:
+        print "\nCheck angle range of data."
+    
+    "Setting all empty arrays for later data collection"
+    ints = {}  # Dictionary for every spectrum at each angle      
+    intensities = [] # 2d array of all intensities across all angles and for all wavelengths     
+    Integral1 = []
+    Integral2 = []
+    Integral3 = []
+    Integral4 = []
+    eFACTOR = []
+    vFACTOR = []
+    projections = [] # weighted sums of the spectra of the angles in eFACTOR and vFACTOR (see uncertainty.py)
+    RI = []
+    LI = []        
+    eCoeff = np.zeros(PDvoltage.shape)
+    vCoeff = np.zeros(PDvoltage.shape)  
+    EQE = np.zeros(PDvoltage.shape)
+    Lum = np.zeros(PDvoltage.shape)
+    LE = np.zeros(PDvoltage.shape)
+    CE = np.zeros(PDvoltage.shape)
+    POW = np.zeros(PDvoltage.shape) 
+    
+    # Long runs are analysed in blocks of angles within the memory limit, the spectra are kept in a float32 map on disk
+    chunked = memory_limit is not None and chunked_analysis.analysis_memory(len(run.angles), len(specwvl), len(wavelength)) > memory_limit*1e6
+    if chunked:
+        print "\nAnalysing the spectra in blocks of angles (memory limit " + str(memory_limit) + " MB)..."
+        specmap = chunked_analysis.SpectralMap(os.path.join(processdirectory, sample+'_specmap.npy'), len(run.angles), len(wavelength), memory_limit)
+        blocks = chunked_analysis.blocks(len(run.angles), len(specwvl), len(wavelength), memory_limit)
+    else:
+        blocks = [(0, len(run.angles))]
+    colour_blocks = []
+    if denoise_rank is not None:
+        decomposition = low_rank.Decomposition(len(wavelength))
+    if not chunked:
+        for angle in run.angles:
+            run.spectrum(angle) # read (and kept) here, so that the spectra stage holds only their processing
+    profiler.stage('spectra')
+    
+    def add_angle(angle, intensity):
+        """
+        RI/LI of an angle, eFACTOR/vFACTOR and their projections for the angles from 0 to 90deg.
+        """
+        RI.append(float(h*c/1e-9*np.sum(intensity)))                
+        LI.append(float(Km*h*c/1e-9*np.sum(intensity*Vlambda)))   
+        if angle in np.arange(min_index,max_index,step_angle):
+            eFACTOR.append(sum(intensity*wavelength)/sum(perp_intensity*wavelength)) # This replaces cos(theta) in I = I0*cos(theta) 
+            vFACTOR.append(sum(intensity*Vlambda)/sum(perp_intensity*Vlambda)) # This replaces cos(theta) in I = I0*cos(theta) 
+            projections.append(uncertainty.factor_projections(intensity, wavelength, Vlambda)[0])
+    
+    # LOADING ALL OF THE SPECTRUM DATA AND FORMATTING
+    for start, stop in blocks:
+        if chunked:
+            rawblock = run.spectrum_block(start, stop)
+            block = np.empty((stop - start, len(wavelength)))
+        for k, angle in enumerate(run.angles[start:stop]):
             
             "PROCESSING THE SPECTRUM DATA - SUBTRACT BACKGROUND AND MULTIPLY BY CALIBRATION"
-            specwvl = np.array(np.loadtxt(os.path.join(mayafilepath,title), skiprows=spec_header)[:,0])
-            rawspecinte = np.array(np.loadtxt(os.path.join(mayafilepath,title), skiprows=spec_header)[:,1]) # load wavelengths and raw intensity               
-            rawspecinte = np.interp(wavelength, specwvl, rawspecinte) # interpolate spectrum onto correct axis            
+            rawspecinte = np.interp(wavelength, specwvl, rawblock[k] if chunked else run.spectrum(angle)) # interpolate spectrum onto correct axis            
             spec = np.array(rawspecinte) - np.array(bginte) # subtract background intensity
             intensity = spec * calibration # multiply by spectrometer calibration factor to get intensity W/nm/sr
             intensity = movingaverage(intensity,10) # smoothing
-            ints[angle] = intensity # saves individual spectra to a directory of all
-            
-            RI.append(float(h*c/1e-9*np.sum(intensity)))                
-            LI.append(float(Km*h*c/1e-9*np.sum(intensity*Vlambda)))   
+            if denoise_rank is None: # otherwise from the approximation, see below
+                add_angle(angle, intensity)
 
-            if angle == first_angle: # Stacking intensities into a 2D matrix
-                intensities.append((np.array(intensity)))
+            if chunked:
+                block[k] = intensity
             else:
-                intensities = np.vstack((intensities,np.array(intensity)))                    
-
-            if angle in np.arange(min_index,max_index,step_angle):
-                eFACTOR.append(sum(intensity*wavelength)/sum(perp_intensity*wavelength)) # This replaces cos(theta) in I = I0*cos(theta) 
-                vFACTOR.append(sum(intensity*Vlambda)/sum(perp_intensity*Vlambda)) # This replaces cos(theta) in I = I0*cos(theta) 
-              
-        # Formatting the data for the intensity map and spectrum.
-        specangles = np.hstack([0, angles])
+                ints[angle] = intensity # saves individual spectra to a directory of all
+                if angle == first_angle: # Stacking intensities into a 2D matrix
+                    intensities.append((np.array(intensity)))
+                else:
+                    intensities = np.vstack((intensities,np.array(intensity)))                    
+        if chunked:
+            specmap.write(start, block)
+            if denoise_rank is None:
+                colour_blocks.append(colorimetry.angle_resolved_colour(run.angles[start:stop], block, wavelength, CMF, normal_angle=min_index))
+            else:
+                decomposition.add(block)
+            del rawblock, block
+
+    # Denoising: the spectra are replaced by their low-rank approximation (see low_rank.py)
+    if denoise_rank is not None:
+        profiler.stage('denoising')
+        if not chunked:
+            decomposition.add(intensities)
+        model = decomposition.fit(denoise_rank, len(run.angles))
+        print "\nDenoising the spectra : rank " + str(model.rank) + ", relative error " + '%.2e' % model.error + "..."
+        perp_intensity = model.denoise(perp_intensity[np.newaxis, :])[0]
+        if chunked:
+            specmap.maximum = -np.inf # the map is written again with the approximation
+        else:
+            intensities = model.denoise(intensities, 0)
+            ints = dict(zip(run.angles, intensities))
+        for start, stop in blocks:
+            block = model.denoise(specmap.data[start:stop], start) if chunked else intensities[start:stop]
+            for k, angle in enumerate(run.angles[start:stop]):
+                add_angle(angle, block[k])
+            if chunked:
+                specmap.write(start, block)
+                colour_blocks.append(colorimetry.angle_resolved_colour(run.angles[start:stop], block, wavelength, CMF, normal_angle=min_index))
+        model.save(os.path.join(processdirectory, sample+low_rank.SUFFIX), run.angles, wavelength)
+        print "Low-rank factors saved, " + '%.0f' % model.compression() + " times smaller than the map"
+          
+    # Formatting the data for the intensity map and spectrum.
+    profiler.stage('integrals')
+    specangles = np.hstack([0, angles])
+    if not chunked:
         normintensities = np.array(intensities) / np.amax(np.array(intensities))
         intensitydata = np.vstack((wavelength,normintensities))
         intensitydata = np.hstack((specangles.reshape(specangles.shape[0],1), intensitydata))
 
-        # Calculating key integrals for intensity in forward direction and correction factors F_E and F_V for all angles
-        Integral1 = np.sum(perp_intensity*wavelength)
-        Integral2 = np.sum(perp_intensity)
-        Integral3 = np.sum(perp_intensity*Vlambda)
-        Integral4 = np.sum(perp_intensity*Rlambda)
-        eFACTOR = np.sum(np.array(eFACTOR)*np.sin(np.deg2rad(np.arange(min_index,max_index,step_angle)))*np.deg2rad(step_angle)) 
-        vFACTOR = np.sum(np.array(vFACTOR)*np.sin(np.deg2rad(np.arange(min_index,max_index,step_angle)))*np.deg2rad(step_angle))     
-        print eFACTOR
-        print vFACTOR
-
-        # Lambertian Spectrum
-        Ilam = []
-        for i in range(len(angles)):
-            Ilam.append(np.cos(np.deg2rad(angles[i])))
-        Inonlam = np.array(RI) / RI[np.where(angles == min_index)[0][0]]
-        Inonlam_v = np.array(LI) / LI[np.where(angles == min_index)[0][0]] #emission in terms of photometric response, so taking into account the spectral shifts and sensitivity of the eye/photopic response
-        lamdata = np.stack((angles, Ilam, Inonlam, Inonlam_v))
-            
-        # Current density calculations
-        currentdensity = OLEDcurrent*1e3/(OLEDarea*1e4) # calculate current density in mA/cm2
-        abscurrentdensity = abs(np.array(currentdensity)) # calculates the absolute value of the current density 
+    # Calculating key integrals for intensity in forward direction and correction factors F_E and F_V for all angles
+    Integral1 = np.sum(perp_intensity*wavelength)
+    Integral2 = np.sum(perp_intensity)
+    Integral3 = np.sum(perp_intensity*Vlambda)
+    Integral4 = np.sum(perp_intensity*Rlambda)
+    eFACTOR = np.sum(np.array(eFACTOR)*np.sin(np.deg2rad(np.arange(min_index,max_index,step_angle)))*np.deg2rad(step_angle)) 
+    vFACTOR = np.sum(np.array(vFACTOR)*np.sin(np.deg2rad(np.arange(min_index,max_index,step_angle)))*np.deg2rad(step_angle))     
+    print eFACTOR
+    print vFACTOR
+
+    # Lambertian Spectrum
+    Ilam = []
+    for i in range(len(angles)):
+        Ilam.append(np.cos(np.deg2rad(angles[i])))
+    Inonlam = np.array(RI) / RI[np.where(angles == min_index)[0][0]]
+    Inonlam_v = np.array(LI) / LI[np.where(angles == min_index)[0][0]] #emission in terms of photometric response, so taking into account the spectral shifts and sensitivity of the eye/photopic response
+    lamdata = np.stack((angles, Ilam, Inonlam, Inonlam_v))
         
-        # Calculating CIE coordinates
-        for i, j in enumerate(perp_intensity):
-            if j == max(perp_intensity):
-                lambdamax = wavelength[i]
-                X = sum(perp_intensity*XCIE)
-                Y = sum(perp_intensity*YCIE)
-                Z = sum(perp_intensity*ZCIE)
-                CIE = [0]*2
-                CIE[0] = X/(X+Y+Z)
-                CIE[1] = Y/(X+Y+Z)
-                CIEformatted = ('('+', '.join(['%.3f']*2)+')') % tuple(CIE)
-                
-        print "Calculating non-Lambertian efficiency data..."
-        for v in range(len(PDvoltage)):
-            if PDvoltage[v] > PDcutoff:
-                eCoeff[v] = PDvoltage[v]/PDresis/sqsinalpha*2
-                vCoeff[v] = Km*PDvoltage[v]/PDresis/sqsinalpha*2
-                EQE[v] = 100*(e/1e9/h/c/OLEDcurrent[v]*eCoeff[v]*Integral1/Integral4*eFACTOR)
-                Lum[v] = 1/np.pi/OLEDarea*vCoeff[v]/2*Integral3/Integral4
-                LE[v] = 1/OLEDvoltage[v]/OLEDcurrent[v]*vCoeff[v]*Integral3/Integral4*vFACTOR
-                CE[v] = OLEDarea/OLEDcurrent[v]*Lum[v]
-                POW[v] = 1/(OLEDarea*1e6)*eCoeff[v]*Integral2/Integral4*eFACTOR*1e3                            
-        # Formatting the efficiency data
-        dataeff_NONLAM = np.stack((OLEDvoltage, OLEDcurrent*1e3, currentdensity,abscurrentdensity,Lum,EQE,LE,CE,POW))  # Converges the individual arrays into one array
-
-        print "Calculating Lambertian efficiency data..."
-        for v in range(len(PDvoltage)):
-            if PDvoltage[v] > PDcutoff:
-                eCoeff[v] = PDvoltage[v]/PDresis/sqsinalpha
-                vCoeff[v] = Km*PDvoltage[v]/PDresis/sqsinalpha
-                EQE[v] = 100*(e/1e9/h/c/OLEDcurrent[v]*eCoeff[v]*Integral1/Integral4)
-                Lum[v] = 1/np.pi/OLEDarea*vCoeff[v]*Integral3/Integral4
-                LE[v] = 1/OLEDvoltage[v]/OLEDcurrent[v]*vCoeff[v]*Integral3/Integral4
-                CE[v] = OLEDarea/OLEDcurrent[v]*Lum[v]
-                POW[v] = 1/(OLEDarea*1e6)*eCoeff[v]*Integral2/Integral4*1e3
-        # Formatting the efficiency data
-        dataeff_LAM = np.stack((OLEDvoltage, OLEDcurrent*1e3, currentdensity,abscurrentdensity,Lum,EQE,LE,CE,POW))  # Converges the individual arrays into one array
+    # Current density calculations
+    currentdensity = OLEDcurrent*1e3/(OLEDarea*1e4) # calculate current density in mA/cm2
+    abscurrentdensity = abs(np.array(currentdensity)) # calculates the absolute value of the current density 
     
-        "#####################################################################"
-        "#####################EXPORTING FORMATTED DATA########################"
-        "#####################################################################"
-        print "\nEXPORTING..."
-        
-        # Header Parameters
-        line01 = 'Measurement code : ' + sample + datetime
-        line02 = 'Calculation programme :	NonLamLIV-EQE.py'
-        linex =  'Credits :	GatherLab, University of St Andrews, 2019'
-        linexx = 'Measurement time : ' + datetime + '\tAnalysis time :' + start_time
-        line03 = 'OLED active area:     ' + str(OLEDarea) + ' m2'
-        line04 = 'Distance OLED - Photodiode:   ' + str(distance) + ' m'
-        line05 = 'Photodiode area:    ' + str(PDarea) + 'm2'
-        line06 = 'Maximum intensity at:     ' + str(lambdamax) + ' nm'
-        line07 = 'CIE coordinates:      ' + str(CIEformatted)
-        line08 = ''
-        line09 = ''
-        line10 = '### Formatted data ###'
-        line11 = 'V            I           J         Abs(J)        L         EQE        LE         CE        PoD'
-        line12 = 'V            mA       mA/cm2      mA/cm2       cd/m2        %        lm/W        cd/A      mW/mm2'  
-        line13 = 'Intensity for all Wavelengths / Angles'
-        line14 = 'angles    Lambertian    Actual    Actual_v'
-        line15 = 'degree    a.u.    a.u.    a.u.'
-        
-        
-        header_lines = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09, line10, line11, line12]       
-        header_lines2 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09, line10, line13]
-        header_lines3 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09, line10, line14, line15]
-           
-        n=1             
-        # Plotting an intensity grid over all angles and wavelengths
-        mpl.figure(n, figsize = (10,8)) 
-        intemap = mpl.contourf(angles,wavelength,normintensities.T,50,cmap=mpl.cm.jet)
-        mpl.title('Normalised Intensity over all Angles and Wavelengths\n', fontsize=20)
-        mpl.xlabel('Angle (degrees)', fontsize=20)
-        mpl.ylabel('Wavelength (nm)', fontsize=20)
-        mpl.colorbar(intemap)
-        mpl.tick_params(axis='both', labelsize=20)
-        mpl.savefig(os.path.join(processdirectory, sample+'_map.png'), dpi = 500)
-         
-        # Plotting perpendicular spectrum
-        mpl.figure(n+1, figsize = (16,9))    
-        mpl.plot(wavelength, perp_intensity, linewidth = 1.0, label = "Angle"+str(angle))
-        mpl.title('Perpendicular Spectrum\n', fontsize=20)
+    # Calculating CIE coordinates of the perpendicular spectrum and the colour of all angles (see colorimetry.py)
+    lambdamax = colorimetry.peak_wavelength(perp_intensity, wavelength)
+    CIE = list(colorimetry.chromaticity(colorimetry.tristimulus(perp_intensity, CMF)))
+    CIEformatted = ('('+', '.join(['%.3f']*2)+')') % tuple(CIE)
+    if chunked:
+        colour = chunked_analysis.join_colour(colour_blocks, normal_angle=min_index)
+    else:
+        colour = colorimetry.angle_resolved_colour(run.angles, intensities, wavelength, CMF, normal_angle=min_index)
+            
+    profiler.stage('efficiency')
+    print "Calculating non-Lambertian efficiency data..."
+    for v in range(len(PDvoltage)):
+        if PDvoltage[v] > PDcutoff:
+            eCoeff[v] = PDvoltage[v]/PDresis/sqsinalpha*2
+            vCoeff[v] = Km*PDvoltage[v]/PDresis/sqsinalpha*2
+            EQE[v] = 100*(e/1e9/h/c/OLEDcurrent[v]*eCoeff[v]*Integral1/Integral4*eFACTOR)
+            Lum[v] = 1/np.pi/OLEDarea*vCoeff[v]/2*Integral3/Integral4
+            LE[v] = 1/OLEDvoltage[v]/OLEDcurrent[v]*vCoeff[v]*Integral3/Integral4*vFACTOR
+            CE[v] = OLEDarea/OLEDcurrent[v]*Lum[v]
+            POW[v] = 1/(OLEDarea*1e6)*eCoeff[v]*Integral2/Integral4*eFACTOR*1e3                            
+    # Formatting the efficiency data
+    dataeff_NONLAM = np.stack((OLEDvoltage, OLEDcurrent*1e3, currentdensity,abscurrentdensity,Lum,EQE,LE,CE,POW))  # Converges the individual arrays into one array
+
+    print "Calculating Lambertian efficiency data..."
+    for v in range(len(PDvoltage)):
+        if PDvoltage[v] > PDcutoff:
+            eCoeff[v] = PDvoltage[v]/PDresis/sqsinalpha
+            vCoeff[v] = Km*PDvoltage[v]/PDresis/sqsinalpha
+            EQE[v] = 100*(e/1e9/h/c/OLEDcurrent[v]*eCoeff[v]*Integral1/Integral4)
+            Lum[v] = 1/np.pi/OLEDarea*vCoeff[v]*Integral3/Integral4
+            LE[v] = 1/OLEDvoltage[v]/OLEDcurrent[v]*vCoeff[v]*Integral3/Integral4
+            CE[v] = OLEDarea/OLEDcurrent[v]*Lum[v]
+            POW[v] = 1/(OLEDarea*1e6)*eCoeff[v]*Integral2/Integral4*1e3
+    # Formatting the efficiency data
+    dataeff_LAM = np.stack((OLEDvoltage, OLEDcurrent*1e3, currentdensity,abscurrentdensity,Lum,EQE,LE,CE,POW))  # Converges the individual arrays into one array
+
+    "#####################################################################"
+    "#####################EXPORTING FORMATTED DATA########################"
+    "#####################################################################"
+    profiler.stage('figures')
+    print "\nEXPORTING..."
+    
+    # Header Parameters
+    line01 = 'Measurement code : ' + sample + datetime
+    line02 = 'Calculation programme :	NonLamLIV-EQE.py'
+    linex =  'Credits :	GatherLab, University of St Andrews, 2019'
+    linexx = 'Measurement time : ' + datetime + '\tAnalysis time :' + start_time
+    line03 = 'OLED active area:     ' + str(OLEDarea) + ' m2'
+    line04 = 'Distance OLED - Photodiode:   ' + str(distance) + ' m'
+    line05 = 'Photodiode area:    ' + str(PDarea) + 'm2'
+    line06 = 'Maximum intensity at:     ' + str(lambdamax) + ' nm'
+    line07 = 'CIE coordinates:      ' + str(CIEformatted)
+    line08 = ''
+    line09 = ''
+    line10 = '### Formatted data ###'
+    line11 = 'V            I           J         Abs(J)        L         EQE        LE         CE        PoD'
+    line12 = 'V            mA       mA/cm2      mA/cm2       cd/m2        %        lm/W        cd/A      mW/mm2'  
+    line13 = 'Intensity for all Wavelengths / Angles'
+    line14 = 'angles    Lambertian    Actual    Actual_v'
+    line15 = 'degree    a.u.    a.u.    a.u.'
+    
+    
+    header_lines = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09, line10, line11, line12]       
+    header_lines2 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09, line10, line13]
+    header_lines3 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09, line10, line14, line15]
+       
+    n=1             
+    # Plotting an intensity grid over all angles and wavelengths
+    if chunked: # every n-th angle of the map on disk
+        plotangles, plotintensities = specmap.preview(angles)
+        plotmap = plotintensities / specmap.maximum
+    else:
+        plotangles, plotmap = angles, normintensities
+    mpl.figure(n, figsize = (10,8)) 
+    intemap = mpl.contourf(plotangles,wavelength,plotmap.T,50,cmap=mpl.cm.jet)
+    mpl.title('Normalised Intensity over all Angles and Wavelengths\n', fontsize=20)
+    mpl.xlabel('Angle (degrees)', fontsize=20)
+    mpl.ylabel('Wavelength (nm)', fontsize=20)
+    mpl.colorbar(intemap)
+    mpl.tick_params(axis='both', labelsize=20)
+    mpl.savefig(os.path.join(processdirectory, sample+'_map.png'), dpi = 500)
+     
+    # Plotting perpendicular spectrum
+    mpl.figure(n+1, figsize = (16,9))    
+    mpl.plot(wavelength, perp_intensity, linewidth = 1.0, label = "Angle"+str(angle))
+    mpl.title('Perpendicular Spectrum\n', fontsize=20)
+    mpl.xlabel('Wavelength (nm)', fontsize=20)
+    mpl.xlim(400,800) # this limits the x-range displayed,view full range before cutting down
+    mpl.ylabel('Intensity (W/nm/sr)', fontsize=20)
+    mpl.minorticks_on()
+    mpl.grid(True, which='major', color='0.5')
+    mpl.grid(True, which='minor', color='0.8')
+    mpl.tick_params(axis='both', labelsize=14)
+    mpl.savefig(os.path.join(processdirectory, sample+'_perpspec.png'), dpi = 500)
+    
+    # Plotting a combined graph of spectra at every angle
+    for i, angle in enumerate(plotangles if chunked else angles):
+        mpl.figure(n+2, figsize = (16,9))    
+        mpl.plot(wavelength, plotintensities[i] if chunked else ints[angle], linewidth = 1.0, label = "Angle"+str(angle))
+        mpl.title('Angular Dependence of Spectra\n', fontsize=20)
         mpl.xlabel('Wavelength (nm)', fontsize=20)
         mpl.xlim(400,800) # this limits the x-range displayed,view full range before cutting down
         mpl.ylabel('Intensity (W/nm/sr)', fontsize=20)
         mpl.minorticks_on()
         mpl.grid(True, which='major', color='0.5')
         mpl.grid(True, which='minor', color='0.8')
-        mpl.tick_params(axis='both', labelsize=14)
-        mpl.savefig(os.path.join(processdirectory, sample+'_perpspec.png'), dpi = 500)
-        
-        # Plotting a combined graph of spectra at every angle
-        for angle in angles:
-            mpl.figure(n+2, figsize = (16,9))    
-            mpl.plot(wavelength, ints[angle], linewidth = 1.0, label = "Angle"+str(angle))
-            mpl.title('Angular Dependence of Spectra\n', fontsize=20)
-            mpl.xlabel('Wavelength (nm)', fontsize=20)
-            mpl.xlim(400,800) # this limits the x-range displayed,view full range before cutting down
-            mpl.ylabel('Intensity (W/nm/sr)', fontsize=20)
-            mpl.minorticks_on()
-            mpl.grid(True, which='major', color='0.5')
-            mpl.grid(True, which='minor', color='0.8')
-        mpl.tick_params(axis='both', labelsize=14)
-        mpl.savefig(os.path.join(processdirectory, sample+'_spec.png'), dpi = 500)
+    mpl.tick_params(axis='both', labelsize=14)
+    mpl.savefig(os.path.join(processdirectory, sample+'_spec.png'), dpi = 500)
+    profiler.stage('export')
+    if chunked: # written from the map on disk in blocks
+        specmap.save_specdatafull(os.path.join(processdirectory,sample+'_specdatafull.txt'), angles, wavelength, header_lines2)
+        specmap.save_specdata(os.path.join(processdirectory,sample+'_specdata.txt'), wavelength)
+        if columnar_directory is not None:
+            columnar_export.save_map(columnar_directory, sample, datetime, wavelength,
+                                     ((angles[start:stop], specmap.normalised(start, stop)) for start, stop in specmap.rows()))
+        del plotintensities, plotmap
+        specmap.close()
+    else:
         np.savetxt(os.path.join(processdirectory,sample+'_specdatafull.txt'), intensitydata.T, fmt='%.6f', delimiter='\t', header='\n'.join(header_lines2), comments='')
         s = open(os.path.join(processdirectory,sample+'_specdata.txt'), 'w')
         for w in wavelength:
@@ -483,77 +639,230 @@ for sample in os.listdir(batch):
         s.close()
         s = open(os.path.join(processdirectory,sample+'_specdata.txt'), 'r')
         s.close()  
-         
-        # Plotting Lambertian emission against Actual Emission
-        mpl.figure(n+3, figsize = (10,8)) 
-        mpl.plot(angles[5:-3], Inonlam[5:-3], linewidth = 1.0, label = "Actual Emission") # Actual
-        mpl.plot(angles[5:-3], Inonlam_v[5:-3], linewidth = 1.0, label = "Actual Emission_v") # Actual
-        mpl.plot(angles[5:-3], Ilam[5:-3], linewidth = 1.0, label = "Lambertian Emission") # Lambertian
-        mpl.title('Lambertian Emission vs Actual Emission\n', fontsize=20)
-        mpl.xlabel('Angle (degrees)', fontsize=20)
-        mpl.ylabel('Intensity (a.u.)', fontsize=20)
-        mpl.legend(loc='upper right', fontsize=14)
-        mpl.tick_params(axis='both', labelsize=14)
-        mpl.xlim(-90,90)
-        mpl.savefig(os.path.join(processdirectory, sample+'_lam.png'), dpi = 500)
-        np.savetxt(os.path.join(processdirectory,sample+'_lamdata.txt'), lamdata.T, fmt='%.2f %.4f %.4f %.4f', delimiter='\t', header='\n'.join(header_lines3), comments='')
-        
-        # IVL Graph
-        mpl.figure(n+4, figsize = (10,8)) 
-        mpl.title('IVL Characteristics\n', fontsize=20)
-        fig,ax1 = mpl.subplots(figsize = (10,8))
-        ax1.semilogy(OLEDvoltage, dataeff_LAM[3],'b', linewidth = 1.0, label = "Current Density") # Lambertian
-        ax1.set_ylabel('Current Density (mA/cm$^2$)', color='b', fontsize=20)                                                            
-        ax1.set_xlabel('Voltage (V)', fontsize=20)
-        ax1.set_xlim(0,4)
-        ax1.set_ylim(10e-7,10e2)
-        ax2 = ax1.twinx()        
-        ax2.semilogy(OLEDvoltage, dataeff_LAM[4],'r-', linewidth = 1.0, label = "Lambertian Lum") # Lambertian
-        ax2.set_ylabel('Luminance (cd/m$^2$)', color='r', fontsize=20) 
-        ax2.set_ylim(10e-1,10e4)
-        ax1.legend(loc='upper left', fontsize=14)
-        ax2.legend(loc='upper right', fontsize=14)
-        ax1.tick_params(axis='both', labelsize=14)   
-        ax2.tick_params(axis='both', labelsize=14)            
-        mpl.savefig(os.path.join(processdirectory, sample+'_ivl.png'), dpi = 500)
-        
-        # EQE Graph
-        mpl.figure(n+5, figsize = (10,8)) 
-        mpl.title('EQE and LE\n', fontsize=20)
-        fig,ax1 = mpl.subplots(figsize = (10,8))
-        ax1.semilogx(dataeff_NONLAM[4], dataeff_NONLAM[5],'b', linewidth = 1.0, label = "Actual EQE") # Actual
-        ax1.semilogx(dataeff_LAM[4], dataeff_LAM[5],'b-', dashes=[6, 2], linewidth = 1.0, label = "Lambertian EQE") # Lambertian
-        ax1.set_ylabel('EQE (%)', color='b', fontsize=20)                                                            
-        ax1.set_xlabel('Luminance (cd/m$^2$)', fontsize=20)
-        ax1.set_xlim(10e0,10e3)
-        ax2 = ax1.twinx()
-        ax2.semilogx(dataeff_NONLAM[4], dataeff_NONLAM[6],'r', linewidth = 1.0, label = "Actual LE") # Actual
-        ax2.semilogx(dataeff_LAM[4], dataeff_LAM[6],'r-', dashes=[6, 2], linewidth = 1.0, label = "Lambertian LE") # Lambertian
-        ax2.set_ylabel('Luminous Efficiency (lm/W)', color='r', fontsize=20) 
-        ax1.legend(loc='upper left', fontsize=14)
-        ax2.legend(loc='upper right', fontsize=14)
-        ax1.tick_params(axis='both', labelsize=14)   
-        ax2.tick_params(axis='both', labelsize=14)    
-        mpl.savefig(os.path.join(processdirectory, sample+'_eqe.png'), dpi = 500)
-        
-        # Densities Graph
-        mpl.figure(n+6, figsize = (10,8)) 
-        fig,ax1 = mpl.subplots(figsize = (10,8))
-        ax1.plot(dataeff_LAM[3], dataeff_LAM[7],'b', linewidth = 1.0, label = "CE") # Lambertian
-        ax1.set_ylabel('Current Efficiency (cd/A)', color='b', fontsize=20)                              
-        ax1.set_xlabel('Current Density (mA/cm$^2$)', fontsize=20)                                 
-        ax2 = ax1.twinx() 
-        ax2.plot(dataeff_NONLAM[3], dataeff_NONLAM[8],'r', linewidth = 1.0, label = "Actual PD") # Actual
-        ax2.plot(dataeff_LAM[3], dataeff_LAM[8],'r-',  dashes=[6, 2], linewidth = 1.0, label = "Lambertian PD") # Lambertian
-        ax2.set_ylabel('Power Density (mW/mm$^2$)', color='r', fontsize=20)     
-        ax1.legend(loc='upper left', fontsize=14)
-        ax2.legend(loc='upper right', fontsize=14)
-        ax1.tick_params(axis='both', labelsize=14)   
-        ax2.tick_params(axis='both', labelsize=14)    
-        mpl.savefig(os.path.join(processdirectory, sample+'_density.png'), dpi = 500)
-               
-        # Saving efficiency data
-        np.savetxt(os.path.join(processdirectory,sample+'_effdata_NONLAM.txt'), dataeff_NONLAM.T, fmt='{: ^8}'.format('%.6e'), header='\n'.join(header_lines), comments='')
-        np.savetxt(os.path.join(processdirectory,sample+'_effdata_LAM.txt'), dataeff_LAM.T, fmt='{: ^8}'.format('%.6e'), header='\n'.join(header_lines), comments='')
-
-        print "FINISHED." 
\ No newline at end of file
+        if columnar_directory is not None:
+            columnar_export.save_map(columnar_directory, sample, datetime, wavelength, [(angles, normintensities)])
+     
+    # Plotting Lambertian emission against Actual Emission
+    profiler.stage('figures')
+    mpl.figure(n+3, figsize = (10,8)) 
+    mpl.plot(angles[5:-3], Inonlam[5:-3], linewidth = 1.0, label = "Actual Emission") # Actual
+    mpl.plot(angles[5:-3], Inonlam_v[5:-3], linewidth = 1.0, label = "Actual Emission_v") # Actual
+    mpl.plot(angles[5:-3], Ilam[5:-3], linewidth = 1.0, label = "Lambertian Emission") # Lambertian
+    mpl.title('Lambertian Emission vs Actual Emission\n', fontsize=20)
+    mpl.xlabel('Angle (degrees)', fontsize=20)
+    mpl.ylabel('Intensity (a.u.)', fontsize=20)
+    mpl.legend(loc='upper right', fontsize=14)
+    mpl.tick_params(axis='both', labelsize=14)
+    mpl.xlim(-90,90)
+    mpl.savefig(os.path.join(processdirectory, sample+'_lam.png'), dpi = 500)
+    profiler.stage('export')
+    np.savetxt(os.path.join(processdirectory,sample+'_lamdata.txt'), lamdata.T, fmt='%.2f %.4f %.4f %.4f', delimiter='\t', header='\n'.join(header_lines3), comments='')
+    colorimetry.save_colour_table(os.path.join(processdirectory,sample+'_colordata.txt'), colour, header_lines3[:12])
+    
+    # IVL Graph
+    profiler.stage('figures')
+    mpl.figure(n+4, figsize = (10,8)) 
+    mpl.title('IVL Characteristics\n', fontsize=20)
+    fig,ax1 = mpl.subplots(figsize = (10,8))
+    ax1.semilogy(OLEDvoltage, dataeff_LAM[3],'b', linewidth = 1.0, label = "Current Density") # Lambertian
+    ax1.set_ylabel('Current Density (mA/cm$^2$)', color='b', fontsize=20)                                                            
+    ax1.set_xlabel('Voltage (V)', fontsize=20)
+    ax1.set_xlim(0,4)
+    ax1.set_ylim(10e-7,10e2)
+    ax2 = ax1.twinx()        
+    ax2.semilogy(OLEDvoltage, dataeff_LAM[4],'r-', linewidth = 1.0, label = "Lambertian Lum") # Lambertian
+    ax2.set_ylabel('Luminance (cd/m$^2$)', color='r', fontsize=20) 
+    ax2.set_ylim(10e-1,10e4)
+    ax1.legend(loc='upper left', fontsize=14)
+    ax2.legend(loc='upper right', fontsize=14)
+    ax1.tick_params(axis='both', labelsize=14)   
+    ax2.tick_params(axis='both', labelsize=14)            
+    mpl.savefig(os.path.join(processdirectory, sample+'_ivl.png'), dpi = 500)
+    
+    # EQE Graph
+    mpl.figure(n+5, figsize = (10,8)) 
+    mpl.title('EQE and LE\n', fontsize=20)
+    fig,ax1 = mpl.subplots(figsize = (10,8))
+    ax1.semilogx(dataeff_NONLAM[4], dataeff_NONLAM[5],'b', linewidth = 1.0, label = "Actual EQE") # Actual
+    ax1.semilogx(dataeff_LAM[4], dataeff_LAM[5],'b-', dashes=[6, 2], linewidth = 1.0, label = "Lambertian EQE") # Lambertian
+    ax1.set_ylabel('EQE (%)', color='b', fontsize=20)                                                            
+    ax1.set_xlabel('Luminance (cd/m$^2$)', fontsize=20)
+    ax1.set_xlim(10e0,10e3)
+    ax2 = ax1.twinx()
+    ax2.semilogx(dataeff_NONLAM[4], dataeff_NONLAM[6],'r', linewidth = 1.0, label = "Actual LE") # Actual
+    ax2.semilogx(dataeff_LAM[4], dataeff_LAM[6],'r-', dashes=[6, 2], linewidth = 1.0, label = "Lambertian LE") # Lambertian
+    ax2.set_ylabel('Luminous Efficiency (lm/W)', color='r', fontsize=20) 
+    ax1.legend(loc='upper left', fontsize=14)
+    ax2.legend(loc='upper right', fontsize=14)
+    ax1.tick_params(axis='both', labelsize=14)   
+    ax2.tick_params(axis='both', labelsize=14)    
+    mpl.savefig(os.path.join(processdirectory, sample+'_eqe.png'), dpi = 500)
+    
+    # Densities Graph
+    mpl.figure(n+6, figsize = (10,8)) 
+    fig,ax1 = mpl.subplots(figsize = (10,8))
+    ax1.plot(dataeff_LAM[3], dataeff_LAM[7],'b', linewidth = 1.0, label = "CE") # Lambertian
+    ax1.set_ylabel('Current Efficiency (cd/A)', color='b', fontsize=20)                              
+    ax1.set_xlabel('Current Density (mA/cm$^2$)', fontsize=20)                                 
+    ax2 = ax1.twinx() 
+    ax2.plot(dataeff_NONLAM[3], dataeff_NONLAM[8],'r', linewidth = 1.0, label = "Actual PD") # Actual
+    ax2.plot(dataeff_LAM[3], dataeff_LAM[8],'r-',  dashes=[6, 2], linewidth = 1.0, label = "Lambertian PD") # Lambertian
+    ax2.set_ylabel('Power Density (mW/mm$^2$)', color='r', fontsize=20)     
+    ax1.legend(loc='upper left', fontsize=14)
+    ax2.legend(loc='upper right', fontsize=14)
+    ax1.tick_params(axis='both', labelsize=14)   
+    ax2.tick_params(axis='both', labelsize=14)    
+    mpl.savefig(os.path.join(processdirectory, sample+'_density.png'), dpi = 500)
+    mpl.close('all') # figures are numbered, they would otherwise collect the curves of the next run
+           
+    # Saving efficiency data
+    profiler.stage('export')
+    np.savetxt(os.path.join(processdirectory,sample+'_effdata_NONLAM.txt'), dataeff_NONLAM.T, fmt='{: ^8}'.format('%.6e'), header='\n'.join(header_lines), comments='')
+    np.savetxt(os.path.join(processdirectory,sample+'_effdata_LAM.txt'), dataeff_LAM.T, fmt='{: ^8}'.format('%.6e'), header='\n'.join(header_lines), comments='')
+
+    # Confidence bands of the efficiency data from the tolerances of the inputs (see uncertainty.py)
+    bands = {}
+    if uncertainty_samples > 0:
+        profiler.stage('uncertainty')
+        print "Calculating confidence bands..."
+        samples = uncertainty.draw_samples({'oled_area': OLEDarea, 'distance': distance, 'pd_area': PDarea,
+                                            'pd_resistance': PDresis, 'pd_cutoff': PDcutoff}, uncertainty_samples)
+        integrals = uncertainty.tilted_integrals(perp_intensity, np.array(projections), np.arange(min_index,max_index,step_angle),
+                                                 step_angle, wavelength, Vlambda, Rlambda, samples['calibration_tilt'])
+        for name, lambertian in (('NONLAM', False), ('LAM', True)):
+            bands[name] = uncertainty.confidence_bands(uncertainty.efficiency(samples, OLEDvoltage, OLEDcurrent, PDvoltage, integrals, lambertian))
+            uncertainty.save_bands(os.path.join(processdirectory,sample+'_effdata_'+name+'_bands.txt'), OLEDvoltage, bands[name], header_lines[:11], uncertainty_samples)
+
+    # Summary of the run for the results index and the columnar outputs
+    profiler.stage('index')
+    summary = {'sample': sample, 'datetime': datetime, 'analysis_time': start_time,
+               'oled_area': OLEDarea, 'distance': distance, 'pd_area': PDarea,
+               'pd_resistance': PDresis, 'pd_cutoff': PDcutoff,
+               'peak_eqe': results_index.peak(dataeff_NONLAM[5]), 'peak_eqe_lam': results_index.peak(dataeff_LAM[5]),
+               'peak_le': results_index.peak(dataeff_NONLAM[6]), 'peak_ce': results_index.peak(dataeff_NONLAM[7]),
+               'peak_lum': results_index.peak(dataeff_NONLAM[4]),
+               'cie_x': CIE[0], 'cie_y': CIE[1], 'lambda_max': lambdamax,
+               'efactor': eFACTOR, 'vfactor': vFACTOR,
+               'process_directory': processdirectory, 'files': os.listdir(processdirectory)}
+
+    # Typed columnar outputs partitioned by sample and date (see columnar_export.py)
+    if columnar_directory is not None:
+        columnar_export.save_tables(columnar_directory, summary, dataeff_NONLAM, dataeff_LAM, lamdata)
+
+    # Adding the run to the results index
+    if index is not None:
+        results_index.upsert_run(index, summary)
+    profiler.stop()
+
+    print "FINISHED."
+    return {'sample': sample, 'datetime': datetime, 'processdirectory': processdirectory,
+            'dataeff_LAM': dataeff_LAM, 'dataeff_NONLAM': dataeff_NONLAM, 'lamdata': lamdata,
+            'eFACTOR': eFACTOR, 'vFACTOR': vFACTOR, 'CIE': CIE, 'lambdamax': lambdamax, 'colour': colour,
+            'bands_NONLAM': bands.get('NONLAM'), 'bands_LAM': bands.get('LAM'), 'summary': summary,
+            'source_current': 1e3 * float(np.mean(OLEDcurrent_spec)), 'source_voltage': float(np.mean(OLEDvoltage_spec))}
+
+"ANALYSIS OF A RUN WITH SEVERAL SETPOINTS"
+def rolloff_corrected(current, setpoint_currents, tables):
+    """
+    Efficiency data in which every point uses the analysis of its current, interpolated by log current between the
+    setpoints (the lowest and highest setpoint below and above them).
+
+    current: numpy.ndarray
+        current of every point of the IVL scan in mA.
+    setpoint_currents: list of float
+        current of every setpoint in mA.
+    tables: list of numpy.ndarray
+        efficiency data (columns x points) analysed with the spectra of every setpoint.
+
+    returns:
+        corrected: numpy.ndarray
+    """
+    order = np.argsort(np.abs(setpoint_currents))
+    logs = np.log(np.maximum(np.abs(np.asarray(setpoint_currents, dtype=float)[order]), 1e-30))
+    stack = np.array([tables[k] for k in order]) # setpoints x columns x points
+    position = np.interp(np.log(np.maximum(np.abs(current), 1e-30)), logs, np.arange(len(logs), dtype=float))
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, len(logs) - 1)
+    weight = (position - lower)[:, np.newaxis]
+    points = np.arange(stack.shape[2])
+    return ((1 - weight) * stack[lower, :, points] + weight * stack[upper, :, points]).T
+
+def analyse_setpoints(sample, datetime, datadirectory=datadirectory, index=None, uncertainty_samples=uncertainty_samples,
+                      memory_limit=memory_limit, columnar_directory=columnar_directory, denoise_rank=denoise_rank, profiler=None):
+    """
+    Analyse a run with several setpoints per angle: every setpoint into 'processedEL'/'setpoint<k>', the setpoint table
+    and the roll-off corrected efficiency data into 'processedEL'. The parameters are those of analyse_run().
+
+    returns:
+        results: dict
+            roll-off corrected 'dataeff_NONLAM' and 'dataeff_LAM', 'current' of every setpoint (mA) and the results
+            of analyse_run() of every setpoint in 'setpoints'.
+    """
+    rawdirectory = os.path.abspath(os.path.join(datadirectory, sample, datetime, 'raw'))
+    values = GoniometerRun(rawdirectory).setpoints
+    setpoints = []
+    for k in range(1, len(values) + 1):
+        print "\nSETPOINT " + str(k) + " OF " + str(len(values)) + " :   " + str(values[k - 1])
+        # the results index and the columnar tables get the corrected efficiencies below
+        setpoints.append(analyse_run(sample, datetime, datadirectory, None, uncertainty_samples, memory_limit, None, denoise_rank, setpoint=k,
+                                     profiler=profiler))
+    if profiler is None:
+        profiler = stage_profiler.NO_PROFILER
+    profiler.run(sample + ' ' + datetime)
+    profiler.stage('setpoints')
+    processdirectory = os.path.abspath(os.path.join(datadirectory, sample, datetime, 'processedEL'))
+    currents = [result['source_current'] for result in setpoints]
+
+    # Angular emission and colour of every setpoint
+    table = np.array([[k + 1, values[k], result['source_current'], result['source_voltage'], result['eFACTOR'], result['vFACTOR'],
+                       result['CIE'][0], result['CIE'][1], result['lambdamax']] for k, result in enumerate(setpoints)])
+    header_lines = ['Measurement code : ' + sample + datetime, 'Calculation programme :	NonLamLIV-EQE.py',
+                    'Source values measured at every angle, the angular emission and the perpendicular spectrum of every setpoint',
+                    'Setpoint   Source      Current      Voltage    eFACTOR    vFACTOR    CIE_x    CIE_y    lambda_max',
+                    '-          A or V      mA           V          -          -          -        -        nm']
+    np.savetxt(os.path.join(processdirectory, sample + '_setpoints.txt'), table, fmt='%d %.4e %.4e %.4f %.5f %.5f %.4f %.4f %.1f',
+               delimiter='\t', header='\n'.join(header_lines), comments='')
+
+    # Efficiency data with the angular emission of the current of every point
+    corrected = {}
+    for name in ('NONLAM', 'LAM'):
+        corrected[name] = rolloff_corrected(setpoints[0]['dataeff_' + name][1], currents, [result['dataeff_' + name] for result in setpoints])
+        effheader = ['Measurement code : ' + sample + datetime, 'Calculation programme :	NonLamLIV-EQE.py',
+                     'Roll-off corrected: every point with the analysis of its current, interpolated by log current between ' + str(len(values)) + ' setpoints',
+                     '### Formatted data ###',
+                     'V            I           J         Abs(J)        L         EQE        LE         CE        PoD',
+                     'V            mA       mA/cm2      mA/cm2       cd/m2        %        lm/W        cd/A      mW/mm2']
+        np.savetxt(os.path.join(processdirectory, sample + '_effdata_' + name + '.txt'), corrected[name].T, fmt='{: ^8}'.format('%.6e'),
+                   header='\n'.join(effheader), comments='')
+
+    # Summary with the corrected efficiencies, the colour and eFACTOR/vFACTOR of the first setpoint
+    summary = dict(setpoints[0]['summary'])
+    summary.update({'peak_eqe': results_index.peak(corrected['NONLAM'][5]), 'peak_eqe_lam': results_index.peak(corrected['LAM'][5]),
+                    'peak_le': results_index.peak(corrected['NONLAM'][6]), 'peak_ce': results_index.peak(corrected['NONLAM'][7]),
+                    'peak_lum': results_index.peak(corrected['NONLAM'][4]),
+                    'process_directory': processdirectory, 'files': os.listdir(processdirectory)})
+    if columnar_directory is not None and columnar_export.available():
+        columnar_export.save_tables(columnar_directory, summary, corrected['NONLAM'], corrected['LAM'], setpoints[0]['lamdata'])
+    if index is not None:
+        results_index.upsert_run(index, summary)
+    profiler.stop()
+
+    print "FINISHED " + str(len(values)) + " SETPOINTS."
+    return {'sample': sample, 'datetime': datetime, 'processdirectory': processdirectory,
+            'dataeff_NONLAM': corrected['NONLAM'], 'dataeff_LAM': corrected['LAM'], 'current': currents,
+            'setpoints': setpoints, 'summary': summary}
+
+"ANALYSING ALL RUNS IN THE BATCH FOLDER"
+if __name__ == '__main__':
+    batch = os.path.abspath(os.path.join(datadirectory, 'batch'))
+    index = results_index.connect() # summary row of every analysed run, see results_index.py
+    profiler = stage_profiler.StageProfiler(profile_stages, profile_mode) if profiling else None
+    if profiler is not None:
+        profiler.add(None, 'library', library_load)
+    print os.listdir(batch)
+    for sample in os.listdir(batch):
+        for datetime in os.listdir(os.path.abspath(os.path.join(batch, sample))):
+            analyse_run(sample, datetime, index=index, profiler=profiler)
+    if profiler is not None:
+        print "\n" + profiler.summary()
+        print "Profile saved to " + profiler.save()
@@ -5,6 +5,10 @@ created by GatherLab
 This is the code for the EL and PL measurements. It is used for measurement only, 
 analysis will be performed using according codes.
 
+The EL and the PL stage can be measured at the same time: every tab has its own parameters, and a started measurement
+runs as its own task (ELTASK, PLTASK) with a snapshot of these parameters, its own stop flag, output queue and motor.
+The spectrometer is shared by both stages and is used by one of them at a time (see shared_spectrometer.py).
+
 requires a 'data' folder
 
 the serial number of the Keithley sourcemeter (2400series) is 04102170 --> keith_address = u'USB0::0x05E6::0x2450::04102170::INSTR'
@@ -24,19 +28,39 @@ The default values for the parameters in this code are
 			0.5V # min_step_voltage 
             0.5V # max_step_voltage 
 			1.05A  # scan_compliance
+			0.1 %  # photodiode noise target, the multimeter range, NPLC and number of averaged readings are chosen for
+			         every point from the signal (0 for 10V range, 1 NPLC, one reading; see photodiode_policy.py)
         'Current'  # as source for angle-resolved measurement, voltage works as well
+        1 mA # source value, several comma-separated values (e.g. 0.001,0.002,0.005) are all measured at every angle
+               of one sweep (Step, see below)
 		 5V # goniometer_compliance
+        'Step' # scan mode (stop and go), 'Fly' rotates continuously while streaming spectra (see flyscan.py),
+                 'Lifetime' records the perpendicular spectrum and photodiode signal at constant current (EL, see lifetime.py),
+                 'Align' finds the normal around the entered offset angle from the symmetry of the emission and keeps it
+                 as the offset angle of the tab for the session (see alignment.py)
+        24 h # lifetime duration
+        'Raw' # spectra with all pixels, 'ROI' crops to 400-800nm, 'Bin' crops and bins 4 pixels, 'Grid' interpolates onto
+                the 1nm axis of the analysis (see spectral_roi.py)
+        'Software' # pulse mode, 'Triggered' lets the sourcemeter time the pulse around one integration (see pulse_timing.py)
+        0 % # target error, above 0 the sweep is repeated into the same run folder until the relative error of the
+              integrated intensity is below the target (at most 20 sweeps), and the average is saved (see sweep_statistics.py)
 		   
 The output of this program is:    
     - creates a folder with sample name (could '190812 S23D1', 'S42D1',...)
 		- creates a 'datetime' folder
 			   - creates a 'raw' folder
+				   - with a 'journal.jsonl' of the completed angles (stop and go, single sweep): a sweep that was interrupted
+				     (crash, USB or motor problem) is resumed into the same folder when it is started again with the same
+				     settings, after the dark frame and the perpendicular intensity were checked for drift (see run_journal.py)
 				   - creates a 'keithleydata' and 'spectrumdata' folder
 				      - in 'keithleydata' there should be the files: keithleyOLEDvoltages.txt, keithleyPDvoltages.txt, specifickeithleyPDvoltages.txt
 					  For ANALYSIS especially the keithleyPDvoltages.txt file can be copied into the folder as a PD measurement might not be needed for every single device
 					  BUT make sure the measurement code (first header line) is adjusted to the one from keithleyOLEDvoltages.
 					  - in 'spectrumdata' there should be the text files (depending on your recodring choice) from Angle-90.txt over Angle0.txt to Angle90.txt
 					  AND a background file (all recorded within the run)
+				   - with several source values: a 'setpoints.txt' and a 'setpoint1', 'setpoint2', ... folder for every value, each
+				     with the Angle_.txt files in 'spectrumdata' and the keithleyOLEDvoltages.txt in 'keithleydata' (the
+				     background and the photodiode scan stay in 'spectrumdata' and 'keithleydata', see goniometer_run.py)
 
 Important parameters for later analysis:    
     - distance PD to OLED: fixed in EL setup to 0.115m
@@ -81,7 +105,30 @@ import matplotlib.pyplot as mpl
 import matplotlib.figure as mplfig
 import matplotlib.backends.backend_tkagg as tkagg
 import threading
-import Queue
+# Continuous-rotation acquisition
+import flyscan
+# SMU-timed pulses
+import pulse_timing
+# Averaging of repeated sweeps
+import sweep_statistics
+# One spectrometer for both stages
+import shared_spectrometer
+# Lifetime measurement
+import lifetime
+# Spectral region of interest and binning at acquisition
+import spectral_roi
+# Resuming interrupted sweeps
+import run_journal
+# Multimeter setting for every photodiode reading
+import photodiode_policy
+# Typed events from the measurement threads to the GUI
+import event_channel
+# Overlapping calls to different instruments
+import instrument_executor
+# Automatic normal-incidence alignment
+import alignment
+# Raw data folders of the setpoints, completion marker of a run
+import goniometer_run
 
 "HARDWARE SETUP"
 # ThorLabs plugs into port directly
@@ -99,10 +146,6 @@ import Queue
 
 "ALWAYS QUIT THE GUI WINDOW BEFORE RESTARTING KERNAL OR CLOSING PYTHON"
 "OTHERWISE THE DLL FOR THE MOTOR CAN'T BE LOADED WITHOUT CAUSING A FATAL ERROR"
-param = {}
-for x in range(0,18):
-    param[x] = ''
-running = False
 
 # Loads spectrometer and motor devices
 class DEVICES:
@@ -123,6 +166,39 @@ class DEVICES:
         spec = sb.Spectrometer(MAYA_devices[0]) # initialise the spectrometer
     except:
         pass
+    spectrometer = shared_spectrometer.SharedSpectrometer(spec) # EL and PL stage take turns on the spectrometer
+
+def relative_angle(angle, offset_angle, ang_range):
+    """
+    Angle of the sample for a motor angle; it is written as 0 -> 180 rather than -90 -> 90 for the full range.
+    """
+    if ang_range == 'F':
+        return angle + 90 - offset_angle
+    elif ang_range == 'HL':
+        return angle - offset_angle
+    elif ang_range == 'HR':
+        return offset_angle - angle
+
+def save_angle(filename, spectrum, fmt, header_lines, journal=None, record=None):
+    """
+    Write the spectrum file of one angle, then its journal record (runs on the 'Data files' worker; the record is only
+    written once the file is, so a resumed sweep never skips an angle without its file).
+    """
+    np.savetxt(filename, spectrum.T, fmt=fmt, delimiter='\t', header='\n'.join(header_lines), comments='')
+    if journal is not None:
+        journal.angle(**record)
+
+def report_alignment(queue, result):
+    """
+    Levels, intensity profile and normal of an alignment (see alignment.py); the GUI takes the normal as offset angle.
+    """
+    if result is None:
+        queue.warning('\nALIGNMENT STOPPED, THE OFFSET ANGLE IS UNCHANGED')
+        return
+    for step, centre, value in result['levels']:
+        queue.progress('Step ' + str(step) + ' deg :  normal at ' + '%.2f' % centre + ',  asymmetry ' + '%.2e' % value)
+    queue.spectrum(result['angles'], result['signal'], {'title': 'Alignment', 'xlabel': 'Motor angle (degrees)', 'ylabel': 'Integrated intensity'})
+    queue.reading('Aligned offset angle', round(result['offset'], 2), 'deg', prefix='\n')
 
 "#####################################################################"
 "###############################GUI CODE##############################"
@@ -141,9 +217,11 @@ class GUI:
         
         "CONFIGURING LAYOUT AND PARAMETERS"  
         self.printcount = 0 
-        self.graphcount = 0
         self.prints = {}        
-        self.graphs = {}
+        self.graphs = {} # last spectrum plot of every tab
+        self.params = {} # parameters entered in every tab
+        self.tasks = {} # running measurement of every tab
+        self.offset_labels = {} # offset angle label of every tab, shows the result of an alignment
         for x in range(0,16,1):
             self.root.grid_rowconfigure(x, minsize=10, weight=1)
         for x in range(0,16,1):    
@@ -153,6 +231,10 @@ class GUI:
     def add_tab(self,title,widgets):   
         
         "WRITING THE MAIN GUI INTERFACE"
+        param = {}
+        for x in range(0,25):
+            param[x] = ''
+        self.params[title] = param
         tab = ttk.Frame(self.notebook) 
         self.notebook.add(tab, text=title)   # Creating a tab and adding it to the GUI
         
@@ -209,7 +291,7 @@ class GUI:
             # Tab specific measurement button specified here
             self.button_paneEL = ttk.LabelFrame(tab)
             self.button_paneEL.grid(column=1, row=14, columnspan=6, sticky="nsew") 
-            self.start_buttonEL = tk.Button(self.button_paneEL, text="Run Measurement", command=self.start) 
+            self.start_buttonEL = tk.Button(self.button_paneEL, text="Run Measurement", command=lambda: self.start(title)) 
             self.start_buttonEL.grid(column=6, row=14, sticky="nsew", padx=10)               
 
         
@@ -231,7 +313,7 @@ class GUI:
             # Tab specific measurement button specified here
             self.button_panePL = ttk.LabelFrame(tab)
             self.button_panePL.grid(column=1, row=14, columnspan=6, sticky="nsew") 
-            self.start_buttonPL = tk.Button(self.button_panePL, text="Run Measurement", command=self.start) 
+            self.start_buttonPL = tk.Button(self.button_panePL, text="Run Measurement", command=lambda: self.start(title)) 
             self.start_buttonPL.grid(column=6, row=14, sticky="nsew", padx=10)               
 
         for widget in widgets:           
@@ -245,14 +327,14 @@ class GUI:
                     param[1] = param1.get()
                     entered = 'Offset angle  :  ' + param[1]
                     param_text1.configure(text=entered) 
-                    current_tab = gui.notebook.tab(gui.notebook.select(),"text")
-                    if current_tab == 'EL Measurement':
+                    if title == 'EL Measurement':
                         DEVICES.ELmotor.move_to(float(param[1])+90)
-                    elif current_tab == 'PL Measurement':
+                    elif title == 'PL Measurement':
                         DEVICES.PLmotor.move_to(float(param[1])+90)
                     param1.delete(0, 'end') 
                 button1 = tk.Button(pane1, text="Enter", command=enter_param1) 
                 button1.grid(column=3, row=3, sticky="ew", padx=5) 
+                self.offset_labels[title] = param_text1
                 #widget1 = [param_text1,param1,button1]
                 
                 param_text2 = tk.Label(pane1, text="Step angle") 
@@ -319,6 +401,30 @@ class GUI:
                 button6 = tk.Button(pane1, text="Enter", command=enter_param6) 
                 button6.grid(column=6, row=5, sticky="ew", padx=5) 
                 #widget6 = [param_text6,param6,button6]
+                
+                param_text20 = tk.Label(pane1, text="Target error (%)") 
+                param_text20.grid(column=7, row=3, sticky="ew", pady=2) 
+                param20 = tk.Entry(pane1) 
+                param20.grid(column=8, row=3, sticky="ew", padx=5)
+                def enter_param20():
+                    param[20] = param20.get() 
+                    entered = 'Target error (%)  :  ' + param[20]
+                    param_text20.configure(text=entered) 
+                    param20.delete(0, 'end') 
+                button20 = tk.Button(pane1, text="Enter", command=enter_param20) 
+                button20.grid(column=9, row=3, sticky="ew", padx=5) 
+                
+                param_text21 = tk.Label(pane1, text="Max sweeps") 
+                param_text21.grid(column=7, row=4, sticky="ew", pady=2) 
+                param21 = tk.Entry(pane1) 
+                param21.grid(column=8, row=4, sticky="ew", padx=5)
+                def enter_param21():
+                    param[21] = param21.get() 
+                    entered = 'Max sweeps  :  ' + param[21]
+                    param_text21.configure(text=entered) 
+                    param21.delete(0, 'end') 
+                button21 = tk.Button(pane1, text="Enter", command=enter_param21) 
+                button21.grid(column=9, row=4, sticky="ew", padx=5) 
             
             if widget == 2:
                 def command1():
@@ -339,6 +445,55 @@ class GUI:
                 rad2.grid(column=2, row=6, sticky="nsew", padx=5)                  
                 rad3.grid(column=3, row=6, sticky="nsew", padx=5)    
                 #widget6 = [rad1,rad2,rad3]
+                
+                def command18a():
+                    param[18] = 'Step'
+                    
+                def command18b():
+                    param[18] = 'Fly'
+                
+                var18 = tk.IntVar()
+                var18.set(1)
+                rad4 = tk.Radiobutton(pane2, text='Stop and go (Default)', variable=var18, value=1, command=command18a,indicatoron=0) 
+                rad5 = tk.Radiobutton(pane2, text='Fly scan (continuous rotation)', variable=var18, value=2, command=command18b,indicatoron=0)                 
+                rad4.grid(column=4, row=6, sticky="nsew", padx=5)                  
+                rad5.grid(column=5, row=6, sticky="nsew", padx=5)                  
+                
+                if title == 'EL Measurement':
+                    def command18c():
+                        param[18] = 'Lifetime'
+                    
+                    rad6 = tk.Radiobutton(pane2, text='Lifetime (perpendicular)', variable=var18, value=3, command=command18c,indicatoron=0)                 
+                    rad6.grid(column=6, row=6, sticky="nsew", padx=5)                  
+                
+                def command18d():
+                    param[18] = 'Align'
+                
+                rad11 = tk.Radiobutton(pane2, text='Align normal', variable=var18, value=4, command=command18d,indicatoron=0)                 
+                rad11.grid(column=7, row=6, sticky="nsew", padx=5)                  
+                
+                def command23a():
+                    param[23] = 'Raw'
+                    
+                def command23b():
+                    param[23] = 'ROI'
+                    
+                def command23c():
+                    param[23] = 'Bin'
+                    
+                def command23d():
+                    param[23] = 'Grid'
+                
+                var23 = tk.IntVar()
+                var23.set(1)
+                rad7 = tk.Radiobutton(pane2, text='All pixels (Default)', variable=var23, value=1, command=command23a,indicatoron=0) 
+                rad8 = tk.Radiobutton(pane2, text='Crop 400-800nm', variable=var23, value=2, command=command23b,indicatoron=0)                 
+                rad9 = tk.Radiobutton(pane2, text='Crop and bin 4 pixels', variable=var23, value=3, command=command23c,indicatoron=0)                 
+                rad10 = tk.Radiobutton(pane2, text='Analysis grid 400-800nm (1nm)', variable=var23, value=4, command=command23d,indicatoron=0)                 
+                rad7.grid(column=1, row=7, sticky="nsew", padx=5)                  
+                rad8.grid(column=2, row=7, sticky="nsew", padx=5)                  
+                rad9.grid(column=3, row=7, sticky="nsew", padx=5)                  
+                rad10.grid(column=4, row=7, sticky="nsew", padx=5)                  
                     
             if widget == 3: 
                 param[8] = 'N'
@@ -424,25 +579,38 @@ class GUI:
                 button14.grid(column=6, row=9, sticky="ew", padx=5)  
                 widget3[6] = [param_text14,param14,button14]
                 
+                param_text24 = tk.Label(pane3, text="Photodiode noise target (%)") 
+                param_text24.grid(column=1, row=10, sticky="ew", pady=2) 
+                param24 = tk.Entry(pane3) 
+                param24.grid(column=2, row=10, sticky="ew", padx=5) 
+                def enter_param24():    
+                    param[24] = param24.get()
+                    entered = 'Photodiode noise target  :  ' + param[24] + ' %'
+                    param_text24.configure(text=entered) 
+                    param24.delete(0, 'end') 
+                button24 = tk.Button(pane3, text="Enter", command=enter_param24) 
+                button24.grid(column=3, row=10, sticky="ew", padx=5)  
+                widget3[7] = [param_text24,param24,button24]
+                
                 if var2.get() == True:
-                    for x in range(1,7):
+                    for x in range(1,8):
                         for entry in widget3[x]:
                             entry.configure(state="normal")
                 
                 if var2.get() == False:                    
-                    for x in range(1,7):
+                    for x in range(1,8):
                                 for entry in widget3[x]:
                                     entry.configure(state="disabled")  
 
                 def show_scan_opt():                   
                     if var2.get() == True:                        
                         param[8] = 'Y' # scan_status
-                        for x in range(1,7):
+                        for x in range(1,8):
                             for entry in widget3[x]:
                                 entry.configure(state="normal")                
                     else: 
                         param[8] = 'N'
-                        for x in range(1,7):
+                        for x in range(1,8):
                             for entry in widget3[x]:
                                 entry.configure(state="disabled")                        
                             
@@ -456,6 +624,20 @@ class GUI:
                 param_text15a.grid(column=1, row=11, sticky="ew", padx=5) 
                 param_text15b = tk.Label(pane4, text="Sense") 
                 param_text15b.grid(column=3, row=11, sticky="ew", padx=5) 
+                
+                param_text22 = tk.Label(pane4, text="Lifetime duration") 
+                param_text22.grid(column=5, row=11, sticky="ew", padx=5) 
+                param22 = tk.Entry(pane4) 
+                param22.grid(column=6, row=11)
+                param_text22a = tk.Label(pane4, text="h") 
+                param_text22a.grid(column=7, row=11, sticky="ew", padx=5) 
+                def enter_param22(): 
+                    param[22] = param22.get()
+                    entered = 'Lifetime duration  :  ' + param[22] 
+                    param_text22.configure(text=entered) 
+                    param22.delete(0, 'end') 
+                button22 = tk.Button(pane4, text="Enter", command=enter_param22) 
+                button22.grid(column=8, row=11, sticky="ew", padx=10) 
                                
                 def command15a():
                     # Selecting current source
@@ -530,80 +712,115 @@ class GUI:
                 param_text17a.grid_forget()
                 param_text17b.grid(column=7, row=13, sticky="E", padx=10)  
                 
-    "FUNCTION TO CHECK FOR OUTPUT FROM MEASUREMENT AND DISPLAY IN GUI"
-    def check_queue(self):               
-        current_tab = gui.notebook.tab(gui.notebook.select(),"text")
-        try: 
-            output = self.queue.get(0)
-            if isinstance(output,str): 
-                if current_tab == 'EL Measurement':
-                    self.scrolling_textEL.insert(tk.INSERT,'\n'+output)
-                    self.scrolling_textEL.see('end')
-                elif current_tab == 'PL Measurement':
-                    self.scrolling_textPL.insert(tk.INSERT,'\n'+output)
-                    self.scrolling_textPL.see('end')
-                self.root.after(1000,self.check_queue)                
-                print output                
-            else: 
+                def command19a():
+                    param[19] = 'Software'
+                    
+                def command19b():
+                    param[19] = 'Triggered'
+                
+                var19 = tk.IntVar()
+                var19.set(1)
+                rad3 = tk.Radiobutton(pane4, text='Software pulse', variable=var19, value=1, command=command19a,indicatoron=0) 
+                rad4 = tk.Radiobutton(pane4, text='SMU-timed pulse', variable=var19, value=2, command=command19b,indicatoron=0)                                  
+                rad3.grid(column=9, row=12, padx=10, sticky="nsew")                  
+                rad4.grid(column=9, row=13, padx=10, sticky="nsew") 
+                
+    "FUNCTION TO CHECK FOR OUTPUT FROM MEASUREMENTS AND DISPLAY IN GUI"
+    def check_queue(self):
+        # Every task has its own event channel, the output goes to the tab of the task independent of the selected tab
+        for title, task in list(self.tasks.items()):
+            events = task.queue.drain() # a batch of events, see event_channel.py
+            for event in events:
+                if event.kind == 'reading' and event.key == 'Aligned offset angle':
+                    # The normal found by the alignment is the offset angle of the tab for the rest of the session
+                    self.params[title][1] = str(event.data[1])
+                    self.offset_labels[title].configure(text='Offset angle  :  ' + self.params[title][1] + '  (aligned)')
+            if not events:
+                if not task.is_alive() and task.queue.empty():
+                    self.finished(title)
+                continue
+            lines = [event.log_text() for event in events if event.log_text() is not None]
+            if lines:
+                if title == 'EL Measurement':
+                    self.append_log(self.scrolling_textEL, lines)
+                elif title == 'PL Measurement':
+                    self.append_log(self.scrolling_textPL, lines)
+                print '\n'.join(lines)
+            spectra = [event for event in events if event.kind == 'spectrum']
+            if spectra: # only the latest graph of the batch is drawn
+                x, y, labels = spectra[-1].data # optional title and axis labels, a spectrum by default
                 fig = mplfig.Figure()
                 a = fig.add_subplot(111)
-                a.plot(output[0],output[1])
-                a.set_title ("Spectrum", fontsize=16)
-                a.set_xlabel("Wavelength", fontsize=14)
-                a.set_ylabel("Intensity", fontsize=14)                
-                if current_tab == 'EL Measurement':
-                    if self.graphcount == 0:
+                a.plot(x,y)
+                a.set_title (labels.get('title', "Spectrum"), fontsize=16)
+                a.set_xlabel(labels.get('xlabel', "Wavelength"), fontsize=14)
+                a.set_ylabel(labels.get('ylabel', "Intensity"), fontsize=14)                
+                if title == 'EL Measurement':
+                    if title not in self.graphs:
                         self.padding_textEL.destroy()
-                    self.graphs[self.graphcount] = tkagg.FigureCanvasTkAgg(fig, master=self.paneEL)
-                elif current_tab == 'PL Measurement':
-                    if self.graphcount == 0:
+                    graph = tkagg.FigureCanvasTkAgg(fig, master=self.paneEL)
+                elif title == 'PL Measurement':
+                    if title not in self.graphs:
                         self.padding_textPL.destroy()
-                    self.graphs[self.graphcount] = tkagg.FigureCanvasTkAgg(fig, master=self.panePL)                    
-                if self.graphcount > 0:
-                    self.graphs[self.graphcount-1].get_tk_widget().destroy()  
-                self.graphs[self.graphcount].get_tk_widget().grid(column=10, row=2, columnspan=5, rowspan=3)
-                self.graphs[self.graphcount].draw() 
-                mpl.plot(output[0],output[1])
+                    graph = tkagg.FigureCanvasTkAgg(fig, master=self.panePL)                    
+                if title in self.graphs:
+                    self.graphs[title].get_tk_widget().destroy()  
+                self.graphs[title] = graph
+                graph.get_tk_widget().grid(column=10, row=2, columnspan=5, rowspan=3)
+                graph.draw() 
+                mpl.plot(x,y)
                 mpl.show()  
-                self.graphcount+=1 
-                self.root.after(1000,self.check_queue)                
-        except Queue.Empty:
-            self.root.after(1000,self.check_queue)
+        self.root.after(event_channel.POLL_INTERVAL,self.check_queue)
+
+    def append_log(self, text, lines):
+        # One insert per batch, the log keeps the last LOG_LINES lines so long sessions do not slow down the GUI
+        text.insert(tk.END,'\n'+'\n'.join(lines))
+        excess = int(text.index('end-1c').split('.')[0]) - event_channel.LOG_LINES
+        if excess > 0:
+            text.delete('1.0', str(excess + 1) + '.0')
+        text.see('end')
     
     "FUNCTION TO START MEASUREMENT THREAD AND CHANGE MEASURING BUTTON TO CANCEL"    
-    def start(self):
-        global running
-        running = True
-        self.queue = Queue.Queue()
-        current_tab = gui.notebook.tab(gui.notebook.select(),"text")
-        if current_tab == 'EL Measurement':
-            ELTASK(self.queue).start()
+    def start(self, title):
+        if title in self.tasks:
+            return # the previous measurement of this stage is still finishing
+        # The task gets a snapshot of the parameters of its tab, its own event channel and the devices of its stage
+        if title == 'EL Measurement':
+            task = ELTASK(event_channel.EventChannel(), self.params[title], DEVICES.ELmotor, DEVICES.spectrometer.channel())
             self.start_buttonEL.destroy()
-            self.stop_buttonEL = tk.Button(self.button_paneEL, text="Stop Measurement", command=self.stop) 
+            self.stop_buttonEL = tk.Button(self.button_paneEL, text="Stop Measurement", command=lambda: self.stop(title)) 
             self.stop_buttonEL.grid(column=6, row=14, sticky="nsew", padx=10)               
-        elif current_tab == 'PL Measurement':
-            PLTASK(self.queue).start()   
+        elif title == 'PL Measurement':
+            task = PLTASK(event_channel.EventChannel(), self.params[title], DEVICES.PLmotor, DEVICES.spectrometer.channel())
             self.start_buttonPL.destroy()
-            self.stop_buttonPL = tk.Button(self.button_panePL, text="Stop Measurement", command=self.stop) 
+            self.stop_buttonPL = tk.Button(self.button_panePL, text="Stop Measurement", command=lambda: self.stop(title)) 
             self.stop_buttonPL.grid(column=6, row=14, sticky="nsew", padx=10)              
-        self.root.after(1000,self.check_queue)  
-
+        self.tasks[title] = task
+        task.start()
             
-    def stop(self):
-        global running
-        running = False
-        current_tab = gui.notebook.tab(gui.notebook.select(),"text")
-        if current_tab == 'EL Measurement':            
+    def stop(self, title):
+        # The task finishes its current sweep, the run button comes back once it has ended (see finished)
+        if title in self.tasks:
+            self.tasks[title].running = False
+        if title == 'EL Measurement':            
+            self.stop_buttonEL.configure(text="Stopping...", state="disabled")
+        elif title == 'PL Measurement':
+            self.stop_buttonPL.configure(text="Stopping...", state="disabled")
+    
+    def finished(self, title):
+        del self.tasks[title]
+        if title == 'EL Measurement':            
             self.stop_buttonEL.destroy()
-            self.start_buttonEL = tk.Button(self.button_paneEL, text="Run Measurement", command=self.start) 
+            self.start_buttonEL = tk.Button(self.button_paneEL, text="Run Measurement", command=lambda: self.start(title)) 
             self.start_buttonEL.grid(column=6, row=14, sticky="nsew", padx=10)               
-        elif current_tab == 'PL Measurement':
+        elif title == 'PL Measurement':
             self.stop_buttonPL.destroy()
-            self.start_buttonPL = tk.Button(self.button_panePL, text="Run Measurement", command=self.start) 
+            self.start_buttonPL = tk.Button(self.button_panePL, text="Run Measurement", command=lambda: self.start(title)) 
             self.start_buttonPL.grid(column=6, row=14, sticky="nsew", padx=10)  
         
     "FUNCTION TO RUN MAIN GUI THREAD"    
     def run(self): 
+        self.root.after(1000,self.check_queue)
         self.root.mainloop()
         
     "#####################################################################"
@@ -612,12 +829,49 @@ class GUI:
     
 class ELTASK(threading.Thread):
     
-    def __init__(self,queue):
+    def __init__(self,queue,param,motor,spec):
         threading.Thread.__init__(self,target=self.testrunEL)
         self.queue = queue
+        self.param = dict(param) # snapshot of the tab parameters at the start of the measurement
+        self.motor = motor # motor of the stage
+        self.spec = spec # channel of the shared spectrometer (see shared_spectrometer.py)
+        self.running = True # set to False by the stop button
+        self.sweeps = None # average of repeated sweeps (target error above 0)
+        
+    def align(self):
+        """
+        Find the normal of the OLED around the entered offset angle from the symmetry of its emission at the goniometer
+        source value, with short integrations (see alignment.py).
+        """
+        self.queue.progress('\nALIGNMENT AROUND THE OFFSET ANGLE ' + str(self.offset_angle))
+        rm = visa.ResourceManager()
+        keith = rm.open_resource(u'USB0::0x05E6::0x2450::04102170::INSTR')
+        keith.write('*rst')  # reset instrument
+        if self.source == 'Current':
+            keith.write('Source:Function Current')  # set current as source
+            keith.write('Source:Current ' + str(self.goniometer_value))  # set current to source_value
+            keith.write('Source:Current:VLimit ' + str(self.goniometer_compliance))  # set voltage compliance to compliance
+        else:
+            keith.write('Source:Function Volt')  # set voltage as source
+            keith.write('Source:Volt ' + str(self.goniometer_value))  # set voltage to source_value
+            keith.write('Source:Volt:ILimit ' + str(self.goniometer_compliance))  # set current compliance to compliance
+        self.spec.integration_time_micros(alignment.INTEGRATION_TIME)
+        dark = self.spec.intensities() # OLED off
+        def measure(angle):
+            self.motor.move_to(angle, blocking=True) # the scan jumps up to ~135 deg, e.g. between the flanks
+            time.sleep(self.moving_time) # settling
+            return run_journal.integrated(self.spec.intensities(), dark)
+        keith.write('Output ON')
+        try:
+            result = alignment.align(measure, self.offset_angle, running=lambda: self.running)
+        finally:
+            keith.write('Output OFF')
+        if result is not None:
+            self.motor.move_to(result['offset'], blocking=True) # at the normal before it is reported
+        report_alignment(self.queue, result)
         
     def testrunEL(self):          
-        while running == True:  
+        while self.running == True:  
 
             "INITIALIZING SETTINGS"          
             defaults = {}
@@ -642,13 +896,20 @@ class ELTASK(threading.Thread):
             defaults[15] = 'Current'  # source 
             defaults[16] = 0.001 # goniometer_value in A for current
             defaults[17] = 5 # goniometer_compliance in V for voltage
+            defaults[18] = 'Step' # scan_mode, 'Step' (stop and go) or 'Fly' (continuous rotation)
+            defaults[19] = 'Software' # pulse_mode, 'Software' (sleep for pulse_duration) or 'Triggered' (sourcemeter trigger model)
+            defaults[20] = 0 # target_error in %, 0 for a new run folder for every sweep
+            defaults[21] = 20 # max_sweeps
+            defaults[22] = 24 # lifetime_duration in h
+            defaults[23] = 'Raw' # spectral_mode, 'Raw', 'ROI', 'Bin' or 'Grid' (see spectral_roi.py)
+            defaults[24] = 0.1 # pd_target_noise in %, 0 for the fixed multimeter setting (see photodiode_policy.py)
             
             "GETTING PARAMETERS FROM GUI, IF BLANK SETTING AS DEFAULT"                
-            for x in range(0,18,1):                        
-                if not param[x]:
+            for x in range(0,25,1):                        
+                if not self.param[x]:
                     parameters.append(defaults[x])
                 else:
-                    settings[x] = param[x]
+                    settings[x] = self.param[x]
                     parameters.append(settings[x])
             if parameters[7] == 'F':
                 self.min_angle = float(parameters[1]) - 90
@@ -660,7 +921,7 @@ class ELTASK(threading.Thread):
                 self.min_angle = float(parameters[1]) - 90
                 self.max_angle = float(parameters[1])
             else:
-                self.queue.put('Invalid input.')
+                self.queue.warning('Invalid input.')
             
             "SETTING PARAMTERS"
             self.sample = parameters[0]
@@ -679,13 +940,45 @@ class ELTASK(threading.Thread):
             self.max_step_voltage = float(parameters[13]) 
             self.scan_compliance = float(parameters[14]) 
             self.source = parameters[15] 
-            self.goniometer_value  = float(parameters[16]) 
+            self.goniometer_values = [float(value) for value in str(parameters[16]).split(',')] # several setpoints per angle
+            self.goniometer_value = self.goniometer_values[0]
             self.goniometer_compliance = float(parameters[17])
+            self.scan_mode = parameters[18]
+            self.pulse_mode = parameters[19]
+            self.target_error = float(parameters[20]) / 100
+            self.max_sweeps = int(parameters[21])
+            self.lifetime_duration = float(parameters[22])
+            self.spectral_mode = parameters[23]
+            self.pd_target_noise = float(parameters[24]) / 100
+            if self.scan_mode == 'Lifetime':
+                self.target_error = 0 # one lifetime run, no repeated sweeps
+            if len(self.goniometer_values) > 1 and self.scan_mode in ('Fly', 'Lifetime'):
+                self.queue.warning('\nSeveral source values are only measured in Step mode, ' + self.scan_mode + ' uses ' + str(self.goniometer_value))
+                self.goniometer_values = self.goniometer_values[:1]
+            if len(self.goniometer_values) > 1:
+                self.target_error = 0 # one sweep with all setpoints, no repeated sweeps
+            if self.sweeps is not None:
+                self.scan_status = 'N' # the photodiode scan is only taken with the first sweep
+            if self.scan_mode == 'Align':
+                self.align() # no run folder, the normal becomes the offset angle of the tab
+                self.running = False
+                continue
             
             "SETTING DIRECTORY DETAILS"
-            now = dt.datetime.now()
-            datetime = str(now.strftime("%Y-%m-%d %H:%M").replace(" ","").replace(":","").replace("-",""))
-            self.queue.put('Measurement code : ' + self.sample + datetime + '  (OLED device code followed by the datetime of measurement).')
+            # An interrupted sweep with the same settings is continued in its run folder (see run_journal.py)
+            journal_settings = run_journal.sweep_settings(parameters, [1, 2, 3, 5, 6, 7, 15, 16, 17, 18, 19, 23])
+            resume = None
+            if self.sweeps is None and self.target_error == 0 and self.scan_mode == 'Step' and len(self.goniometer_values) == 1:
+                resume = run_journal.find_interrupted(os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', self.sample)), journal_settings)
+            if self.sweeps is not None:
+                datetime = self.sweeps.datetime # repeated sweep into the same run folder
+            elif resume is not None:
+                datetime = resume.datetime
+                self.scan_status = 'N' # the photodiode scan was finished before the interrupted sweep
+            else:
+                now = dt.datetime.now()
+                datetime = str(now.strftime("%Y-%m-%d %H:%M").replace(" ","").replace(":","").replace("-",""))
+            self.queue.progress('Measurement code : ' + self.sample + datetime + '  (OLED device code followed by the datetime of measurement).')
             # Set directories for recorded data.
             directory = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', self.sample, datetime, 'raw')) # Folder to separate raw and processed data
             if os.path.isdir(directory):
@@ -697,6 +990,10 @@ class ELTASK(threading.Thread):
             # Filename Parameters
             keithleyfilepath = os.path.join(directory, 'keithleydata')
             mayafilepath = os.path.join(directory, 'spectrumdata')
+            if self.target_error > 0:
+                # Repeated sweeps: the last sweep is kept in 'lastsweep', the average is written to 'spectrumdata'
+                averagefilepath = mayafilepath
+                mayafilepath = os.path.join(directory, 'lastsweep')
             if os.path.isdir(keithleyfilepath):
                 pass
             else:
@@ -713,7 +1010,8 @@ class ELTASK(threading.Thread):
             line01 = 'Measurement code : ' + self.sample + datetime
             line02 = 'Measurement programme :	"GatherLab Goniometer Measurement System".py'
             linex = 'Credits :	Gather Lab, University of St Andrews, 2018'
-            linexx = 'Integration Time:  ' + str(self.integrationtime) + 'micro s'
+            self.spec.reduction = spectral_roi.SpectralReduction(self.spec.raw_wavelengths(), self.spectral_mode)
+            linexx = 'Integration Time:  ' + str(self.integrationtime) + 'micro s   ' + self.spec.reduction.description()
             line03 = 'Pulse duration :		' + str(self.pulse_duration) + ' s'
             line04 = 'Step time between voltages :		' + str(self.moving_time) + ' s'
             if self.source == 'Current':
@@ -733,17 +1031,43 @@ class ELTASK(threading.Thread):
             header_lines = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09] # PD Voltages
             header_lines2 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line10, line11] # OLED Voltages
             header_lines3 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line12, line13] # Spectrum Data
+            
+            if len(self.goniometer_values) > 1:
+                # Several setpoints per angle: spectra and OLED voltages of setpoint k in 'raw'/'setpoint<k>' (see goniometer_run.py)
+                setpoint_paths = []
+                setpoint_lines = []
+                for k, value in enumerate(self.goniometer_values):
+                    folder = os.path.join(directory, goniometer_run.setpoint_folder(k + 1))
+                    setpoint_paths.append((os.path.join(folder, 'spectrumdata'), os.path.join(folder, 'keithleydata')))
+                    for path in setpoint_paths[-1]:
+                        if not os.path.isdir(path):
+                            os.makedirs(path)
+                    if self.source == 'Current':
+                        setpoint_lines.append('Source Current:		' + str(value * 1e3) + ' mA')
+                    else:
+                        setpoint_lines.append('Source Voltage:		' + str(value) + ' V')
+                setpoints = np.array([np.arange(1, len(self.goniometer_values) + 1), self.goniometer_values])
+                np.savetxt(os.path.join(directory, goniometer_run.SETPOINTS_FILE), setpoints.T, fmt='%d %.6e', delimiter='\t',
+                           header='\n'.join([line01, line02, linex, line07, 'Setpoint   Source ' + self.source, '-          ' + ('A' if self.source == 'Current' else 'V')]), comments='')
                        
             "INITIALIZING HARDWARE"
             # Keithley Finding Device
             rm = visa.ResourceManager()
             keith = rm.open_resource(u'USB0::0x05E6::0x2450::04102170::INSTR')
             keithmulti = rm.open_resource(u'USB0::0x05E6::0x2100::8003430::INSTR')
-            self.queue.put('\nKeithley Multimeter : '+ str(keithmulti.query('*IDN?')))
-            self.queue.put('\nKeithley Sourcemeter : '+ str(keith.query('*IDN?')))
+            self.queue.progress('\nKeithley Multimeter : '+ str(keithmulti.query('*IDN?')))
+            self.queue.progress('\nKeithley Sourcemeter : '+ str(keith.query('*IDN?')))
+            
+            self.queue.progress('\nOceanOptics : '+ str(DEVICES.MAYA_devices[0]))
+            self.spec.integration_time_micros(self.integrationtime) 
             
-            self.queue.put('\nOceanOptics : '+ str(DEVICES.MAYA_devices[0]))
-            DEVICES.spec.integration_time_micros(self.integrationtime) 
+            # One worker thread per instrument, calls to different instruments overlap (see instrument_executor.py)
+            smu = instrument_executor.InstrumentWorker('Keithley Sourcemeter')
+            dmm = instrument_executor.InstrumentWorker('Keithley Multimeter')
+            spectrometer = instrument_executor.InstrumentWorker('OceanOptics', 2 * self.integrationtime * 1e-6 + instrument_executor.TIMEOUT) # may wait for an integration of the PL stage
+            motor = instrument_executor.InstrumentWorker('Motor', instrument_executor.MOVE_TIMEOUT)
+            disk = instrument_executor.InstrumentWorker('Data files', instrument_executor.DISK_TIMEOUT)
+            workers = [smu, dmm, spectrometer, motor, disk]
     
             # Write operational parameters to Sourcemeter (Voltage to OLED)
             keith.write('*rst')  # reset instrument
@@ -762,16 +1086,17 @@ class ELTASK(threading.Thread):
             keithmulti.write('VOLTage:NPLCycles 1')  # sets the read-out speed and accuracy (0.01 fastest, 10 slowest but highest accuracy)
             keithmulti.write('TRIGer:SOURce BUS')  # sets the trigger to activate immediately after 'idle' -> 'wait-for-trigger' 
             keithmulti.write('TRIGer:DELay 0')  # sets the trigger to activate immediately after 'idle' -> 'wait-for-trigger' 
+            pdreader = photodiode_policy.AdaptiveReader(keithmulti, self.pd_target_noise) # range, NPLC and readings for every point of the scan
             
             "MOVING TO INITIAL POSITION"       
-            DEVICES.ELmotor.move_to(self.max_angle) 
+            self.motor.move_to(self.max_angle) 
             time.sleep(self.homing_time)
                          
             "#####################################################################"
             "#####TAKING MEASUREMENTS FROM THE THORLABS PDA100A2 PHOTODIODE#####"
             "#####################################################################"
             
-            self.queue.put("\n\nPHOTODIODE READINGS") 
+            self.queue.progress("\n\nPHOTODIODE READINGS") 
             "IMPLEMENTATION"                               
             # generate empty lists for later data collection
             low_vlt = np.arange(self.min_voltage, self.change_voltage, self.min_step_voltage) # Voltage points for low OLED voltage
@@ -779,53 +1104,64 @@ class ELTASK(threading.Thread):
             OLEDvlt = []
             OLEDcrt = []
             PDvlt = []
+            PDset = [] # multimeter setting of every photodiode reading
             "SCANNING VOLTAGES"     
             # Optional scanning voltage readings, runs readings if Y, anything else and this section is skipped
             if self.scan_status == str('Y'):  
                 
                 keithmulti.write("INITiate") # Initiating 'wait_for_trigger' mode for Multimeter
+                pending_background = dmm.submit(pdreader.read) # PD voltage reading from Multimeter for background, while the buffer is made
                 keith.write('Trace:Make "OLEDbuffer", ' + str(max(len(low_vlt)+len(high_vlt), 10))) # Buffer for Sourcemeter
                 keith.write('Trace:Clear "OLEDbuffer"')  # Keithley empties the buffer
-                background_diodevoltage = float(keithmulti.query('MEASure:VOLTage:DC?')) # Take PD voltage reading from Multimeter for background
-                self.queue.put("Background Photodiode Voltage :"+ str(background_diodevoltage) + ' V')
-                self.queue.put('\nSaving output to: ' + 'keithleyPDvoltages.txt')
+                background_diodevoltage = pending_background.result()
+                self.queue.reading("Background Photodiode Voltage", background_diodevoltage, 'V')
+                self.queue.progress('\nSaving output to: ' + 'keithleyPDvoltages.txt')
                 keith.write('Output ON')    
                 # Low Voltage Readings
                 for voltage in low_vlt:
-                    self.queue.put("\nOLED Voltage : "+ str(voltage) + ' V')
+                    self.queue.reading("OLED Voltage", voltage, 'V', prefix='\n')
                     keith.write('Source:Volt ' + str(voltage))  # Set voltage to source_value
                     
-                    diodevoltage = float(keithmulti.query('MEASure:VOLTage:DC?')) # Take PD voltage reading from Multimeter
-                    oledcurrent = float(keith.query('Read? "OLEDbuffer"')[:-1]) # Take OLED current reading from Sourcemeter
-                    self.queue.put("OLED Current : "+ str(oledcurrent*1e3) + ' mA')
-                    self.queue.put("Photodiode Voltage :"+ str(diodevoltage - background_diodevoltage) + ' V')
+                    # PD voltage reading from Multimeter and OLED current reading from Sourcemeter at the same time
+                    diodevoltage, oledcurrent = instrument_executor.gather(dmm.submit(pdreader.read), smu.submit(keith.query, 'Read? "OLEDbuffer"'))
+                    PDset.append(pdreader.used)
+                    oledcurrent = float(oledcurrent[:-1])
+                    self.queue.reading("OLED Current", oledcurrent*1e3, 'mA')
+                    self.queue.reading("Photodiode Voltage", diodevoltage - background_diodevoltage, 'V')
                     PDvlt.append(diodevoltage - background_diodevoltage)
                     OLEDcrt.append(oledcurrent)
                     OLEDvlt.append(voltage)   
                     
                 # High Voltage Readings
                 for voltage in high_vlt:
-                    self.queue.put("\nOLED Voltage : "+ str(voltage) + ' V')
+                    self.queue.reading("OLED Voltage", voltage, 'V', prefix='\n')
                     keith.write('Source:Volt ' + str(voltage))  # Set voltage to source_value
                     
-                    diodevoltage = float(keithmulti.query('MEASure:VOLTage:DC?')) # Take PD voltage reading from Multimeter
-                    oledcurrent = float(keith.query('Read? "OLEDbuffer"')[:-1]) # Take OLED current reading from Sourcemeter
-                    self.queue.put("OLED Current : "+ str(oledcurrent*1e3) + ' mA')
-                    self.queue.put("Photodiode Voltage :"+ str(diodevoltage - background_diodevoltage) + ' V')
+                    # PD voltage reading from Multimeter and OLED current reading from Sourcemeter at the same time
+                    diodevoltage, oledcurrent = instrument_executor.gather(dmm.submit(pdreader.read), smu.submit(keith.query, 'Read? "OLEDbuffer"'))
+                    PDset.append(pdreader.used)
+                    oledcurrent = float(oledcurrent[:-1])
+                    self.queue.reading("OLED Current", oledcurrent*1e3, 'mA')
+                    self.queue.reading("Photodiode Voltage", diodevoltage - background_diodevoltage, 'V')
                     PDvlt.append(diodevoltage - background_diodevoltage)
                     OLEDcrt.append(oledcurrent)
                     OLEDvlt.append(voltage)   
                     self.scan_status = 'N'   
                         
                 keith.write('Output OFF')
+                self.queue.progress('\nPhotodiode integration time :  ' + '%.2f' % sum(used['integration'] for used in PDset) + ' s')
                 OLEDvolt = np.array(OLEDvlt)  # Creates voltage array
                 OLEDcurrent = np.array(OLEDcrt) * 1e3  # Creates current array; NOTE: current in mA !!!
                 PDvoltage = np.array(PDvlt)
-                photodiodedata = np.stack((OLEDvolt, OLEDcurrent, PDvoltage)) 
-                np.savetxt(keithleyfilename, photodiodedata.T, fmt='%.4f %.4e %.6f', header='\n'.join(header_lines), delimiter='\t', comments='')
+                PDsetting = np.array([[used['range'], used['nplc'], used['readings'], used['integration']] for used in PDset]).T
+                photodiodedata = np.vstack((OLEDvolt, OLEDcurrent, PDvoltage, PDsetting)) 
+                header_scan = header_lines[:-2] + [line08 + '   Range   NPLC   Readings   Integration', line09 + '     V       -      -          s']
+                np.savetxt(keithleyfilename, photodiodedata.T, fmt='%.4f %.4e %.6f %g %g %d %.4f', header='\n'.join(header_scan), delimiter='\t', comments='')
         
             "SPECIFIC READING AT CERTAIN CURRENT"
             
+            pending_background = dmm.submit(keithmulti.query, 'MEASure:VOLTage:DC?') # PD voltage reading from Multimeter for background, while the Sourcemeter is set
+            
             # Write operational parameters to Sourcemeter (Current to OLED)
             keith.write('Source:Function Current')  # set current as source
             keith.write('Source:Current ' + str(self.goniometer_value))  # set current to source_value
@@ -834,19 +1170,22 @@ class ELTASK(threading.Thread):
             keith.write('Source:Current:READ:BACK OFF')  # record preset source value instead of measuring it anew. NO CURRENT IS MEASURED!!! (Costs approx. 1.5 ms)
             keith.write('Volt:AZero OFF')  # turn off autozero
             keith.write('Source:Current:Delay:AUTO OFF')  # turn off autodelay
-            background_diodevoltage = float(keithmulti.query('MEASure:VOLTage:DC?')) # Take PD voltage reading from Multimeter for background
+            background_diodevoltage = float(pending_background.result())
                 
             keith.write('Output ON')  # Turn power on
-            specificPDvoltage = float(keithmulti.query('MEASure:VOLTage:DC?')) # Take PD voltage reading from Multimeter
-            specificPDvoltage = specificPDvoltage - background_diodevoltage # Background Subtracted
-            specificOLEDcurrent = float(keith.query('MEASure:CURRent:DC?')) # Take OLED current reading from Sourcemeter
-            specificOLEDvoltage = float(keith.query('MEASure:VOLTage:DC?')) # Take OLED current reading from Sourcemeter
+            # PD voltage reading from Multimeter while the Sourcemeter reads OLED current and voltage
+            specificPDvoltage, specificOLEDcurrent, specificOLEDvoltage = instrument_executor.gather(dmm.submit(keithmulti.query, 'MEASure:VOLTage:DC?'),
+                                                                                                     smu.submit(keith.query, 'MEASure:CURRent:DC?'),
+                                                                                                     smu.submit(keith.query, 'MEASure:VOLTage:DC?'))
             keith.write('Output OFF')  # Turn power off
+            specificPDvoltage = float(specificPDvoltage) - background_diodevoltage # Background Subtracted
+            specificOLEDcurrent = float(specificOLEDcurrent)
+            specificOLEDvoltage = float(specificOLEDvoltage)
                
-            self.queue.put('\n\nSaving output to: ' + 'specifickeithleyPDvoltages.txt')                 
-            self.queue.put("\nPhotodiode Voltage :"+ str(specificPDvoltage) + ' V')
-            self.queue.put("OLED Voltage : "+ str(specificOLEDvoltage) + ' V')
-            self.queue.put("OLED Current : "+ str(specificOLEDcurrent*1e3) + ' mA')
+            self.queue.progress('\n\nSaving output to: ' + 'specifickeithleyPDvoltages.txt')                 
+            self.queue.reading("Photodiode Voltage", specificPDvoltage, 'V', prefix='\n')
+            self.queue.reading("OLED Voltage", specificOLEDvoltage, 'V')
+            self.queue.reading("OLED Current", specificOLEDcurrent*1e3, 'mA')
             
             
             specificphotodiodedata = np.stack((np.array(specificOLEDvoltage), np.array(specificOLEDcurrent), np.array(specificPDvoltage)))
@@ -858,7 +1197,7 @@ class ELTASK(threading.Thread):
             "####TAKING MEASUREMENTS FROM THE OCEANOPTICS MAYALSL SPECTROMETER####"
             "#####################################################################"
             
-            self.queue.put("\n\nSPECTROMETER READINGS") 
+            self.queue.progress("\n\nSPECTROMETER READINGS") 
             
             "SETTING PARAMETERS"
             # Keithley OLED Current Parameters
@@ -869,13 +1208,13 @@ class ELTASK(threading.Thread):
             	sense = 'Current'
             	
             if warning_message is True:
-            	self.queue.put("\nWARNING:\n")
+            	self.queue.warning("\nWARNING:\n")
             	if self.source == 'Current':
-            		self.queue.put("You are about to set " + str(self.source) + " as source with " + str(self.goniometer_value * 1e3) + " mA.")
-            		self.queue.put("Your " + sense + " Compliance is " + str (self.goniometer_compliance) + " V.\n")
+            		self.queue.warning("You are about to set " + str(self.source) + " as source with " + str(self.goniometer_value * 1e3) + " mA.")
+            		self.queue.warning("Your " + sense + " Compliance is " + str (self.goniometer_compliance) + " V.\n")
             	else:
-            		self.queue.put("You are about to set " + str(self.source) + " as source with " + str(self.goniometer_value) + " V.")
-            		self.queue.put("Your " + sense + " Compliance is " + str (self.goniometer_compliance * 1e3) + " mA.\n")
+            		self.queue.warning("You are about to set " + str(self.source) + " as source with " + str(self.goniometer_value) + " V.")
+            		self.queue.warning("Your " + sense + " Compliance is " + str (self.goniometer_compliance * 1e3) + " mA.\n")
             	while True:
             		i = input("If this looks right, press Enter to continue. Else press 'q' to quit.")
             		if i == 'q':
@@ -885,14 +1224,14 @@ class ELTASK(threading.Thread):
                     
             # Printing source and compliance
             if self.source == 'Current':
-                self.queue.put('\nsource current: ' + str(self.goniometer_value * 1e3) + ' mA')
-                self.queue.put('voltage compliance: ' + str(self.goniometer_compliance) + ' V')
+                self.queue.progress('\nsource current: ' + str(self.goniometer_value * 1e3) + ' mA')
+                self.queue.progress('voltage compliance: ' + str(self.goniometer_compliance) + ' V')
             else:
-                self.queue.put('\nsource voltage: ' + str(self.goniometer_value) + ' V')
-                self.queue.put('current compliance: ' + str(self.goniometer_compliance * 1e3) + ' mA')	
+                self.queue.progress('\nsource voltage: ' + str(self.goniometer_value) + ' V')
+                self.queue.progress('current compliance: ' + str(self.goniometer_compliance * 1e3) + ' mA')	
             
-            self.queue.put('approx pulse length: ' + str(self.pulse_duration) + ' s')
-            self.queue.put('Saving output to: ' + 'keithleyOLEDvoltages.txt' + ' and Angle_.txt'),
+            self.queue.progress('approx pulse length: ' + str(self.pulse_duration) + ' s')
+            self.queue.progress('Saving output to: ' + 'keithleyOLEDvoltages.txt' + ' and Angle_.txt'),
             
             # Keithley write operational parameters to SMU
             keith.write('*rst')  # reset instrument        
@@ -914,8 +1253,8 @@ class ELTASK(threading.Thread):
                 keith.write('Current:AZero OFF')  # turn off autozero
                 keith.write('Source:Volt:Delay:AUTO OFF')  # turn off autodelay
             
-            self.queue.put('\n\nSource: ' + str(keith.query('Source:Function?')))
-            self.queue.put('Sense: ' + str(keith.query('Sense:Voltage:Unit?')))
+            self.queue.progress('\n\nSource: ' + str(keith.query('Source:Function?')))
+            self.queue.progress('Sense: ' + str(keith.query('Sense:Voltage:Unit?')))
             
             "SETTING FILE DETAILS"
             # Filename Parameters
@@ -937,72 +1276,258 @@ class ELTASK(threading.Thread):
             keith.write('Trace:Make "pulsebuffer", ' + str(max(buffer_length, 10)))  # create buffer; buffer size must be between 10 and 11000020
             keith.write('Trace:Clear "pulsebuffer"')  # keithley empties the buffer
             
-            DEVICES.ELmotor.move_to(self.min_angle)  
+            if self.pulse_mode == 'Triggered':
+                pulse = pulse_timing.TriggeredPulse(keith, self.integrationtime)
+                pulse.load()
+                self.queue.progress('SMU-timed pulse length: ' + str(pulse.on_time) + ' s')
+            
+            self.motor.move_to(self.min_angle)  
             time.sleep(self.homing_time) 
                 
             # Take calibration readings
-            spectrum = DEVICES.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
-            np.savetxt(mayafilename, spectrum.T, fmt='%.4f %.0f', delimiter='\t', header='\n'.join(header_lines3), comments='')
+            spectrum = self.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
+            if resume is None: # the background of an interrupted sweep is kept
+                np.savetxt(mayafilename, spectrum.T, fmt='%.4f ' + self.spec.reduction.fmt, delimiter='\t', header='\n'.join(header_lines3), comments='')
+            background = spectrum
             processing_time = 0.5 # Initial processing time in seconds   
             
-            # Move motor by given increment while giving current to OLED and reading spectrum
-            for angle in np.arange(self.min_angle, self.max_angle + 1, self.step_angle):           
-     
-                DEVICES.ELmotor.move_to(angle)  
-                time.sleep(self.moving_time)                    
+            def acquire(processing_time):
+                """
+                Spectrum and SMU reading of one pulse at the present source value.
+                """
+                if self.pulse_mode == 'Triggered':
+                    # Pulse timed by the sourcemeter around one integration, SMU reading from its buffer (see pulse_timing.py)
+                    start_process = time.clock()
+                    with self.spec.lock: # the pulse must not wait for the other stage
+                        intensity, temp_buffer = pulse.fire(self.spec.intensities)
+                else:
+                    keith.write('Output ON')
+                    time.sleep(max(self.pulse_duration - processing_time, 0))
+                    start_process = time.clock()
+                    # Keithley measurement and spectrum at the same time, the current is off as soon as both are taken
+                    temp_buffer, intensity = instrument_executor.gather(smu.submit(keith.query, 'Read? "pulsebuffer"'), spectrometer.submit(self.spec.intensities))
+                    keith.write('Output OFF') #Turn current off
+                    temp_buffer = float(temp_buffer[:-1])
+                return intensity, temp_buffer, start_process
+            
+            journal = None
+            if resume is not None:
+                "CHECKING THE INTERRUPTED SWEEP FOR DRIFT"
+                reference = None
+                if resume.reference is not None:
+                    self.motor.move_to(self.offset_angle)
+                    time.sleep(self.homing_time)
+                    intensity = acquire(0)[0]
+                    reference = run_journal.integrated(intensity, background[1])
+                drift = resume.drift(background[1], reference)
+                self.queue.progress('\nDrift since the interruption :  dark ' + '%.2f' % (100 * drift['dark']) + ' %' +
+                               ('' if drift['reference'] is None else ',  perpendicular intensity ' + '%.2f' % (100 * drift['reference']) + ' %'))
+                if not resume.resumable(drift):
+                    resume.abandon(drift)
+                    self.queue.warning('\nDRIFT ABOVE TOLERANCE, STARTING A NEW RUN')
+                    for worker in workers:
+                        worker.close()
+                    continue
+                resume.resume(drift)
+                journal = resume
+                for record in journal.angles:
+                    ang.append(record['label'])
+                    vlt.append(record['voltage'])
+                    crt.append(record['current'])
+                self.queue.progress('\nRESUMING THE INTERRUPTED SWEEP AFTER ' + str(len(ang)) + ' ANGLES')
+            elif self.scan_mode == 'Step' and self.target_error == 0 and len(self.goniometer_values) == 1:
+                journal = run_journal.RunJournal(directory)
+                journal.start(journal_settings, background[1])
+            
+            if self.scan_mode == 'Lifetime':
+                # Perpendicular spectrum, OLED voltage and photodiode signal at constant current on a log-spaced schedule (see lifetime.py)
+                self.queue.progress('\nLifetime measurement for ' + str(self.lifetime_duration) + ' h')
+                self.motor.move_to(self.offset_angle)
+                time.sleep(self.homing_time)
+                tracker = lifetime.LifetimeTracker(directory, background[0], header_lines3[:9])
+                keith.write('Output ON')
+                start_lifetime = time.time()
+                try:
+                    for sample_time in lifetime.schedule(self.lifetime_duration * 3600):
+                        while self.running == True and time.time() - start_lifetime < sample_time:
+                            time.sleep(min(0.5, max(sample_time - (time.time() - start_lifetime), 0)))
+                        if self.running != True:
+                            break
+                        temp_buffer = float(keith.query('Read? "pulsebuffer"')[:-1]) # take measurement from Keithley
+                        pdvoltage = float(keithmulti.query('MEASure:VOLTage:DC?')) - background_diodevoltage
+                        intensity = self.spec.intensities()
+                        if self.source == 'Current':
+                            tracker.add(time.time() - start_lifetime, temp_buffer, self.goniometer_value, pdvoltage, intensity)
+                        else:
+                            tracker.add(time.time() - start_lifetime, self.goniometer_value, temp_buffer, pdvoltage, intensity)
+                        self.queue.publish(event_channel.Event('reading', '\nTime : ' + '%.0f' % (time.time() - start_lifetime) + ' s,  photodiode voltage : ' + str(pdvoltage) + ' V,  ' + ',  '.join(tracker.summary()), pdvoltage, key='lifetime'))
+                        self.queue.spectrum(tracker.ring.times / 3600, tracker.ring.values, {'title': 'Photodiode signal', 'xlabel': 'Time (h)', 'ylabel': 'Photodiode voltage (V)'})
+                finally:
+                    keith.write('Output OFF')
+                    tracker.close()
+                self.running = False # the lifetime run is not repeated
+            elif self.scan_mode == 'Fly':
+                # Continuous rotation with current on while streaming spectra, interpolated onto the angle grid (see flyscan.py)
+                self.queue.progress('\nFly scan at ' + str(flyscan.velocity_for_step(self.step_angle, self.integrationtime)) + ' deg/s')
                 keith.write('Output ON')
-                time.sleep(self.pulse_duration - processing_time)
                 start_process = time.clock()
-                temp_buffer = float(keith.query('Read? "pulsebuffer"')[:-1]) # take measurement from Keithley
-                # Add Keithley readings to lists
+                result = flyscan.FlyScan(self.motor, self.spec, self.min_angle, self.max_angle, self.step_angle, self.integrationtime,
+                                         smu_read=lambda: float(keith.query('Read? "pulsebuffer"')[:-1]), running=lambda: self.running).run()
+                keith.write('Output OFF')
+                self.queue.progress('\nProcessing time :  '+str(time.clock() - start_process))
+                flyscan.save_trace(directory, result, header_lines3[:9])
+                if len(result['grid']) == 0:
+                    self.queue.warning('\nFEWER THAN TWO SPECTRA IN THE FLY SCAN, NO ANGLE FILES WRITTEN')
+                elif len(result['grid']) < len(np.arange(self.min_angle, self.max_angle + 1, self.step_angle)):
+                    self.queue.warning('\nFLY SCAN STOPPED AFTER ' + str(len(result['grid'])) + ' ANGLES, NO FILES FOR THE OTHERS')
+                for angle, intensity, temp_buffer in zip(result['grid'], result['spectra'], result['smu']):
+                    if self.source == 'Current':
+                        crt.append(self.goniometer_value)
+                        vlt.append(temp_buffer)
+                    else:
+                        crt.append(temp_buffer)
+                        vlt.append(self.goniometer_value)
+                    ang.append(relative_angle(angle, self.offset_angle, self.ang_range))
+                    mayafilename = os.path.abspath(os.path.join(mayafilepath, 'Angle'+str(ang[-1]).zfill(3)+'.txt'))
+                    np.savetxt(mayafilename, np.stack((result['wavelengths'], intensity)).T, fmt='%.3f %.1f', delimiter='\t', header='\n'.join(header_lines3), comments='')
+                if len(result['grid']):
+                    self.queue.spectrum(result['wavelengths'], result['spectra'][len(result['grid'])//2])
+            elif len(self.goniometer_values) > 1:
+                # Every setpoint at every angle: one move, then one pulse per source value (no journal, no repeated sweeps)
+                setpoint_vlt = [[] for value in self.goniometer_values]
+                setpoint_crt = [[] for value in self.goniometer_values]
+                saving = None
+                for angle in np.arange(self.min_angle, self.max_angle + 1, self.step_angle):
+                    motor.call(self.motor.move_to, angle)
+                    time.sleep(self.moving_time)
+                    ang.append(relative_angle(angle, self.offset_angle, self.ang_range))
+                    self.queue.progress('\nAngle : ' + str(ang[-1]))
+                    wavelength = self.spec.wavelengths()
+                    for k, value in enumerate(self.goniometer_values):
+                        if self.source == 'Current':
+                            keith.write('Source:Current ' + str(value))
+                        else:
+                            keith.write('Source:Volt ' + str(value))
+                        intensity, temp_buffer, start_process = acquire(processing_time)
+                        if self.source == 'Current':
+                            setpoint_crt[k].append(value)
+                            setpoint_vlt[k].append(temp_buffer)
+                            self.queue.reading('OLED Voltage', temp_buffer, 'V', prefix=setpoint_lines[k].replace('\t', ' ') + ',  ')
+                        else:
+                            setpoint_crt[k].append(temp_buffer)
+                            setpoint_vlt[k].append(value)
+                            self.queue.reading('OLED Current', temp_buffer * 1e3, 'mA', prefix=setpoint_lines[k].replace('\t', ' ') + ',  ')
+                        self.queue.spectrum(wavelength, intensity)
+                        header = list(header_lines3)
+                        header[6] = setpoint_lines[k] # line05, the source value of this setpoint
+                        mayafilename = os.path.join(setpoint_paths[k][0], 'Angle' + str(ang[-1]).zfill(3) + '.txt')
+                        if saving is not None:
+                            saving.result() # the previous file is written (raises its error)
+                        saving = disk.submit(save_angle, mayafilename, np.stack((wavelength, intensity)), '%.3f ' + self.spec.reduction.fmt, header)
+                        processing_time = time.clock() - start_process
+                    self.queue.progress('\nProcessing time :  ' + str(processing_time))
+                if saving is not None:
+                    saving.result()
+                # Source back to the first value, the OLED voltages of every setpoint are written below
                 if self.source == 'Current':
-                    crt.append(self.goniometer_value)
-                    vlt.append(temp_buffer)
-                    line13 = 'Source Current:		' + str(self.goniometer_value * 1e3) + ' mA'
-                    line14 = 'Source Voltage:      ' + str(temp_buffer) + ' V'
+                    keith.write('Source:Current ' + str(self.goniometer_value))
                 else:
-                    crt.append(temp_buffer)
-                    vlt.append(self.goniometer_value)
-                    line13 = 'Source Voltage:		' + str(self.goniometer_value) + ' V'
-                    line14 = 'Source Current:      ' + str(temp_buffer * 1e3) + ' mA'
-                header_lines3.append(line13)
-                header_lines3.append(line14)
-                # Take spectrometer readings    
-                wavelength = DEVICES.spec.wavelengths() # creates a list of wavelengths
-                intensity = DEVICES.spec.intensities() # creates a list of intensities
-                spectrum = DEVICES.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
-                wvl.append(wavelength) # adding to a master list (may not be necessary with txt file outputs)
-                inte.append(intensity) # adding to a master list (may not be necessary with txt file outputs)
-                spect.append(spectrum) # adding to a master list (may not be necessary with txt file outputs)
+                    keith.write('Source:Volt ' + str(self.goniometer_value))
+            else:
+                # Move motor by given increment while giving current to OLED and reading spectrum
+                # The file of an angle is written on the 'Data files' worker while the motor moves to the next angle
+                saving = None
+                for angle in np.arange(self.min_angle, self.max_angle + 1, self.step_angle):           
+                    if journal is not None and journal.done(angle):
+                        continue # completed before the interruption
+                    motor.call(self.motor.move_to, angle)
+                    time.sleep(self.moving_time)                    
+                    intensity, temp_buffer, start_process = acquire(processing_time)
+                    # Add Keithley readings to lists
+                    if self.source == 'Current':
+                        crt.append(self.goniometer_value)
+                        vlt.append(temp_buffer)
+                        line13 = 'Source Current:		' + str(self.goniometer_value * 1e3) + ' mA'
+                        line14 = 'Source Voltage:      ' + str(temp_buffer) + ' V'
+                    else:
+                        crt.append(temp_buffer)
+                        vlt.append(self.goniometer_value)
+                        line13 = 'Source Voltage:		' + str(self.goniometer_value) + ' V'
+                        line14 = 'Source Current:      ' + str(temp_buffer * 1e3) + ' mA'
+                    header_lines3.append(line13)
+                    header_lines3.append(line14)
+                    # Take spectrometer readings    
+                    wavelength = self.spec.wavelengths() # creates a list of wavelengths
+                    spectrum = np.stack((wavelength, intensity)) # the spectrum taken during the pulse
+                    wvl.append(wavelength) # adding to a master list (may not be necessary with txt file outputs)
+                    inte.append(intensity) # adding to a master list (may not be necessary with txt file outputs)
+                    spect.append(spectrum) # adding to a master list (may not be necessary with txt file outputs)
                 
-                "DISPLAYING SPECTRUM AS A PLOT"
-                self.queue.put([wavelength,intensity])
+                    "DISPLAYING SPECTRUM AS A PLOT"
+                    self.queue.spectrum(wavelength,intensity)
                 
-                "SPECTRUM OUTPUT FILE"
-                # Angle is written as 0 -> 180 rather than -90 -> 90
-                if self.ang_range == 'F':
-                    mayafilename = 'Angle'+str(angle + 90 - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
-                elif self.ang_range == 'HL':
-                    mayafilename = 'Angle'+str(angle - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
-                elif self.ang_range == 'HR':
-                    mayafilename = 'Angle'+str(self.offset_angle - angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
-                mayafilename = os.path.abspath(os.path.join(mayafilepath, mayafilename))
-                np.savetxt(mayafilename, spectrum.T, fmt='%.3f %.0f', delimiter='\t', header='\n'.join(header_lines3), comments='')
-                keith.write('Output OFF') #Turn current off
-                end_process = time.clock()
-                processing_time = end_process - start_process
-                self.queue.put('\nProcessing time :  '+str(processing_time))
+                    "SPECTRUM OUTPUT FILE"
+                    # Angle is written as 0 -> 180 rather than -90 -> 90
+                    if self.ang_range == 'F':
+                        mayafilename = 'Angle'+str(angle + 90 - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
+                    elif self.ang_range == 'HL':
+                        mayafilename = 'Angle'+str(angle - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
+                    elif self.ang_range == 'HR':
+                        mayafilename = 'Angle'+str(self.offset_angle - angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
+                    mayafilename = os.path.abspath(os.path.join(mayafilepath, mayafilename))
+                    end_process = time.clock()
+                    processing_time = end_process - start_process
+                    self.queue.progress('\nProcessing time :  '+str(processing_time))
                     
-                if self.ang_range == 'F':
-                    self.queue.put('\nAngle : '+str(angle + 90 - self.offset_angle))
-                    ang.append(angle + 90 - self.offset_angle)
-                elif self.ang_range == 'HL':
-                    self.queue.put('\nAngle : '+str(angle - self.offset_angle))
-                    ang.append(angle - self.offset_angle)
-                elif self.ang_range == 'HR':
-                    self.queue.put('\nAngle : '+str(self.offset_angle - angle))
-                    ang.append(self.offset_angle - angle)
+                    if self.ang_range == 'F':
+                        self.queue.progress('\nAngle : '+str(angle + 90 - self.offset_angle))
+                        ang.append(angle + 90 - self.offset_angle)
+                    elif self.ang_range == 'HL':
+                        self.queue.progress('\nAngle : '+str(angle - self.offset_angle))
+                        ang.append(angle - self.offset_angle)
+                    elif self.ang_range == 'HR':
+                        self.queue.progress('\nAngle : '+str(self.offset_angle - angle))
+                        ang.append(self.offset_angle - angle)
+                    record = dict(angle=angle, label=ang[-1], voltage=vlt[-1], current=crt[-1], integral=run_journal.integrated(intensity, background[1]),
+                                  reference=abs(angle - self.offset_angle) < 1e-6)
+                    if saving is not None:
+                        saving.result() # the file of the previous angle is written (raises its error)
+                    saving = disk.submit(save_angle, mayafilename, spectrum, '%.3f ' + self.spec.reduction.fmt, list(header_lines3), journal, record)
+                if saving is not None:
+                    saving.result()
+            
+            if self.target_error > 0 and (self.scan_mode != 'Fly' or self.running == True):
+                "AVERAGING REPEATED SWEEPS"
+                if self.sweeps is None:
+                    self.sweeps = sweep_statistics.SweepAverage(ang, background[0], datetime, self.target_error, self.max_sweeps)
+                if self.source == 'Current':
+                    smu_values = vlt
+                else:
+                    smu_values = crt
+                self.sweeps.add(result['spectra'] if self.scan_mode == 'Fly' else inte, background[1], smu_values)
+                self.sweeps.save(averagefilepath, os.path.join(averagefilepath, 'Background.txt'), header_lines3[:9])
+                if self.source == 'Current':
+                    vlt = list(self.sweeps.smu.mean)
+                else:
+                    crt = list(self.sweeps.smu.mean)
+                self.queue.progress('\nSweeps averaged : ' + str(self.sweeps.count) + ',  relative error of the integrated intensity : ' + str(100 * self.sweeps.relative_error()) + ' %')
+                if self.sweeps.converged():
+                    self.queue.progress('\nTARGET ERROR OR MAXIMUM NUMBER OF SWEEPS REACHED')
+                    self.running = False
     
+            if len(self.goniometer_values) > 1:
+                "PULSE OUTPUT FILES OF THE SETPOINTS"
+                for k in range(len(self.goniometer_values)):
+                    pulse_data = np.stack((ang, setpoint_vlt[k], setpoint_crt[k]))
+                    header = list(header_lines2)
+                    header[6] = setpoint_lines[k]
+                    np.savetxt(os.path.join(setpoint_paths[k][1], 'keithleyOLEDvoltages.txt'), pulse_data.T, fmt='%.0f %.4f %.3e', delimiter='\t', header='\n'.join(header), comments='')
+                for worker in workers:
+                    worker.close()
+                goniometer_run.mark_complete(directory) # the run can be packed (see run_archive.py)
+                self.queue.progress('\n\nMEASUREMENT COMPLETE')
+                continue
+            
             pulse_data = np.stack((ang, vlt, crt))
                             
             "PULSE OUTPUT FILE"
@@ -1011,17 +1536,45 @@ class ELTASK(threading.Thread):
             	np.savetxt(keithleyfilename, pulse_data.T, fmt='%.0f %.4f %.3e', delimiter='\t', header='\n'.join(header_lines2), comments='')
             else:
             	np.savetxt(keithleyfilename, pulse_data.T, fmt='%.0f %.4f %.3e', delimiter='\t', header='\n'.join(header_lines2), comments='')
+            if journal is not None:
+                journal.complete()
+            for worker in workers:
+                worker.close()
+            if self.target_error == 0 or self.running == False: # repeated sweeps: after the last one
+                goniometer_run.mark_complete(directory) # the run can be packed (see run_archive.py)
                 
-            self.queue.put('\n\nMEASUREMENT COMPLETE') 
+            self.queue.progress('\n\nMEASUREMENT COMPLETE') 
         
 class PLTASK(threading.Thread):
     
-    def __init__(self,queue):
+    def __init__(self,queue,param,motor,spec):
         threading.Thread.__init__(self,target=self.runPL)
         self.queue = queue
+        self.param = dict(param) # snapshot of the tab parameters at the start of the measurement
+        self.motor = motor # motor of the stage
+        self.spec = spec # channel of the shared spectrometer (see shared_spectrometer.py)
+        self.running = True # set to False by the stop button
+        self.sweeps = None # average of repeated sweeps (target error above 0)
+        
+    def align(self):
+        """
+        Find the normal of the film around the entered offset angle from the symmetry of its photoluminescence, with
+        short integrations (see alignment.py). The laser stays on, so the counts are not dark-subtracted (a constant
+        offset does not move the normal).
+        """
+        self.queue.progress('\nALIGNMENT AROUND THE OFFSET ANGLE ' + str(self.offset_angle))
+        self.spec.integration_time_micros(alignment.INTEGRATION_TIME)
+        def measure(angle):
+            self.motor.move_to(angle, blocking=True) # the scan jumps up to ~135 deg, e.g. between the flanks
+            time.sleep(self.moving_time) # settling
+            return float(np.sum(self.spec.intensities()))
+        result = alignment.align(measure, self.offset_angle, running=lambda: self.running)
+        if result is not None:
+            self.motor.move_to(result['offset'], blocking=True) # at the normal before it is reported
+        report_alignment(self.queue, result)
         
     def runPL(self):
-        while running == True: 
+        while self.running == True: 
             "INITIALIZING SETTINGS"          
             defaults = {}
             settings = {}
@@ -1036,13 +1589,17 @@ class PLTASK(threading.Thread):
             defaults[5] = 0.2 # moving_time
             defaults[6] = 0.2  # pulse_duration
             defaults[7] = 'HL' # ang_range
+            defaults[18] = 'Step' # scan_mode, 'Step' (stop and go) or 'Fly' (continuous rotation)
+            defaults[20] = 0 # target_error in %, 0 for a new run folder for every sweep
+            defaults[21] = 20 # max_sweeps
+            defaults[23] = 'Raw' # spectral_mode, 'Raw', 'ROI', 'Bin' or 'Grid' (see spectral_roi.py)
             
             "GETTING PARAMETERS FROM GUI, IF BLANK SETTING AS DEFAULT"
-            for x in range(0,8,1):                        
-                if not param[x]:
+            for x in [0, 1, 2, 3, 4, 5, 6, 7, 18, 20, 21, 23]:                        
+                if not self.param[x]:
                     parameters.append(defaults[x])
                 else:
-                    settings[x] = param[x]
+                    settings[x] = self.param[x]
                     parameters.append(settings[x])                
             if parameters[7] == 'F':
                 self.min_angle = float(parameters[1]) - 90
@@ -1054,7 +1611,7 @@ class PLTASK(threading.Thread):
                 self.min_angle = float(parameters[1]) - 90
                 self.max_angle = float(parameters[1])
             else:
-                self.queue.put('Invalid input.')
+                self.queue.warning('Invalid input.')
             
             "SETTING PARAMTERS"
             self.sample = parameters[0]
@@ -1065,12 +1622,30 @@ class PLTASK(threading.Thread):
             self.moving_time = float(parameters[5])
             self.pulse_duration = float(parameters[6])
             self.ang_range = parameters[7]
+            self.scan_mode = parameters[8]
+            self.target_error = float(parameters[9]) / 100
+            self.max_sweeps = int(parameters[10])
+            self.spectral_mode = parameters[11]
+            if self.scan_mode == 'Align':
+                self.align() # no run folder, the normal becomes the offset angle of the tab
+                self.running = False
+                continue
             
             "SETTING DIRECTORY DETAILS"
+            # An interrupted sweep with the same settings is continued in its run folder (see run_journal.py)
+            journal_settings = run_journal.sweep_settings(parameters, [1, 2, 3, 5, 6, 7, 8, 11])
+            resume = None
+            if self.sweeps is None and self.target_error == 0 and self.scan_mode == 'Step':
+                resume = run_journal.find_interrupted(os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', self.sample)), journal_settings)
             # Getting date-time
-            now = dt.datetime.now()
-            datetime = str(now.strftime("%Y-%m-%d %H:%M").replace(" ","").replace(":","").replace("-",""))
-            self.queue.put('Measurement code : ' + self.sample + datetime + '  (OLED device code followed by the datetime of measurement).')
+            if self.sweeps is not None:
+                datetime = self.sweeps.datetime # repeated sweep into the same run folder
+            elif resume is not None:
+                datetime = resume.datetime
+            else:
+                now = dt.datetime.now()
+                datetime = str(now.strftime("%Y-%m-%d %H:%M").replace(" ","").replace(":","").replace("-",""))
+            self.queue.progress('Measurement code : ' + self.sample + datetime + '  (OLED device code followed by the datetime of measurement).')
             # Set directories for recorded data.
             directory = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', self.sample, datetime, 'raw')) # Folder to separate raw and processed data
             if os.path.isdir(directory):
@@ -1081,6 +1656,12 @@ class PLTASK(threading.Thread):
             "SETTING FILE DETAILS"
             # Filename Parameters
             mayafilepath = os.path.join(directory, 'spectrumdata')
+            backgroundfilepath = directory
+            if self.target_error > 0:
+                # Repeated sweeps: the last sweep is kept in 'lastsweep', the average is written to 'spectrumdata'
+                averagefilepath = mayafilepath
+                mayafilepath = os.path.join(directory, 'lastsweep')
+                backgroundfilepath = mayafilepath
             if os.path.isdir(mayafilepath):
                 pass
             else:
@@ -1091,7 +1672,8 @@ class PLTASK(threading.Thread):
             line01 = 'Measurement code : ' + self.sample + datetime
             line02 = 'Measurement programme :	"GatherLab Goniometer Measurement System".py'
             linex = 'Credits :	GatherLab, University of St Andrews, 2020'
-            linexx = 'Integration Time:  ' + str(self.integrationtime) + 'micro s'
+            self.spec.reduction = spectral_roi.SpectralReduction(self.spec.raw_wavelengths(), self.spectral_mode)
+            linexx = 'Integration Time:  ' + str(self.integrationtime) + 'micro s   ' + self.spec.reduction.description()
             line03 = 'Pulse duration :		' + str(self.pulse_duration) + ' s'
             line04 = 'Step time between voltages :		' + str(self.moving_time) + ' s'
             line05 = 'Offset angle:     ' + str(self.offset_angle)
@@ -1109,17 +1691,17 @@ class PLTASK(threading.Thread):
             header_lines3 = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line12, line13] # Spectrum Data
             
             "MOVING TO INITIAL POSITION"       
-            DEVICES.PLmotor.move_to(self.min_angle) 
+            self.motor.move_to(self.min_angle) 
             time.sleep(self.homing_time)
             
-            self.queue.put('\nOceanOptics : '+ str(DEVICES.MAYA_devices[0]))
-            DEVICES.spec.integration_time_micros(self.integrationtime) 
+            self.queue.progress('\nOceanOptics : '+ str(DEVICES.MAYA_devices[0]))
+            self.spec.integration_time_micros(self.integrationtime) 
                         
             "#####################################################################"
             "####TAKING MEASUREMENTS FROM THE OCEANOPTICS MAYALSL SPECTROMETER####"
             "#####################################################################"
             
-            self.queue.put("\n\nSPECTROMETER READINGS") 
+            self.queue.progress("\n\nSPECTROMETER READINGS") 
             
             "IMPLEMENTATION"
             # Generate empty lists for data collection
@@ -1129,53 +1711,123 @@ class PLTASK(threading.Thread):
             spect = [] # Spectrums
             
             # Take calibration readings
-            spectrum = DEVICES.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
-            np.savetxt(os.path.join(directory, mayafilename), spectrum.T, fmt='%.4f %.0f', delimiter='\t', header='\n'.join(header_lines3), comments='')
+            spectrum = self.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
+            if resume is None: # the background of an interrupted sweep is kept
+                np.savetxt(os.path.join(backgroundfilepath, mayafilename), spectrum.T, fmt='%.4f ' + self.spec.reduction.fmt, delimiter='\t', header='\n'.join(header_lines3), comments='')
+            background = spectrum
             processing_time = 0.5 # Initial processing time in seconds   
+            
+            journal = None
+            if resume is not None:
+                "CHECKING THE INTERRUPTED SWEEP FOR DRIFT"
+                reference = None
+                if resume.reference is not None:
+                    self.motor.move_to(self.offset_angle)
+                    time.sleep(self.homing_time)
+                    reference = run_journal.integrated(self.spec.intensities(), background[1])
+                drift = resume.drift(background[1], reference)
+                self.queue.progress('\nDrift since the interruption :  dark ' + '%.2f' % (100 * drift['dark']) + ' %' +
+                               ('' if drift['reference'] is None else ',  perpendicular intensity ' + '%.2f' % (100 * drift['reference']) + ' %'))
+                if not resume.resumable(drift):
+                    resume.abandon(drift)
+                    self.queue.warning('\nDRIFT ABOVE TOLERANCE, STARTING A NEW RUN')
+                    continue
+                resume.resume(drift)
+                journal = resume
+                ang = [record['label'] for record in journal.angles]
+                self.queue.progress('\nRESUMING THE INTERRUPTED SWEEP AFTER ' + str(len(ang)) + ' ANGLES')
+            elif self.scan_mode == 'Step' and self.target_error == 0:
+                journal = run_journal.RunJournal(directory)
+                journal.start(journal_settings, background[1])
                         
-            for angle in np.arange(self.min_angle, self.max_angle + 1, self.step_angle):           
-                DEVICES.PLmotor.move_to(angle)
-                time.sleep(self.moving_time)
-                
-                time.sleep(self.pulse_duration)                
-                time.sleep(self.pulse_duration - processing_time)
+            if self.scan_mode == 'Fly':
+                # Continuous rotation while streaming spectra, interpolated onto the angle grid (see flyscan.py)
+                self.queue.progress('\nFly scan at ' + str(flyscan.velocity_for_step(self.step_angle, self.integrationtime)) + ' deg/s')
                 start_process = time.clock()
+                result = flyscan.FlyScan(self.motor, self.spec, self.min_angle, self.max_angle, self.step_angle, self.integrationtime,
+                                         running=lambda: self.running).run()
+                self.queue.progress('\nProcessing time :  '+str(time.clock() - start_process))
+                flyscan.save_trace(directory, result, header_lines3[:9])
+                if len(result['grid']) == 0:
+                    self.queue.warning('\nFEWER THAN TWO SPECTRA IN THE FLY SCAN, NO ANGLE FILES WRITTEN')
+                elif len(result['grid']) < len(np.arange(self.min_angle, self.max_angle + 1, self.step_angle)):
+                    self.queue.warning('\nFLY SCAN STOPPED AFTER ' + str(len(result['grid'])) + ' ANGLES, NO FILES FOR THE OTHERS')
+                for angle, intensity in zip(result['grid'], result['spectra']):
+                    ang.append(relative_angle(angle, self.offset_angle, self.ang_range))
+                    mayafilename = os.path.abspath(os.path.join(mayafilepath, 'Angle'+str(ang[-1]).zfill(3)+'.txt'))
+                    np.savetxt(mayafilename, np.stack((result['wavelengths'], intensity)).T, fmt='%.3f %.1f', delimiter='\t', header='\n'.join(header_lines3), comments='')
+                if len(result['grid']):
+                    self.queue.spectrum(result['wavelengths'], result['spectra'][len(result['grid'])//2])
+            else:
+                disk = instrument_executor.InstrumentWorker('Data files', instrument_executor.DISK_TIMEOUT) # writes the file of an angle during the next move
+                saving = None
+                for angle in np.arange(self.min_angle, self.max_angle + 1, self.step_angle):           
+                    if journal is not None and journal.done(angle):
+                        continue # completed before the interruption
+                    self.motor.move_to(angle)
+                    time.sleep(self.moving_time)
+                
+                    time.sleep(self.pulse_duration)                
+                    time.sleep(self.pulse_duration - processing_time)
+                    start_process = time.clock()
                 
-                wavelength = DEVICES.spec.wavelengths() # creates a list of wavelengths
-                intensity = DEVICES.spec.intensities() # creates a list of intensities
-                spectrum = DEVICES.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
-                wvl.append(wavelength) # adding to a master list (may not be necessary with txt file outputs)
-                inte.append(intensity) # adding to a master list (may not be necessary with txt file outputs)
-                spect.append(spectrum) # adding to a master list (may not be necessary with txt file outputs)
+                    wavelength = self.spec.wavelengths() # creates a list of wavelengths
+                    intensity = self.spec.intensities() # creates a list of intensities
+                    spectrum = self.spec.spectrum() # this gives a pre-stacked array of wavelengths and intensities
+                    wvl.append(wavelength) # adding to a master list (may not be necessary with txt file outputs)
+                    inte.append(intensity) # adding to a master list (may not be necessary with txt file outputs)
+                    spect.append(spectrum) # adding to a master list (may not be necessary with txt file outputs)
                                         
-                "DISPLAYING SPECTRUM AS A PLOT"                            
-                self.queue.put([wavelength,intensity])
+                    "DISPLAYING SPECTRUM AS A PLOT"                            
+                    self.queue.spectrum(wavelength,intensity)
                 
-                "SPECTRUM OUTPUT FILE"
-                # Angle is written as 0 -> 180 rather than -90 -> 90
-                if self.ang_range == 'F':
-                    mayafilename = 'Angle'+str(angle + 90 - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
-                elif self.ang_range == 'HL':
-                    mayafilename = 'Angle'+str(angle - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
-                elif self.ang_range == 'HR':
-                    mayafilename = 'Angle'+str(self.offset_angle - angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
-                mayafilename = os.path.abspath(os.path.join(mayafilepath, mayafilename))
-                np.savetxt(mayafilename, spectrum.T, fmt='%.3f %.0f', delimiter='\t', header='\n'.join(header_lines3), comments='')
-                end_process = time.clock()
-                processing_time = end_process - start_process
-                self.queue.put('\nProcessing time :  '+str(processing_time))
+                    "SPECTRUM OUTPUT FILE"
+                    # Angle is written as 0 -> 180 rather than -90 -> 90
+                    if self.ang_range == 'F':
+                        mayafilename = 'Angle'+str(angle + 90 - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
+                    elif self.ang_range == 'HL':
+                        mayafilename = 'Angle'+str(angle - self.offset_angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
+                    elif self.ang_range == 'HR':
+                        mayafilename = 'Angle'+str(self.offset_angle - angle).zfill(3)+'.txt' # changing mayalsl filename for actual readings
+                    mayafilename = os.path.abspath(os.path.join(mayafilepath, mayafilename))
+                    end_process = time.clock()
+                    processing_time = end_process - start_process
+                    self.queue.progress('\nProcessing time :  '+str(processing_time))
                 
-                if self.ang_range == 'F':
-                    self.queue.put('\nAngle : '+str(angle + 90 - self.offset_angle))
-                    ang.append(angle + 90 - self.offset_angle)
-                elif self.ang_range == 'HL':
-                    self.queue.put('\nAngle : '+str(angle - self.offset_angle))
-                    ang.append(angle - self.offset_angle)
-                elif self.ang_range == 'HR':
-                    self.queue.put('\nAngle : '+str(self.offset_angle - angle))
-                    ang.append(self.offset_angle - angle)
+                    if self.ang_range == 'F':
+                        self.queue.progress('\nAngle : '+str(angle + 90 - self.offset_angle))
+                        ang.append(angle + 90 - self.offset_angle)
+                    elif self.ang_range == 'HL':
+                        self.queue.progress('\nAngle : '+str(angle - self.offset_angle))
+                        ang.append(angle - self.offset_angle)
+                    elif self.ang_range == 'HR':
+                        self.queue.progress('\nAngle : '+str(self.offset_angle - angle))
+                        ang.append(self.offset_angle - angle)
+                    record = dict(angle=angle, label=ang[-1], voltage=None, current=None, integral=run_journal.integrated(intensity, background[1]),
+                                  reference=abs(angle - self.offset_angle) < 1e-6)
+                    if saving is not None:
+                        saving.result() # the file of the previous angle is written (raises its error)
+                    saving = disk.submit(save_angle, mayafilename, spectrum, '%.3f ' + self.spec.reduction.fmt, list(header_lines3), journal, record)
+                if saving is not None:
+                    saving.result()
+                disk.close()
+            
+            if self.target_error > 0 and (self.scan_mode != 'Fly' or self.running == True):
+                "AVERAGING REPEATED SWEEPS"
+                if self.sweeps is None:
+                    self.sweeps = sweep_statistics.SweepAverage(ang, background[0], datetime, self.target_error, self.max_sweeps)
+                self.sweeps.add(result['spectra'] if self.scan_mode == 'Fly' else inte, background[1])
+                self.sweeps.save(averagefilepath, os.path.join(directory, 'Background.txt'), header_lines3[:9])
+                self.queue.progress('\nSweeps averaged : ' + str(self.sweeps.count) + ',  relative error of the integrated intensity : ' + str(100 * self.sweeps.relative_error()) + ' %')
+                if self.sweeps.converged():
+                    self.queue.progress('\nTARGET ERROR OR MAXIMUM NUMBER OF SWEEPS REACHED')
+                    self.running = False
+            if journal is not None:
+                journal.complete()
+            if self.target_error == 0 or self.running == False: # repeated sweeps: after the last one
+                goniometer_run.mark_complete(directory) # the run can be packed (see run_archive.py)
                
-            self.queue.put('\n\nMEASUREMENT COMPLETE') 
+            self.queue.progress('\n\nMEASUREMENT COMPLETE') 
                             
 gui = GUI("GatherLab Goniometer Measurement System")
 ELtab = gui.add_tab('EL Measurement',[1,2,3,4])
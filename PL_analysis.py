@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the analysis of angle-resolved PL measurements of thin films (PL Measurement tab of
+Goniometer_measurement.py). It determines the orientation of the transition dipoles of the emitter, i.e. the ratio of
+horizontal dipoles Theta (0.67 for isotropic, 1 for fully horizontal), from the p-polarised emission between 0 and 90deg.
+
+Required files:
+	- 'library' folder with
+		- "Photopic_response.txt" (wavelength axis 400-800nm)
+		- 'CalibrationData.txt'(converison from counts into intensity)
+	- 'data' folder
+	  with sample folder
+		-'batch' folder
+		with sample folder again
+	- in both sample folders:
+			'datetime' folder
+				'raw' folder with the Background.txt file
+					'spectrumdata' folder with the text files Angle0.txt to Angle90.txt (half 90 LHS range)
+
+The analysis:
+	- loads the sweep as one (angles x pixels) matrix, interpolates it onto the 400-800nm axis, subtracts the
+	  background and multiplies by the spectrometer calibration
+	- models the p-polarised emission of horizontal and vertical dipoles in the thin-film stack (substrate / layers below /
+	  emitting layer / layers above / ambient) on the whole angle x wavelength grid with batched transfer matrices
+	- fits Theta with a free emission spectrum for every wavelength; the layer matrices are calculated once and reused for
+	  every emitter position and Theta in the fit
+
+The default stack is a single emitting film on glass measured through a glass half-cylinder, the angles are then angles
+in the substrate. Adjust the stack in "SETTING KNOWN PARAMETERS" to the measured sample.
+
+The output of this program is created in the sample folder in the 'data' folder:
+    - creates a 'processedPL' folder with the results
+		'sample_name'_orientation.txt (Theta, emitter position and residual of the fit)
+		'sample_name'_PLmap.txt (normalised measured intensity for all angles and wavelengths)
+		'sample_name'_PLfit.txt (measured and fitted intensity against angle at the peak wavelength)
+		and
+		2 PNG files with the map and the fit.
+"""
+
+"IMPORTING REQUIRED MODULES"
+# General Modules
+import os, shutil
+import numpy as np
+import matplotlib.pyplot as mpl
+import datetime as dt
+# Run data model
+from goniometer_run import GoniometerRun
+
+"FUNCTIONS AND DEFAULT SETTINGS"
+def resample(spectra, wavelengths, axis):
+    """
+    Linear interpolation of all spectra (rows) from the spectrometer wavelengths onto a new axis with one set of weights.
+    """
+    upper = np.clip(np.searchsorted(wavelengths, axis), 1, len(wavelengths) - 1)
+    lower = upper - 1
+    weight = np.clip((axis - wavelengths[lower]) / (wavelengths[upper] - wavelengths[lower]), 0, 1)
+    spectra = np.asarray(spectra)
+    return spectra[:, lower] * (1 - weight) + spectra[:, upper] * weight
+
+def movingaverage(spectra, window_size):
+    """
+    Smoothing function for all spectra (rows), same as in EL_analysis.py.
+    """
+    window = np.ones(int(window_size))/float(window_size)
+    return np.apply_along_axis(lambda x: np.convolve(x, window, 'same'), -1, spectra)
+
+def index_on_axis(n, wavelength):
+    """
+    Refractive index on the wavelength axis; n can be a number, an array on the axis or a function of the wavelength (nm).
+    """
+    if callable(n):
+        n = n(wavelength)
+    return np.asarray(n, dtype=complex) * np.ones(np.shape(wavelength))
+
+def cosine(n, u):
+    """
+    Complex cosine of the propagation angle in a medium of index n for the in-plane wavevector u = n_substrate sin(theta).
+    The branch is chosen so that evanescent waves decay.
+    """
+    cos = np.sqrt(1 - (u / n)**2 + 0j)
+    cos = np.where(np.abs(cos) < 1e-12, 1e-12, cos) # grazing incidence, avoids an infinite admittance
+    return np.where(np.imag(cos) < 0, -cos, cos)
+
+def stack_response(n_start, layers, n_end, u, wavelength):
+    """
+    Tangential-field reflection and transmission of a layer stack for p-polarisation (characteristic matrices).
+
+    n_start: np.array
+        index of the medium the wave comes from (on the wavelength axis).
+    layers: list of (n, thickness in nm)
+        layers in the order the wave passes them.
+    n_end: np.array
+        index of the semi-infinite medium at the end of the stack.
+    u, wavelength: np.array
+        (angles x wavelengths) in-plane wavevector and wavelength grids.
+
+    returns:
+        r, t: np.array
+            (angles x wavelengths) reflection and transmission coefficients of the tangential electric field.
+    """
+    eta_start = n_start / cosine(n_start, u)
+    eta_end = n_end / cosine(n_end, u)
+    B = np.ones(u.shape, dtype=complex)
+    C = eta_end * np.ones(u.shape, dtype=complex)
+    for n, thickness in reversed(layers):
+        n = index_on_axis(n, wavelength)
+        cos = cosine(n, u)
+        eta = n / cos
+        delta = 2 * np.pi * n * thickness * cos / wavelength
+        B, C = np.cos(delta) * B + 1j * np.sin(delta) / eta * C, 1j * eta * np.sin(delta) * B + np.cos(delta) * C
+    r = (eta_start * B - C) / (eta_start * B + C)
+    t = (1 + r) / B
+    return r, t
+
+class DipoleModel(object):
+    """
+    p-polarised emission of horizontal and vertical dipoles in the emitting layer of a thin-film stack, evaluated on the
+    whole angle x wavelength grid.
+
+    The reflection and transmission of the layers above and below the emitting layer do not depend on the position of
+    the emitter and are calculated once when the model is created; emission(position) only updates the phases.
+
+    angles: np.array
+        angles of the measurement in the substrate (deg).
+    wavelength: np.array
+        wavelength axis (nm).
+    n_substrate, n_emitter, n_ambient: float, array or function of the wavelength
+        refractive indices.
+    thickness: float
+        thickness of the emitting layer (nm).
+    layers_below, layers_above: list of (n, thickness in nm)
+        layers between substrate and emitting layer and between emitting layer and ambient, both listed from the
+        emitting layer outwards.
+    """
+
+    def __init__(self, angles, wavelength, n_substrate, n_emitter, thickness, n_ambient=1.0, layers_below=[], layers_above=[]):
+        theta, wavelength = np.meshgrid(np.deg2rad(angles), wavelength, indexing='ij')
+        self.wavelength = wavelength
+        self.thickness = thickness
+        n_substrate = index_on_axis(n_substrate, wavelength)
+        n_emitter = index_on_axis(n_emitter, wavelength)
+        n_ambient = index_on_axis(n_ambient, wavelength)
+        self.u = n_substrate * np.sin(theta)
+        self.cos_emitter = cosine(n_emitter, self.u)
+        self.sin_emitter = self.u / n_emitter
+        self.kz = 2 * np.pi * n_emitter * self.cos_emitter / wavelength
+
+        # Precomputed layer matrices: looking up to the ambient and down into the substrate
+        self.r_top, t_top = stack_response(n_emitter, layers_above, n_ambient, self.u, wavelength)
+        self.r_bottom, self.t_bottom = stack_response(n_emitter, layers_below, n_substrate, self.u, wavelength)
+        self.cavity = 1 - self.r_top * self.r_bottom * np.exp(2j * self.kz * thickness)
+        self.prefactor = np.real(n_substrate)**3 / np.abs(n_emitter)**2 * np.abs(self.t_bottom)**2 / np.abs(self.cavity)**2
+
+    def emission(self, position):
+        """
+        Emission of horizontal and vertical dipoles at a position in the emitting layer.
+
+        position: float
+            distance of the emitter from the substrate side of the emitting layer as fraction of its thickness.
+
+        returns:
+            horizontal, vertical: np.array
+                (angles x wavelengths) p-polarised radiant intensity per unit horizontal and vertical dipole fraction
+                (the horizontal dipoles are isotropic in plane, half of them emit p-polarised light).
+        """
+        z_bottom = position * self.thickness
+        z_top = self.thickness - z_bottom
+        phase_top = self.r_top * np.exp(2j * self.kz * z_top)
+        decay = np.abs(np.exp(1j * self.kz * z_bottom))**2
+        horizontal = 0.5 * self.prefactor * decay * np.abs(self.cos_emitter)**2 * np.abs(1 + phase_top)**2
+        vertical = self.prefactor * decay * np.abs(self.sin_emitter)**2 * np.abs(1 - phase_top)**2
+        return horizontal, vertical
+
+def fit_orientation(intensity, model, positions=np.linspace(0, 1, 11), thetas=np.linspace(0, 1, 101), refine=10):
+    """
+    Fit the horizontal dipole ratio to an (angles x wavelengths) p-polarised intensity matrix.
+
+    The emission spectrum is free for every wavelength (linear least squares in closed form), Theta and the emitter
+    position are found on grids; all Thetas are evaluated at once for every position, the grid is refined around the
+    best value.
+
+    returns:
+        fit: dict
+            'theta', 'position', 'residual' (relative), 'spectrum' (wavelengths) and 'model' (angles x wavelengths).
+    """
+    norm = np.sum(intensity**2)
+    best = None
+    for position in positions:
+        horizontal, vertical = model.emission(position)
+        grid = thetas
+        for step in range(refine):
+            models = grid[:, None, None] * horizontal + (1 - grid[:, None, None]) * vertical
+            spectra = np.sum(models * intensity, axis=1) / np.sum(models**2, axis=1)
+            residuals = np.sum((intensity - spectra[:, None, :] * models)**2, axis=(1, 2)) / norm
+            k = np.argmin(residuals)
+            if best is None or residuals[k] < best['residual']:
+                best = {'theta': grid[k], 'position': position, 'residual': residuals[k],
+                        'spectrum': spectra[k], 'model': spectra[k][None, :] * models[k]}
+            width = (grid[1] - grid[0]) if len(grid) > 1 else 0
+            if width < 1e-4:
+                break
+            grid = np.linspace(max(grid[k] - width, 0), min(grid[k] + width, 1), 11)
+    return best
+
+"SETTING KNOWN PARAMETERS"
+now = dt.datetime.now() # Set the start time
+start_time = str(now.strftime("%Y-%m-%d %H:%M").replace(" ","").replace(":","").replace("-",""))
+
+# Loading the wavelength axis
+wavelength = np.loadtxt(os.path.join(os.path.dirname(__file__),'library','Photopic_response.txt'))[:,0]
+
+# Loading the spectrometer calibration factors -  this converts the counts/nm/sr into W/nm/sr (responsivity function of the spectrometer and transmission of the fibre)
+calibrationwvl = np.array(np.loadtxt(os.path.join(os.path.dirname(__file__),'library','CalibrationData.txt'))[:,0])
+calibration = np.array(np.loadtxt(os.path.join(os.path.dirname(__file__),'library','CalibrationData.txt'))[:,1])
+calibration = np.interp(wavelength, calibrationwvl, calibration) # interpolate calibration factor onto correct axis
+
+# Thin-film stack
+n_substrate = 1.52 # glass substrate and half-cylinder, the angles are angles in the glass
+n_emitter = 1.75 # emitting layer
+thickness = 20.0 # thickness of the emitting layer in nm
+n_ambient = 1.0 # nitrogen / air above the film
+layers_below = [] # (n, thickness in nm) between substrate and emitting layer, from the emitting layer outwards
+layers_above = [] # (n, thickness in nm) between emitting layer and ambient, from the emitting layer outwards
+
+# Fit settings
+fit_threshold = 0.1 # wavelengths with less than this fraction of the peak intensity are not fitted
+max_fit_angle = 89.0 # deg, grazing angles are excluded
+
+datadirectory = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
+
+"ANALYSIS OF ONE RUN"
+def analyse_run(sample, datetime, datadirectory=datadirectory):
+    """
+    Analyse one PL run, i.e. the 'raw' folder of datadirectory/sample/datetime, and write the results to its 'processedPL' folder.
+
+    returns:
+        results: dict
+            'theta', 'position', 'residual' of the orientation fit, 'angles', 'intensities' (angles x wavelengths).
+    """
+    sampledirectory = os.path.abspath(os.path.join(datadirectory, sample, datetime))
+    processdirectory = os.path.abspath(os.path.join(sampledirectory, 'processedPL'))
+    run = GoniometerRun(sampledirectory)
+    if os.path.isdir(processdirectory):
+        shutil.rmtree(processdirectory)
+    os.makedirs(processdirectory)
+
+    print("\nIMPORTING DATA...")
+    angles = run.angles
+    background = np.interp(wavelength, run.background_wavelengths, run.background)
+    intensities = (resample(run.spectra, run.wavelengths, wavelength) - background) * calibration
+    intensities = movingaverage(intensities, 10)
+    print("Spectra loaded for " + str(len(angles)) + " angles...")
+
+    print("\nFITTING DIPOLE ORIENTATION...")
+    perp = intensities[np.argmin(np.abs(angles))]
+    fitted_wavelengths = perp > fit_threshold * np.max(perp)
+    fitted_angles = np.abs(angles) <= max_fit_angle
+    model = DipoleModel(angles[fitted_angles], wavelength[fitted_wavelengths], n_substrate, n_emitter, thickness,
+                        n_ambient, layers_below, layers_above)
+    data = intensities[fitted_angles][:, fitted_wavelengths]
+    fit = fit_orientation(data / np.max(data), model)
+    print("Horizontal dipole ratio: " + str(round(fit['theta'], 3)))
+
+    "EXPORTING"
+    print("\nEXPORTING...")
+    line01 = 'Measurement code : ' + sample + datetime
+    line02 = 'Calculation programme :	PL_analysis.py'
+    linex =  'Credits :	GatherLab, University of St Andrews'
+    linexx = 'Measurement time : ' + datetime + '\tAnalysis time :' + start_time
+    line03 = 'Substrate index:     ' + str(n_substrate) + '  Emitter index:     ' + str(n_emitter) + '  Ambient index:     ' + str(n_ambient)
+    line04 = 'Emitting layer thickness:   ' + str(thickness) + ' nm'
+    line05 = 'Layers below:   ' + str(layers_below) + '  Layers above:   ' + str(layers_above)
+    line06 = 'Horizontal dipole ratio:     ' + '%.3f' % fit['theta']
+    line07 = 'Emitter position:     ' + '%.2f' % fit['position']
+    line08 = ''
+    line09 = '### Formatted data ###'
+    header_lines = [line01, line02, linex, linexx, line03, line04, line05, line06, line07, line08, line09]
+
+    np.savetxt(os.path.join(processdirectory, sample+'_orientation.txt'), np.array([[fit['theta'], fit['position'], fit['residual']]]),
+               fmt='%.4f %.3f %.4e', header='\n'.join(header_lines + ['Theta    Position    Residual', '-    fraction    relative']), comments='')
+    normintensities = intensities / np.amax(intensities)
+    intensitydata = np.hstack((np.hstack([0, angles]).reshape(-1, 1), np.vstack((wavelength, normintensities))))
+    np.savetxt(os.path.join(processdirectory, sample+'_PLmap.txt'), intensitydata.T, fmt='%.6f', delimiter='\t',
+               header='\n'.join(header_lines + ['Intensity for all Wavelengths / Angles']), comments='')
+    peak = np.argmax(fit['spectrum'])
+    fitdata = np.stack((angles[fitted_angles], data[:, peak] / np.max(data), fit['model'][:, peak]))
+    np.savetxt(os.path.join(processdirectory, sample+'_PLfit.txt'), fitdata.T, fmt='%.2f %.4f %.4f', delimiter='\t',
+               header='\n'.join(header_lines + ['Peak wavelength:  ' + str(wavelength[fitted_wavelengths][peak]) + ' nm',
+                                                'angles    Measured    Fit', 'degree    a.u.    a.u.']), comments='')
+
+    mpl.figure(1, figsize = (10,8))
+    intemap = mpl.contourf(angles,wavelength,normintensities.T,50,cmap=mpl.cm.jet)
+    mpl.title('Normalised PL Intensity over all Angles and Wavelengths\n', fontsize=20)
+    mpl.xlabel('Angle (degrees)', fontsize=20)
+    mpl.ylabel('Wavelength (nm)', fontsize=20)
+    mpl.colorbar(intemap)
+    mpl.tick_params(axis='both', labelsize=20)
+    mpl.savefig(os.path.join(processdirectory, sample+'_PLmap.png'), dpi = 500)
+
+    mpl.figure(2, figsize = (10,8))
+    mpl.plot(fitdata[0], fitdata[1], 'o', markersize = 3, label = "Measured")
+    mpl.plot(fitdata[0], fitdata[2], linewidth = 1.0, label = "Fit, Theta = " + '%.3f' % fit['theta'])
+    mpl.title('p-polarised Emission at ' + str(wavelength[fitted_wavelengths][peak]) + ' nm\n', fontsize=20)
+    mpl.xlabel('Angle (degrees)', fontsize=20)
+    mpl.ylabel('Intensity (a.u.)', fontsize=20)
+    mpl.legend(loc='upper right', fontsize=14)
+    mpl.tick_params(axis='both', labelsize=14)
+    mpl.savefig(os.path.join(processdirectory, sample+'_PLfit.png'), dpi = 500)
+    mpl.close('all')
+
+    print("FINISHED.")
+    return {'theta': fit['theta'], 'position': fit['position'], 'residual': fit['residual'],
+            'angles': angles, 'intensities': intensities}
+
+"ANALYSING ALL RUNS IN THE BATCH FOLDER"
+if __name__ == '__main__':
+    batch = os.path.abspath(os.path.join(datadirectory, 'batch'))
+    for sample in os.listdir(batch):
+        for datetime in os.listdir(os.path.abspath(os.path.join(batch, sample))):
+            analyse_run(sample, datetime)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for finding the normal of a sample (the offset angle of the motor) in Goniometer_measurement.py
+('Align' mode of the EL and PL tab). The angular emission is symmetric about the normal, so the normal is the angle c
+for which the intensity at c + u and c - u is the same for every u. The search runs from coarse to fine around the
+entered (nominal) offset angle, with short integrations of the spectrometer:
+	- coarse: the integrated intensity from nominal - SPAN - HALF_WIDTH to nominal + SPAN + HALF_WIDTH in steps of
+	  STEPS[0], the normal is the candidate within +/- SPAN with the smallest asymmetry
+	- fine (every further step of STEPS): only the flanks on both sides of the normal found so far, where the
+	  intensity changes fastest with the angle and the asymmetry is most sensitive to the normal (the emission is flat
+	  around the normal itself)
+The asymmetry of a candidate c is the mean of (I(c + u) - I(c - u))^2 over the compared distances u, relative to the
+mean of I^2, with I interpolated between the measured angles; the minimum is refined with a parabola. The result is
+used as the offset angle of the tab for the rest of the session.
+
+Example:
+	result = align(lambda angle: intensity at the motor angle, 318.0)
+	result['offset'], result['asymmetry']
+"""
+
+"IMPORTING REQUIRED MODULES"
+import numpy as np
+
+"DEFAULT SETTINGS"
+INTEGRATION_TIME = 20000 # microseconds, spectra taken for the alignment
+SPAN = 5.0 # deg, the normal is searched within the nominal offset angle +/- SPAN
+HALF_WIDTH = 40.0 # deg, distances from the normal compared in the coarse scan
+STEPS = (2.0, 0.5, 0.1) # deg, angle steps from coarse to fine
+WINDOW = 5 # steps on both sides of the flank in a fine scan
+CANDIDATES = 5 # candidates per step
+
+"FUNCTIONS"
+def asymmetry(angles, signal, centre, distances):
+    """
+    Mean of (I(centre + u) - I(centre - u))^2 over the distances u, relative to the mean of I^2.
+
+    angles: numpy.ndarray
+        measured angles, ascending.
+    signal: numpy.ndarray
+        intensity at these angles.
+    """
+    right = np.interp(centre + distances, angles, signal)
+    left = np.interp(centre - distances, angles, signal)
+    return np.mean((right - left)**2) / max(np.mean((right + left)**2) / 4.0, 1e-300)
+
+def symmetry_centre(angles, signal, candidates, distances):
+    """
+    Candidate with the smallest asymmetry, refined by a parabola through its neighbours.
+
+    returns:
+        centre: float
+        asymmetry: float
+            asymmetry at the best candidate.
+    """
+    values = np.array([asymmetry(angles, signal, c, distances) for c in candidates])
+    best = int(np.argmin(values))
+    centre = candidates[best]
+    if 0 < best < len(candidates) - 1:
+        a, b, c = values[best - 1], values[best], values[best + 1]
+        if a - 2*b + c > 0:
+            centre += 0.5 * (a - c) / (a - 2*b + c) * (candidates[1] - candidates[0])
+    return float(centre), float(values[best])
+
+def steepest_flank(angles, signal, centre, step, half_width):
+    """
+    Distance from the centre at which the intensity changes fastest on both sides together.
+    """
+    distances = np.arange(step, half_width + step / 2.0, step)
+    slope = np.abs(np.gradient(np.interp(centre + distances, angles, signal), step)) + \
+            np.abs(np.gradient(np.interp(centre - distances, angles, signal), step))
+    return float(distances[np.argmax(slope)])
+
+"ALIGNMENT"
+def align(measure, nominal, span=SPAN, half_width=HALF_WIDTH, steps=STEPS, running=None):
+    """
+    Find the normal around the nominal offset angle.
+
+    measure: function
+        measure(angle) moves the motor to angle, waits until it stands there and returns the integrated intensity.
+    nominal: float
+        entered offset angle (motor angle).
+    running: function
+        running() is False once the measurement is stopped, the search then ends with the result so far.
+
+    returns:
+        result: dict
+            'offset' (the normal, motor angle), 'asymmetry', 'levels' ((step, normal, asymmetry) of every level),
+            'angles' and 'signal' (all measured angles, ascending, and their intensities).
+    """
+    measured = {}
+    def scan(angles):
+        for angle in angles:
+            if running is not None and not running():
+                return False
+            angle = round(float(angle), 6)
+            if angle not in measured:
+                measured[angle] = float(measure(angle))
+        return True
+
+    def profile():
+        angles = np.array(sorted(measured))
+        return angles, np.array([measured[a] for a in angles])
+
+    # Coarse scan over the whole range
+    step = steps[0]
+    if not scan(nominal + np.arange(-(span + half_width), span + half_width + step / 2.0, step)):
+        return None
+    angles, signal = profile()
+    centre, value = symmetry_centre(angles, signal, nominal + np.arange(-span, span + step / (2.0 * CANDIDATES), step / CANDIDATES),
+                                    np.arange(step, half_width + step / 2.0, step))
+    levels = [(step, centre, value)]
+    flank = steepest_flank(angles, signal, centre, step, half_width)
+
+    # Fine scans of the flanks
+    for previous, step in zip(steps[:-1], steps[1:]):
+        width = WINDOW * step + 2 * previous # the normal is within +/- 2 previous steps
+        window = np.arange(-width, width + step / 2.0, step)
+        if not scan(np.concatenate((centre - flank + window, centre + flank + window))):
+            break
+        angles, signal = profile()
+        # compared over the window of the first fine scan, the finer scans add measured angles within it
+        centre, value = symmetry_centre(angles, signal, centre + np.arange(-2 * previous, 2 * previous + step / (2.0 * CANDIDATES), step / CANDIDATES),
+                                        flank + np.arange(-WINDOW * steps[1], WINDOW * steps[1] + step / 2.0, step))
+        levels.append((step, centre, value))
+    angles, signal = profile()
+    return {'offset': centre, 'asymmetry': value, 'levels': levels, 'angles': angles, 'signal': signal}
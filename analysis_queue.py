@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for analysing the runs in the 'data' folder with several workers (processing nodes that see the same
+'data' share, or several processes on one computer). The work queue only uses the file system of the share:
+	- a job is one pass over all runs, by default named after the spectrometer calibration ('calibration-' and the
+	  first 8 hex digits of the MD5 of CalibrationData.txt), so after a calibration update every run is analysed again
+	- 'data'/'queue'/job/'claims'/run: a worker claims a run (sample__datetime) by creating this folder; os.mkdir is
+	  atomic on local disks and network shares, so only one worker gets it. The folder holds the owner (host, process)
+	  and a heartbeat file that the worker touches every HEARTBEAT s while it analyses the run
+	- a claim whose heartbeat is older than STALE_AFTER s (worker crashed or node lost) is recovered: it is renamed
+	  (atomic, only one worker succeeds) and deleted, and the run is claimed again
+	- the run is analysed in a staging copy ('data'/'queue'/job/'staging') and published by renaming the new
+	  'processedEL' folder into the run folder, so the run folder never holds a partly written analysis
+	- 'done'/run or 'failed'/run (with the traceback) is written when a run is finished, the claim is removed
+Workers do not write to the results index (SQLite is not safe with several writers on a network share).
+
+Usage:
+	python analysis_queue.py worker [job]        # on every node, until all runs of the job are done
+	python analysis_queue.py local [processes] [job]  # several workers on this computer (multiprocessing)
+	python analysis_queue.py status [job]
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import hashlib
+import threading
+import traceback
+import multiprocessing
+
+"DEFAULT SETTINGS"
+DATA_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
+HEARTBEAT = 30.0 # s
+STALE_AFTER = 600.0 # s without heartbeat until a claim is recovered
+SKIP = ['batch', 'queue', 'golden'] # folders in 'data' that are not samples
+
+"FUNCTIONS"
+def default_job():
+    """
+    Job name of the current calibration.
+    """
+    with open(os.path.join(os.path.dirname(__file__), 'library', 'CalibrationData.txt'), 'rb') as f:
+        return 'calibration-' + hashlib.md5(f.read()).hexdigest()[:8]
+
+def find_runs(datadirectory=DATA_DIRECTORY):
+    """
+    All EL runs (sample, datetime) in the data folder, i.e. folders with 'raw'/'keithleydata' or packed runs ('raw.npz').
+    """
+    runs = []
+    for sample in sorted(os.listdir(datadirectory)):
+        if sample in SKIP or not os.path.isdir(os.path.join(datadirectory, sample)):
+            continue
+        for datetime in sorted(os.listdir(os.path.join(datadirectory, sample))):
+            if (os.path.isdir(os.path.join(datadirectory, sample, datetime, 'raw', 'keithleydata'))
+                    or os.path.isfile(os.path.join(datadirectory, sample, datetime, 'raw.npz'))):
+                runs.append((sample, datetime))
+    return runs
+
+def run_name(sample, datetime):
+    return sample + '__' + datetime
+
+def write_file(path, text):
+    """
+    Write a small file atomically (temporary file and rename).
+    """
+    temporary = path + '.' + socket.gethostname() + '-' + str(os.getpid()) + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporary, path)
+
+"QUEUE"
+class WorkQueue(object):
+    """
+    File-based work queue of one job.
+
+    datadirectory: str
+        the 'data' folder (share) with the runs.
+    job: str
+        name of the job, default_job() if None.
+    """
+
+    def __init__(self, datadirectory=DATA_DIRECTORY, job=None):
+        self.datadirectory = datadirectory
+        self.job = job if job is not None else default_job()
+        self.directory = os.path.join(datadirectory, 'queue', self.job)
+        self.owner = socket.gethostname() + '-' + str(os.getpid())
+        for folder in ('claims', 'done', 'failed', 'staging'):
+            path = os.path.join(self.directory, folder)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError: # created by another worker at the same time
+                    pass
+
+    def path(self, folder, name):
+        return os.path.join(self.directory, folder, name)
+
+    def finished(self, name):
+        return os.path.exists(self.path('done', name)) or os.path.exists(self.path('failed', name))
+
+    def claim(self, name):
+        """
+        True if this worker got the run; a stale claim of another worker is recovered first.
+        """
+        claim = self.path('claims', name)
+        try:
+            os.mkdir(claim)
+        except OSError:
+            if not self.stale(claim):
+                return False
+            recovered = claim + '.stale-' + self.owner
+            try:
+                os.rename(claim, recovered) # only one worker can rename it
+            except OSError:
+                return False
+            if not self.stale(recovered): # another worker recovered it first and claimed it again, give it back
+                try:
+                    os.rename(recovered, claim)
+                except OSError: # the run may be analysed twice, publishing the same result twice is harmless
+                    shutil.rmtree(recovered, ignore_errors=True)
+                return False
+            shutil.rmtree(recovered, ignore_errors=True)
+            try:
+                os.mkdir(claim)
+            except OSError:
+                return False
+        if self.finished(name): # finished between listing and claiming
+            shutil.rmtree(claim, ignore_errors=True)
+            return False
+        write_file(os.path.join(claim, 'owner.json'), json.dumps({'owner': self.owner, 'claimed': time.time()}))
+        self.beat(name)
+        return True
+
+    def stale(self, claim):
+        """
+        True if the claim has not been renewed for STALE_AFTER s.
+        """
+        try:
+            heartbeat = os.path.join(claim, 'heartbeat')
+            last = os.path.getmtime(heartbeat if os.path.exists(heartbeat) else claim)
+        except OSError: # released in the meantime
+            return False
+        return time.time() - last > STALE_AFTER
+
+    def beat(self, name):
+        with open(os.path.join(self.path('claims', name), 'heartbeat'), 'w') as f:
+            f.write(str(time.time()))
+
+    def release(self, name):
+        shutil.rmtree(self.path('claims', name), ignore_errors=True)
+
+    def status(self):
+        """
+        Number of runs of the job that are done, failed, claimed and waiting.
+        """
+        names = [run_name(sample, datetime) for sample, datetime in find_runs(self.datadirectory)]
+        done = sum(os.path.exists(self.path('done', name)) for name in names)
+        failed = sum(os.path.exists(self.path('failed', name)) for name in names)
+        claimed = sum(os.path.isdir(self.path('claims', name)) for name in names)
+        return {'runs': len(names), 'done': done, 'failed': failed, 'claimed': claimed,
+                'waiting': len(names) - done - failed - claimed}
+
+"WORKER"
+class Heartbeat(threading.Thread):
+    """
+    Renews the claim of a run while it is analysed.
+    """
+
+    def __init__(self, queue, name):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.name_ = name
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT):
+            self.queue.beat(self.name_)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def publish(stagingdirectory, rundirectory):
+    """
+    Replace the 'processedEL' folder of a run by the one analysed in staging (two renames on the same share).
+    """
+    new = os.path.join(stagingdirectory, 'processedEL')
+    final = os.path.join(rundirectory, 'processedEL')
+    old = final + '.old-' + socket.gethostname() + '-' + str(os.getpid())
+    if os.path.isdir(final):
+        os.rename(final, old)
+    os.rename(new, final)
+    for folder in os.listdir(rundirectory): # also the old folder of a worker that died while publishing
+        if folder.startswith('processedEL.old-'):
+            shutil.rmtree(os.path.join(rundirectory, folder), ignore_errors=True)
+
+def analyse(queue, sample, datetime):
+    """
+    Analyse one claimed run in staging and publish the result.
+    """
+    import matplotlib
+    matplotlib.use('Agg') # workers have no display
+    import EL_analysis
+    name = run_name(sample, datetime)
+    staging = queue.path('staging', name + '-' + queue.owner)
+    rundirectory = os.path.join(queue.datadirectory, sample, datetime)
+    shutil.rmtree(staging, ignore_errors=True)
+    if os.path.isdir(os.path.join(rundirectory, 'raw')):
+        shutil.copytree(os.path.join(rundirectory, 'raw'), os.path.join(staging, sample, datetime, 'raw'))
+    else: # packed run (see run_archive.py)
+        os.makedirs(os.path.join(staging, sample, datetime))
+        shutil.copy2(os.path.join(rundirectory, 'raw.npz'), os.path.join(staging, sample, datetime, 'raw.npz'))
+    try:
+        results = EL_analysis.analyse_run(sample, datetime, datadirectory=staging)
+        publish(os.path.join(staging, sample, datetime), rundirectory)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return results
+
+def work(datadirectory=DATA_DIRECTORY, job=None):
+    """
+    Claim and analyse runs of the job until none is left.
+
+    returns:
+        count: int
+            number of runs analysed by this worker.
+    """
+    queue = WorkQueue(datadirectory, job)
+    count = 0
+    while True:
+        waiting = [(sample, datetime) for sample, datetime in find_runs(datadirectory) if not queue.finished(run_name(sample, datetime))]
+        claimed = None
+        for sample, datetime in waiting:
+            if queue.claim(run_name(sample, datetime)):
+                claimed = (sample, datetime)
+                break
+        if claimed is None:
+            if not any(os.path.isdir(queue.path('claims', run_name(*run))) for run in waiting):
+                return count # all runs finished
+            time.sleep(min(HEARTBEAT, STALE_AFTER) / 2.0) # runs of other workers, wait for them or until they are stale
+            continue
+        name = run_name(*claimed)
+        heartbeat = Heartbeat(queue, name)
+        heartbeat.start()
+        try:
+            results = analyse(queue, *claimed)
+            write_file(queue.path('done', name), json.dumps({'owner': queue.owner, 'finished': time.time(),
+                                                             'peak_eqe': float(max(results['dataeff_NONLAM'][5]))}))
+            count += 1
+        except (Exception, SystemExit): # EL_analysis exits if a run has no data
+            write_file(queue.path('failed', name), queue.owner + '\n' + traceback.format_exc())
+        finally:
+            heartbeat.stop()
+            queue.release(name)
+
+def _work(arguments):
+    return work(*arguments)
+
+def run_local(processes=None, datadirectory=DATA_DIRECTORY, job=None):
+    """
+    Several workers on this computer, one process each.
+
+    returns:
+        counts: list of int
+            runs analysed by every worker.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    job = job if job is not None else default_job()
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_work, [(datadirectory, job)] * processes)
+    finally:
+        pool.close()
+        pool.join()
+
+"RUNNING FROM THE COMMAND LINE"
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'worker'
+    if command == 'worker':
+        print('Runs analysed : ' + str(work(job=sys.argv[2] if len(sys.argv) > 2 else None)))
+    elif command == 'local':
+        counts = run_local(int(sys.argv[2]) if len(sys.argv) > 2 else None, job=sys.argv[3] if len(sys.argv) > 3 else None)
+        print('Runs analysed by every worker : ' + ', '.join(str(count) for count in counts))
+    elif command == 'status':
+        print(WorkQueue(job=sys.argv[2] if len(sys.argv) > 2 else None).status())
+    else:
+        print('Usage: python analysis_queue.py worker|local|status [processes] [job]')
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the analysis of runs with many angles (e.g. 0.1deg steps) in EL_analysis.py within a memory
+ceiling. The in-memory analysis keeps every spectrum several times (raw spectra, the 'ints' dictionary, the stacked
+'intensities', 'normintensities' and 'intensitydata', all float64). If this would need more than the memory limit,
+the angles are analysed in blocks instead:
+	- the raw spectra of a block are read with GoniometerRun.spectrum_block() (memory-mapped cache or text files)
+	- RI/LI, eFACTOR/vFACTOR and the colour of every angle are calculated block by block in float64
+	- the processed spectra are written to a float32 memory-mapped map in the 'processedEL' folder (float32 holds the
+	  normalised intensities to more than the 6 decimals of the text files); the running maximum normalises the map
+	- _specdatafull.txt and _specdata.txt are written from the map in blocks, the map and spectra plots use a
+	  decimated copy; the map file is deleted once the outputs are written
+The block size follows from the memory limit and the number of pixels, so the memory used does not grow with the
+number of angles.
+
+Example:
+	if analysis_memory(angles, pixels, wavelengths) > memory_limit * 1e6:
+		specmap = SpectralMap(path, angles, wavelengths, memory_limit)
+		for start, stop in blocks(angles, pixels, wavelengths, memory_limit):
+			specmap.write(start, processed spectra of run.spectrum_block(start, stop))
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+
+"DEFAULT SETTINGS"
+DTYPE = np.float32 # stored spectra
+RAW_COPIES = 2 # raw spectrum and the table it was read from, per angle (in memory: kept by GoniometerRun)
+MAP_COPIES = 6 # ints, intensities (and its copy while stacking), normintensities, intensitydata, colour
+BLOCK_COPIES = 4 # block, interpolated spectrum, colour and normalisation temporaries
+BLOCK_SHARE = 0.5 # share of the memory limit for one block, the rest is left for plots and the interpreter
+PLOT_ANGLES = 360 # angles in the map and spectra plots
+
+"FUNCTIONS"
+def analysis_memory(angles, pixels, wavelengths):
+    """
+    Estimated memory in bytes of the in-memory analysis of a run.
+
+    angles: int
+        number of spectra.
+    pixels: int
+        pixels of the raw spectra.
+    wavelengths: int
+        points of the wavelength axis of the analysis.
+    """
+    return angles * 8 * (RAW_COPIES * pixels + MAP_COPIES * wavelengths)
+
+def blocks(angles, pixels, wavelengths, memory_limit):
+    """
+    (start, stop) of the blocks of angles that fit into the memory limit (MB).
+    """
+    size = max(int(memory_limit * 1e6 * BLOCK_SHARE / (8 * (RAW_COPIES * pixels + BLOCK_COPIES * wavelengths))), 1)
+    return [(start, min(start + size, angles)) for start in range(0, angles, size)]
+
+def join_colour(parts, normal_angle=0.0):
+    """
+    Angle-resolved colour of all blocks (see colorimetry.angle_resolved_colour()), the colour shift against the
+    normal angle of the whole run.
+    """
+    colour = dict((name, np.concatenate([part[name] for part in parts])) for name in parts[0])
+    normal = np.argmin(np.abs(colour['angles'] - normal_angle))
+    colour['duv'] = np.sqrt((colour['u'] - colour['u'][normal])**2 + (colour['v'] - colour['v'][normal])**2)
+    return colour
+
+"SPECTRAL MAP"
+class SpectralMap(object):
+    """
+    (angles x wavelengths) processed spectra of a run in a float32 memory-mapped .npy file.
+
+    path: str
+        file of the map, deleted by close().
+    angles: int
+        number of spectra.
+    wavelengths: int
+        points of the wavelength axis.
+    memory_limit: float
+        memory limit (MB) of the analysis, the map is read in blocks within it.
+    """
+
+    def __init__(self, path, angles, wavelengths, memory_limit):
+        self.path = path
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=DTYPE, shape=(angles, wavelengths))
+        self.maximum = -np.inf
+        self.size = blocks(angles, 0, wavelengths, memory_limit)[0][1] # angles per block when the map is read
+
+    def write(self, start, block):
+        self.data[start:start + len(block)] = block
+        self.maximum = max(self.maximum, float(np.max(block)))
+
+    def normalised(self, start, stop):
+        """
+        Spectra start to stop divided by the maximum of the map (as normintensities), float64.
+        """
+        return np.asarray(self.data[start:stop], dtype=float) / self.maximum
+
+    def rows(self):
+        """
+        (start, stop) of the blocks the map is read in.
+        """
+        return [(start, min(start + self.size, len(self.data))) for start in range(0, len(self.data), self.size)]
+
+    def preview(self, angles, count=PLOT_ANGLES):
+        """
+        Every n-th angle and its spectrum (not normalised, float64), at most count of them, for the plots.
+        """
+        step = max(int(np.ceil(len(self.data) / float(count))), 1)
+        return np.asarray(angles)[::step], np.asarray(self.data[::step], dtype=float)
+
+    def save_specdatafull(self, filename, angles, wavelength, header_lines):
+        """
+        Write _specdatafull.txt like intensitydata.T of the in-memory analysis: angles in the first row, then one row
+        per wavelength with the normalised intensity of every angle.
+        """
+        with open(filename, 'w') as f:
+            np.savetxt(f, np.hstack([0, angles])[np.newaxis, :], fmt='%.6f', delimiter='\t', header='\n'.join(header_lines), comments='')
+            step = max(int(self.size * len(wavelength) / float(len(self.data))), 1) # same memory as a block of angles
+            for start in range(0, len(wavelength), step):
+                stop = min(start + step, len(wavelength))
+                columns = np.asarray(self.data[:, start:stop], dtype=float).T / self.maximum
+                np.savetxt(f, np.hstack((wavelength[start:stop, np.newaxis], columns)), fmt='%.6f', delimiter='\t')
+
+    def save_specdata(self, filename, wavelength):
+        """
+        Write _specdata.txt like the in-memory analysis: the wavelengths, then the normalised spectrum of every angle.
+        """
+        with open(filename, 'w') as f:
+            for w in wavelength:
+                f.write(str(w))
+                f.write(' ')
+            f.write('\n')
+            for start, stop in self.rows():
+                for i in self.normalised(start, stop):
+                    f.write(str(i))
+                    f.write(' ')
+
+    def close(self):
+        del self.data # closes the memory map before the file is deleted
+        os.remove(self.path)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the colorimetry of angle-resolved spectra. All angles are evaluated at once: the
+(angles x wavelengths) intensity matrix is multiplied with the (wavelengths x 3) matrix of the CIE 1931 colour
+matching functions (XCIE, YCIE, ZCIE) to obtain the tristimulus values of every angle in one matrix product.
+
+For every angle the following is calculated:
+	- wavelength of maximum intensity (lambda max) and full width at half maximum (FWHM)
+	- CIE 1931 xy and CIE 1976 u'v' chromaticity coordinates
+	- colour shift delta u'v' against the spectrum at normal incidence (0deg)
+
+The CIE norm curves are those used in EL_analysis.py ('library'/'NormCurves_400-800.txt', columns 2-4 on the 400-800nm
+axis of 'Photopic_response.txt'), the spectra have to be given on the same wavelength axis.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+
+"FUNCTIONS"
+def load_cmf(library=os.path.join(os.path.dirname(__file__), 'library')):
+    """
+    Load the CIE 1931 colour matching functions.
+
+    returns:
+        cmf: np.array
+            (wavelengths x 3) matrix with the columns XCIE, YCIE, ZCIE on the 400-800nm axis.
+    """
+    return np.loadtxt(os.path.join(library, 'NormCurves_400-800.txt'))[:, 2:5]
+
+def tristimulus(intensities, cmf):
+    """
+    Tristimulus values X, Y, Z of one spectrum (wavelengths) or of many spectra (angles x wavelengths).
+    """
+    return np.dot(intensities, cmf)
+
+def chromaticity(XYZ):
+    """
+    CIE 1931 chromaticity coordinates x, y from tristimulus values (last axis X, Y, Z).
+    """
+    XYZ = np.asarray(XYZ, dtype=float)
+    total = XYZ.sum(axis=-1)
+    return XYZ[..., 0] / total, XYZ[..., 1] / total
+
+def uv_prime(XYZ):
+    """
+    CIE 1976 uniform chromaticity coordinates u', v' from tristimulus values (last axis X, Y, Z).
+    """
+    XYZ = np.asarray(XYZ, dtype=float)
+    denominator = XYZ[..., 0] + 15 * XYZ[..., 1] + 3 * XYZ[..., 2]
+    return 4 * XYZ[..., 0] / denominator, 9 * XYZ[..., 1] / denominator
+
+def peak_wavelength(intensities, wavelength):
+    """
+    Wavelength of maximum intensity of every spectrum (first maximum if there are several).
+    """
+    return np.asarray(wavelength)[np.argmax(intensities, axis=-1)]
+
+def fwhm(intensities, wavelength):
+    """
+    Full width at half maximum of every spectrum (last axis wavelengths).
+
+    The half-maximum crossings next to the main peak are interpolated linearly between pixels,
+    spectra that do not drop below half maximum on both sides give NaN.
+    """
+    intensities = np.atleast_2d(intensities)
+    wavelength = np.asarray(wavelength, dtype=float)
+    rows = np.arange(intensities.shape[0])
+    pixels = np.arange(intensities.shape[1])
+    peak = np.argmax(intensities, axis=1)
+    half = intensities[rows, peak] / 2.0
+    below = intensities < half[:, None]
+
+    # Last pixel below half maximum left of the peak, first pixel below half maximum right of the peak
+    left = np.where(below & (pixels < peak[:, None]), pixels, -1).max(axis=1)
+    right = np.where(below & (pixels > peak[:, None]), pixels, len(pixels)).min(axis=1)
+    valid = (left >= 0) & (right < len(pixels))
+    left = np.clip(left, 0, len(pixels) - 2)
+    right = np.clip(right, 1, len(pixels) - 1)
+
+    def crossing(a, b):
+        ia, ib = intensities[rows, a], intensities[rows, b]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(ib != ia, (half - ia) / (ib - ia), 0.0)
+        return wavelength[a] + fraction * (wavelength[b] - wavelength[a])
+
+    width = crossing(right - 1, right) - crossing(left, left + 1)
+    width[~valid] = np.nan
+    return width
+
+def angle_resolved_colour(angles, intensities, wavelength, cmf, normal_angle=0.0):
+    """
+    Colorimetry of all angles of a measurement.
+
+    angles: np.array
+        angles of the spectra (deg).
+    intensities: np.array
+        (angles x wavelengths) spectra, e.g. in W/nm/sr.
+    wavelength: np.array
+        wavelength axis of the spectra and of cmf (nm).
+    cmf: np.array
+        (wavelengths x 3) colour matching functions, see load_cmf().
+    normal_angle: float
+        angle of normal incidence used as reference for the colour shift.
+
+    returns:
+        colour: dict of np.array (one value per angle)
+            'angles', 'lambdamax', 'fwhm', 'x', 'y', 'u', 'v', 'duv'
+    """
+    angles = np.asarray(angles, dtype=float)
+    intensities = np.atleast_2d(intensities)
+    XYZ = tristimulus(intensities, cmf)
+    x, y = chromaticity(XYZ)
+    u, v = uv_prime(XYZ)
+    normal = np.argmin(np.abs(angles - normal_angle))
+    duv = np.sqrt((u - u[normal])**2 + (v - v[normal])**2)
+    return {'angles': angles, 'lambdamax': peak_wavelength(intensities, wavelength), 'fwhm': fwhm(intensities, wavelength),
+            'x': x, 'y': y, 'u': u, 'v': v, 'duv': duv}
+
+COLUMNS = ['angles', 'lambdamax', 'fwhm', 'x', 'y', 'u', 'v', 'duv']
+COLUMN_HEADER = ["angles    lambda_max    FWHM    CIE_x    CIE_y    u'    v'    delta_u'v'",
+                 'degree    nm    nm    -    -    -    -    -']
+
+def save_colour_table(path, colour, header_lines):
+    """
+    Write the angle-resolved colour table as text file in the format of the other processed files.
+
+    header_lines: list of str
+        general header lines (measurement code, analysis time, ...); the column names are added.
+    """
+    table = np.stack([colour[name] for name in COLUMNS])
+    np.savetxt(path, table.T, fmt='%.2f %.2f %.2f %.4f %.4f %.4f %.4f %.5f', delimiter='\t',
+               header='\n'.join(list(header_lines) + COLUMN_HEADER), comments='')
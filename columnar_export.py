@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the typed columnar outputs (Parquet) of EL_analysis.py. The processed text files have free-text
+headers that have to be parsed again for every comparison of runs; the columnar outputs hold the same results as
+typed columns, so that queries across many devices only read the columns they need:
+	- 'runs': one row per run, the summary of the results index (see results_index.py) with the analysis parameters,
+	  peak efficiencies, CIE coordinates, eFACTOR/vFACTOR, ...
+	- 'efficiency': the efficiency tables, LAM and NONLAM in one table with the column 'emission'
+	- 'lamdata': angular emission (Lambertian, actual, actual photometric)
+	- 'spectral_map': normalised intensity for every angle and wavelength (long format, float32)
+Every table is partitioned by sample and measurement date (Hive layout, one file per run):
+	'data'/'columnar'/table/sample=S23D1/date=20190703/201907031258.parquet
+The units of the columns are kept in the field metadata.
+
+Needs pyarrow (optional, the analysis skips the columnar outputs without it).
+
+Example, peak EQE of all runs of two devices:
+	runs = read('runs', columns=['datetime', 'peak_eqe'], filters=[('sample', 'in', ['S23D1', 'S23D2'])])
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+import results_index
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+"DEFAULT SETTINGS"
+COLUMNAR_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'columnar'))
+EFFICIENCY_COLUMNS = [('voltage', 'V'), ('current', 'mA'), ('current_density', 'mA/cm2'), ('abs_current_density', 'mA/cm2'),
+                      ('luminance', 'cd/m2'), ('eqe', '%'), ('le', 'lm/W'), ('ce', 'cd/A'), ('power_density', 'mW/mm2')]
+LAMDATA_COLUMNS = [('angle', 'degree'), ('lambertian', 'a.u.'), ('actual', 'a.u.'), ('actual_v', 'a.u.')]
+RUN_UNITS = {'oled_area': 'm2', 'distance': 'm', 'pd_area': 'm2', 'pd_resistance': 'Ohm', 'pd_cutoff': 'V',
+             'peak_eqe': '%', 'peak_eqe_lam': '%', 'peak_le': 'lm/W', 'peak_ce': 'cd/A', 'peak_lum': 'cd/m2', 'lambda_max': 'nm'}
+
+"FUNCTIONS"
+def available():
+    return pa is not None
+
+def field(name, dtype, unit=None):
+    return pa.field(name, dtype, metadata={'unit': unit} if unit else None)
+
+def partition(directory, table, sample, datetime):
+    """
+    Folder of a run in a table, e.g. directory/'efficiency'/'sample=S23D1'/'date=20190703'.
+    """
+    return os.path.join(directory, table, 'sample=' + sample, 'date=' + datetime[:8])
+
+def write(table, directory, name, sample, datetime):
+    """
+    Write a table of one run, replacing the file of an earlier analysis.
+    """
+    folder = partition(directory, name, sample, datetime)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, datetime + '.parquet')
+    temporary = path + '.tmp'
+    pq.write_table(table, temporary)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+    return path
+
+def run_table(summary):
+    """
+    One row with the summary of a run (the columns of the results index, sample is the partition).
+    """
+    fields, arrays = [], []
+    for name, sqltype in results_index.COLUMNS:
+        if name == 'sample':
+            continue
+        if name == 'files':
+            fields.append(field(name, pa.list_(pa.string())))
+            arrays.append(pa.array([[str(f) for f in summary.get(name, [])]], type=pa.list_(pa.string())))
+        elif sqltype.startswith('TEXT'):
+            fields.append(field(name, pa.string()))
+            arrays.append(pa.array([None if summary.get(name) is None else str(summary[name])], type=pa.string()))
+        else:
+            fields.append(field(name, pa.float64(), RUN_UNITS.get(name)))
+            arrays.append(pa.array([None if summary.get(name) is None else float(summary[name])], type=pa.float64()))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def efficiency_table(datetime, dataeff_NONLAM, dataeff_LAM):
+    """
+    Efficiency data of both emission models, the rows of dataeff_NONLAM then dataeff_LAM.
+    """
+    rows = dataeff_NONLAM.shape[1] + dataeff_LAM.shape[1]
+    fields = [field('datetime', pa.string()), field('emission', pa.string())]
+    arrays = [pa.array([datetime] * rows, type=pa.string()),
+              pa.array(['NONLAM'] * dataeff_NONLAM.shape[1] + ['LAM'] * dataeff_LAM.shape[1], type=pa.string())]
+    for k, (name, unit) in enumerate(EFFICIENCY_COLUMNS):
+        fields.append(field(name, pa.float64(), unit))
+        arrays.append(pa.array(np.concatenate((dataeff_NONLAM[k], dataeff_LAM[k])).astype(np.float64), type=pa.float64()))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def lamdata_table(datetime, lamdata):
+    fields = [field('datetime', pa.string())] + [field(name, pa.float64(), unit) for name, unit in LAMDATA_COLUMNS]
+    arrays = [pa.array([datetime] * lamdata.shape[1], type=pa.string())] + \
+             [pa.array(np.asarray(lamdata[k], dtype=np.float64), type=pa.float64()) for k in range(len(LAMDATA_COLUMNS))]
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def map_table(datetime, angles, wavelength, intensities):
+    """
+    Normalised intensities of some angles (angles x wavelengths) in long format.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    fields = [field('datetime', pa.string()), field('angle', pa.float64(), 'degree'), field('wavelength', pa.float64(), 'nm'),
+              field('intensity', pa.float32(), 'a.u.')]
+    arrays = [pa.array([datetime] * (len(angles) * len(wavelength)), type=pa.string()),
+              pa.array(np.repeat(angles, len(wavelength)), type=pa.float64()),
+              pa.array(np.tile(np.asarray(wavelength, dtype=np.float64), len(angles)), type=pa.float64()),
+              pa.array(np.asarray(intensities, dtype=np.float32).ravel(), type=pa.float32())]
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+"EXPORT OF A RUN"
+def save_map(directory, sample, datetime, wavelength, blocks):
+    """
+    Write the spectral map of a run, one row group per block.
+
+    blocks: iterable
+        (angles, normalised intensities (angles x wavelengths)) of all angles, in one or several blocks.
+    """
+    folder = partition(directory, 'spectral_map', sample, datetime)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, datetime + '.parquet')
+    temporary = path + '.tmp'
+    writer = None
+    for angles, intensities in blocks:
+        table = map_table(datetime, angles, wavelength, intensities)
+        if writer is None:
+            writer = pq.ParquetWriter(temporary, table.schema)
+        writer.write_table(table)
+    writer.close()
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+    return path
+
+def save_tables(directory, summary, dataeff_NONLAM, dataeff_LAM, lamdata):
+    """
+    Write the run summary, the efficiency data and the angular emission of a run.
+
+    summary: dict
+        summary row of the run as in the results index, with 'sample' and 'datetime'.
+    """
+    sample, datetime = summary['sample'], summary['datetime']
+    return [write(run_table(summary), directory, 'runs', sample, datetime),
+            write(efficiency_table(datetime, dataeff_NONLAM, dataeff_LAM), directory, 'efficiency', sample, datetime),
+            write(lamdata_table(datetime, lamdata), directory, 'lamdata', sample, datetime)]
+
+"READING"
+def read(table, directory=COLUMNAR_DIRECTORY, columns=None, filters=None):
+    """
+    Read a table of all runs, only the columns and partitions that are needed.
+
+    table: str
+        'runs', 'efficiency', 'lamdata' or 'spectral_map'.
+    columns: list of str
+        columns to read (also 'sample' and 'date' of the partitions), None for all.
+    filters: list of tuple
+        e.g. [('sample', '=', 'S23D1'), ('emission', '=', 'NONLAM')].
+
+    returns:
+        table: pyarrow.Table
+    """
+    return pq.read_table(os.path.join(directory, table), columns=columns, filters=filters)
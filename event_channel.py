@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the messages from the measurement threads (ELTASK, PLTASK) to the GUI of
+Goniometer_measurement.py. Instead of formatted strings and plain lists in an unbounded Queue.Queue, a task publishes
+typed events into a bounded channel:
+	- progress: a line for the log of the measurement (settings, angle, processing time, ...)
+	- reading: an instrument reading (name, value, unit), logged as 'name : value unit'
+	- spectrum: data for the graph of the tab (x, y and optional title and axis labels)
+	- warning: a line for the log that is never dropped
+The GUI drains the channel in batches (one insert into the log and at most one graph update per batch). Events the
+GUI has not taken yet are coalesced, so a fast sweep cannot back up the channel:
+	- a spectrum replaces the spectrum of the same key that is still waiting (only the latest is drawn)
+	- a reading replaces the waiting reading of the same name, the log shows how many were coalesced
+	- if the channel is full, the oldest waiting progress line is dropped (the log notes how many were dropped)
+Publishing never blocks the measurement thread. The data itself is saved to the files of the run, the channel only
+feeds the display.
+
+Example:
+	channel = EventChannel()
+	channel.reading('OLED Voltage', 3.0, 'V')  # measurement thread
+	events = channel.drain()  # GUI
+"""
+
+"IMPORTING REQUIRED MODULES"
+import threading
+from collections import deque
+
+"DEFAULT SETTINGS"
+MAX_EVENTS = 500 # waiting events of one channel
+BATCH = 200 # events the GUI takes per update
+POLL_INTERVAL = 250 # ms between GUI updates
+LOG_LINES = 2000 # lines kept in the log of a tab
+
+"EVENTS"
+class Event(object):
+    """
+    One message of a measurement task.
+
+    kind: str
+        'progress', 'reading', 'spectrum' or 'warning'.
+    text: str
+        line for the log (None for spectra).
+    data: object
+        (name, value, unit) of a reading, (x, y, labels) of a spectrum.
+    key: str
+        readings and spectra with the same key are coalesced.
+    """
+
+    def __init__(self, kind, text=None, data=None, key=None):
+        self.kind = kind
+        self.text = text
+        self.data = data
+        self.key = key
+        self.count = 1 # number of events coalesced into this one
+
+    def __repr__(self):
+        return 'Event(' + repr(self.kind) + ', ' + repr(self.text) + ')'
+
+    def log_text(self):
+        """
+        Line for the log, None if the event is not logged.
+        """
+        if self.text is None:
+            return None
+        if self.count > 1:
+            return self.text + '  (latest of ' + str(self.count) + ')'
+        return self.text
+
+"CHANNEL"
+class EventChannel(object):
+    """
+    Bounded, coalescing channel from one measurement task to the GUI (see module description).
+    """
+
+    def __init__(self, maxsize=MAX_EVENTS):
+        self.maxsize = maxsize
+        self.events = deque()
+        self.waiting = {} # (kind, key) -> waiting event that later ones are coalesced into
+        self.dropped = 0 # progress lines dropped since the last drain
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        with self.lock:
+            if event.key is not None and (event.kind, event.key) in self.waiting:
+                waiting = self.waiting[(event.kind, event.key)]
+                waiting.text, waiting.data = event.text, event.data
+                waiting.count += event.count
+                return
+            if len(self.events) >= self.maxsize:
+                for old in self.events:
+                    if old.kind == 'progress':
+                        self.events.remove(old)
+                        self.dropped += 1
+                        break
+            self.events.append(event)
+            if event.key is not None:
+                self.waiting[(event.kind, event.key)] = event
+
+    def progress(self, text):
+        self.publish(Event('progress', text))
+
+    def warning(self, text):
+        self.publish(Event('warning', text))
+
+    def reading(self, name, value, unit='', prefix=''):
+        """
+        Instrument reading, logged as prefix + 'name : value unit'.
+        """
+        self.publish(Event('reading', prefix + name + ' : ' + str(value) + (' ' + unit if unit else ''), (name, value, unit), key=name))
+
+    def spectrum(self, x, y, labels=None, key='spectrum'):
+        """
+        Data for the graph, labels are the optional 'title', 'xlabel' and 'ylabel' (a spectrum by default).
+        """
+        self.publish(Event('spectrum', None, (x, y, labels or {}), key=key))
+
+    def drain(self, limit=BATCH):
+        """
+        Up to limit waiting events in the order they were published (a note first if progress lines were dropped).
+        """
+        with self.lock:
+            events = []
+            if self.dropped:
+                events.append(Event('warning', '... ' + str(self.dropped) + ' lines skipped (display too slow)'))
+                self.dropped = 0
+            while self.events and len(events) < limit:
+                event = self.events.popleft()
+                if event.key is not None:
+                    del self.waiting[(event.kind, event.key)]
+                events.append(event)
+            return events
+
+    def empty(self):
+        with self.lock:
+            return not self.events and not self.dropped
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the continuous-rotation ("fly scan") acquisition of the goniometer. Instead of moving to an
+angle, waiting and acquiring (stop-and-go), the motor rotates at a constant velocity over the whole angle range while the
+spectrometer takes back-to-back spectra:
+	- a PositionLogger thread polls the motor position (and optionally the sourcemeter) with monotonic timestamps
+	- every spectrum is tagged with the start and end time of its acquisition
+	- the angle of a spectrum is interpolated from the logged position trace at the middle of its integration
+	- the spectra are finally interpolated onto the regular angle grid of the stop-and-go sweep, so the output files are
+	  the same Angle_.txt files EL_analysis.py expects; only the grid angles within the measured range are returned
+	  (a sweep stopped early ends at the last angle it passed, fewer than two spectra give no angles)
+
+The velocity is chosen so that one integration time covers one step angle, i.e. a sweep takes about
+(number of angles x integration time) instead of adding moving, settle and pulse times for every angle.
+
+The motor and spectrometer objects are those of thorlabs_apt and seabreeze as used in Goniometer_measurement.py.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import time
+import threading
+import numpy as np
+
+try:
+    clock = time.monotonic  # Python 3
+except AttributeError:
+    clock = time.time
+
+"FUNCTIONS"
+def velocity_for_step(step_angle, integrationtime):
+    """
+    Velocity (deg/s) at which the motor rotates by one step angle during one integration time (in microseconds).
+    """
+    return float(step_angle) / (float(integrationtime) * 1e-6)
+
+def resample_to_grid(measured_angles, spectra, grid):
+    """
+    Interpolate spectra taken at arbitrary (monotonic) angles linearly onto the grid angles within the measured range.
+
+    measured_angles: np.array
+        angle of every spectrum (n).
+    spectra: np.array
+        (n x pixels) spectra.
+    grid: np.array
+        angles of the output spectra; grid angles outside the measured range are left out, all of them if fewer
+        than two spectra were taken.
+
+    returns:
+        covered: np.array
+            grid angles within the measured range.
+        resampled: np.array
+            (covered x pixels) spectra.
+    """
+    measured_angles = np.asarray(measured_angles, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    if len(measured_angles) < 2:
+        return grid[:0], np.zeros((0, np.shape(spectra)[1] if np.ndim(spectra) == 2 else 0))
+    spectra = np.asarray(spectra, dtype=float)
+    order = np.argsort(measured_angles)
+    measured_angles = measured_angles[order]
+    spectra = spectra[order]
+    grid = grid[(grid >= measured_angles[0]) & (grid <= measured_angles[-1])]
+    upper = np.clip(np.searchsorted(measured_angles, grid), 1, len(measured_angles) - 1)
+    lower = upper - 1
+    span = measured_angles[upper] - measured_angles[lower]
+    weight = np.where(span > 0, (grid - measured_angles[lower]) / np.where(span > 0, span, 1), 0.0)
+    return grid, spectra[lower] * (1 - weight)[:, None] + spectra[upper] * weight[:, None]
+
+"POSITION LOGGING"
+class PositionLogger(threading.Thread):
+    """
+    Thread that logs the motor position (and optionally a sourcemeter reading) with timestamps while the motor moves.
+
+    motor: thorlabs_apt.Motor
+    interval: float
+        polling interval in s.
+    smu_read: callable
+        optional function returning one sourcemeter reading, polled every smu_interval s.
+    """
+
+    def __init__(self, motor, interval=0.01, smu_read=None, smu_interval=0.2, start_timeout=2.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.motor = motor
+        self.interval = interval
+        self.smu_read = smu_read
+        self.smu_interval = smu_interval
+        self.times = []
+        self.positions = []
+        self.smu_times = []
+        self.smu_values = []
+        self.start_timeout = start_timeout
+        self.moving = True  # stays True until the motion has started and ended again
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last_smu = None
+        started = None
+        first = clock()
+        while not self._stop_event.is_set():
+            now = clock()
+            self.times.append(now)
+            self.positions.append(self.motor.position)
+            in_motion = self.motor.is_in_motion
+            started = started or in_motion
+            if started:
+                self.moving = in_motion
+            elif now - first > self.start_timeout:
+                self.moving = False  # the motor never started
+            if self.smu_read is not None and (last_smu is None or now - last_smu >= self.smu_interval):
+                self.smu_values.append(self.smu_read())
+                self.smu_times.append(clock())
+                last_smu = now
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def angle_at(self, times):
+        """
+        Motor position at the given times, interpolated from the logged trace.
+        """
+        return np.interp(times, self.times, self.positions)
+
+    def smu_at(self, times):
+        """
+        Sourcemeter reading at the given times, interpolated from the logged readings (NaN if none were taken).
+        """
+        if not self.smu_values:
+            return np.nan * np.ones(np.shape(times))
+        return np.interp(times, self.smu_times, self.smu_values)
+
+"ACQUISITION"
+class FlyScan(object):
+    """
+    Continuous-rotation sweep of one motor with one spectrometer.
+
+    start_angle, stop_angle, step_angle: float
+        motor angles of the sweep; the output grid is np.arange(start_angle, stop_angle + 1, step_angle) as in the
+        stop-and-go sweep.
+    integrationtime: float
+        integration time of the spectrometer in microseconds (it has to be set on the spectrometer already).
+    velocity: float
+        rotation velocity in deg/s, by default one step angle per integration time.
+    smu_read: callable
+        optional sourcemeter reading logged during the sweep (e.g. OLED voltage under current source).
+    running: callable
+        returns False if the sweep should be aborted (stop button).
+    """
+
+    def __init__(self, motor, spec, start_angle, stop_angle, step_angle, integrationtime, velocity=None,
+                 acceleration=9, smu_read=None, running=lambda: True):
+        self.motor = motor
+        self.spec = spec
+        self.start_angle = float(start_angle)
+        self.stop_angle = float(stop_angle)
+        self.step_angle = float(step_angle)
+        self.integrationtime = float(integrationtime)
+        self.velocity = velocity if velocity is not None else velocity_for_step(step_angle, integrationtime)
+        self.acceleration = acceleration
+        self.smu_read = smu_read
+        self.running = running
+        self.grid = np.arange(self.start_angle, self.stop_angle + 1, self.step_angle)
+
+    def run(self):
+        """
+        Perform the sweep.
+
+        returns:
+            result: dict
+                'grid' (motor angles within the measured range, shorter than self.grid if the sweep was stopped,
+                empty with fewer than two spectra), 'wavelengths', 'spectra' (grid x pixels), 'smu' (grid), and the raw trace:
+                'frame_start', 'frame_end', 'frame_angles', 'frames', 'log_times', 'log_positions'
+        """
+        wavelengths = self.spec.wavelengths()
+        velocity_parameters = self.motor.get_velocity_parameters()
+        # Run-in of one step on both sides so that the first and last grid angle are inside the measured range
+        self.motor.move_to(self.start_angle - self.step_angle, blocking=True)
+        self.motor.set_velocity_parameters(0, self.acceleration, self.velocity)
+        logger = PositionLogger(self.motor, smu_read=self.smu_read)
+        frame_start = []
+        frame_end = []
+        frames = []
+        try:
+            logger.start()
+            self.motor.move_to(self.stop_angle + self.step_angle, blocking=False)
+            while logger.moving and self.running():
+                frame_start.append(clock())
+                frames.append(self.spec.intensities())
+                frame_end.append(clock())
+        finally:
+            logger.stop()
+            self.motor.set_velocity_parameters(*velocity_parameters)
+
+        # A spectrum is returned right after its integration, its middle is half an integration time earlier
+        frame_end = np.array(frame_end)
+        frame_middle = frame_end - self.integrationtime * 1e-6 / 2
+        frame_angles = logger.angle_at(frame_middle) if len(frames) else np.zeros(0) # stopped before the first poll
+        grid, spectra = resample_to_grid(frame_angles, np.array(frames).reshape(len(frames), len(wavelengths)), self.grid)
+        if len(grid):
+            smu = np.interp(grid, np.sort(frame_angles), logger.smu_at(frame_middle[np.argsort(frame_angles)]))
+        else:
+            smu = np.zeros(0)
+        return {'grid': grid, 'wavelengths': np.array(wavelengths), 'spectra': spectra, 'smu': smu,
+                'frame_start': np.array(frame_start), 'frame_end': frame_end, 'frame_angles': frame_angles,
+                'frames': np.array(frames), 'log_times': np.array(logger.times), 'log_positions': np.array(logger.positions)}
+
+def save_trace(directory, result, header_lines):
+    """
+    Save the timestamps and interpolated angles of a fly scan next to the spectra ('flyscan_frames.txt',
+    'flyscan_positions.txt' in the given folder), so that the resampling can be checked later.
+    """
+    t0 = result['log_times'][0] if len(result['log_times']) else 0.0
+    frames = np.stack((np.arange(len(result['frame_end'])), result['frame_start'] - t0, result['frame_end'] - t0,
+                       result['frame_angles']))
+    np.savetxt(os.path.join(directory, 'flyscan_frames.txt'), frames.T, fmt='%d %.4f %.4f %.4f', delimiter='\t',
+               header='\n'.join(list(header_lines) + ['Frame    Start    End    Angle', '-    s    s    deg']), comments='')
+    positions = np.stack((result['log_times'] - t0, result['log_positions']))
+    np.savetxt(os.path.join(directory, 'flyscan_positions.txt'), positions.T, fmt='%.4f %.4f', delimiter='\t',
+               header='\n'.join(list(header_lines) + ['Time    Position', 's    deg']), comments='')
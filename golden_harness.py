@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for checking an implementation of the EL analysis (analyse_run in EL_analysis.py) against known
+answers and frozen reference ("golden") outputs, so that a faster implementation can be accepted on evidence.
+
+Synthetic runs:
+	make_run() writes a run folder in the layout of Goniometer_measurement.py ('raw' with 'spectrumdata' and
+	'keithleydata') for an emitter with the angular emission I(theta) = I0 cos(theta)^m (m = 1 is Lambertian) and a
+	Gaussian spectrum. The photodiode voltages are those of a device with a given external quantum efficiency, so the
+	analytic answers are known:
+		- eFACTOR = vFACTOR = 1/(m+1) (integral of cos^m(theta) sin(theta) from 0 to 90deg)
+		- Actual and Actual_v emission in lamdata = cos^m(theta)
+		- EQE of effdata_NONLAM = the EQE of the device, EQE of effdata_LAM = EQE (m+1)/2
+		- maximum intensity at the peak of the Gaussian
+	CASES holds the default set of runs (Lambertian and non-Lambertian emitters).
+
+Golden outputs:
+	freeze() analyses all CASES and stores the numbers of every processed text file and the returned results as one
+	.npz file per case. compare() analyses the same runs with any implementation (default EL_analysis.analyse_run) and
+	reports the largest deviation from the frozen numbers and from the analytic answers together with the analysis time.
+
+Usage:
+	python golden_harness.py freeze [golden folder]
+	python golden_harness.py compare [golden folder] [module:function]
+The golden folder is 'data'/'golden' by default.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os, sys, shutil, tempfile, time, importlib
+import numpy as np
+import matplotlib
+matplotlib.use('Agg') # the analysis only saves figures
+# Run data model
+from goniometer_run import read_table
+
+"DEFAULT SETTINGS"
+GOLDEN_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'golden'))
+DATETIME = '202001011200'
+# name: emission exponent m, EQE in %, angle range, peak and width of the spectrum in nm
+# EL_analysis.py takes the perpendicular spectrum from Angle0.0.txt, so the cases use the 'HL' range (0 to 90deg)
+CASES = {'lambertian': {'m': 1.0, 'eqe': 10.0, 'ang_range': 'HL', 'peak': 550.0, 'width': 30.0},
+         'cos2': {'m': 2.0, 'eqe': 20.0, 'ang_range': 'HL', 'peak': 610.0, 'width': 40.0},
+         'cos05': {'m': 0.5, 'eqe': 5.0, 'ang_range': 'HL', 'peak': 470.0, 'width': 25.0}}
+RTOL = 1e-5 # relative deviation allowed for every number
+ATOL = 1e-3 # absolute deviation allowed, as fraction of the largest value of the column (printing precision of the files)
+ANALYTIC_RTOL = 1e-2 # discretisation of the angle integral and smoothing of the spectrum
+
+"FUNCTIONS"
+def analysis_setup():
+    """
+    Setup parameters of the analysis (photodiode, calibration, wavelength axis) the synthetic runs are made for.
+    """
+    import EL_analysis
+    return EL_analysis
+
+def make_run(datadirectory, sample, m=1.0, eqe=10.0, ang_range='HL', peak=550.0, width=30.0, step_angle=1.0,
+             current=1e-3, peak_counts=40000.0, background_counts=1000.0, datetime=DATETIME):
+    """
+    Write a synthetic run folder datadirectory/sample/datetime/raw.
+
+    m: float
+        exponent of the angular emission cos(theta)^m.
+    eqe: float
+        external quantum efficiency of the device in %.
+    ang_range: str
+        'HL' for angles 0 to 90deg, 'F' for 0 to 180deg with the normal at 90deg.
+
+    returns:
+        expected: dict
+            analytic answers 'eFACTOR', 'vFACTOR', 'EQE_NONLAM', 'EQE_LAM', 'lambdamax' and 'lamdata' (angles, cos^m).
+    """
+    setup = analysis_setup()
+    wavelength = setup.wavelength
+    rawdirectory = os.path.join(datadirectory, sample, datetime, 'raw')
+    spectrumdirectory = os.path.join(rawdirectory, 'spectrumdata')
+    keithleydirectory = os.path.join(rawdirectory, 'keithleydata')
+    for directory in (spectrumdirectory, keithleydirectory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    header = '\n'.join(['Measurement code : ' + sample + datetime, 'Measurement programme :	golden_harness.py',
+                        'Emission : cos(theta)^' + str(m) + '    EQE : ' + str(eqe) + ' %', '', '', '', '', '',
+                        '### Measurement data ###'])
+
+    # Spectra: counts = intensity / calibration + background, on the wavelength axis of the analysis
+    shape = np.exp(-0.5 * ((wavelength - peak) / width)**2)
+    counts = shape / setup.calibration
+    counts = counts * peak_counts / counts.max()
+    intensity = counts * setup.calibration # W/nm/sr in the units of the calibration
+    angles = np.arange(0, (180 if ang_range == 'F' else 90) + step_angle / 2.0, step_angle)
+    normal = 90.0 if ang_range == 'F' else 0.0
+    emission = np.cos(np.deg2rad(np.clip(np.abs(angles - normal), 0, 90)))**m
+    np.savetxt(os.path.join(spectrumdirectory, 'Background.txt'), np.stack((wavelength, background_counts + 0 * wavelength)).T,
+               fmt='%.3f %.0f', delimiter='\t', header='\n'.join([header, 'Wavelength   Intensity', 'nm             -']), comments='')
+    for angle, factor in zip(angles, emission):
+        np.savetxt(os.path.join(spectrumdirectory, 'Angle' + str(angle).zfill(3) + '.txt'),
+                   np.stack((wavelength, background_counts + factor * counts)).T, fmt='%.3f %.0f', delimiter='\t',
+                   header='\n'.join([header, 'Wavelength   Intensity', 'nm             -']), comments='')
+
+    # Sourcemeter readings during the sweep
+    np.savetxt(os.path.join(keithleydirectory, 'keithleyOLEDvoltages.txt'), np.stack((angles, 3.0 + 0 * angles, current + 0 * angles)).T,
+               fmt='%.0f %.4f %.3e', delimiter='\t', header='\n'.join([header, 'Angle    OLEDVoltage   	OLEDCurrent', 'Degrees 	  V       	 A']), comments='')
+
+    # IVL scan: photodiode voltage of a device with the given EQE, for a small photodiode on the normal the collected
+    # fraction of the photons is (m+1)/2 sin^2(alpha)
+    voltage = np.arange(0.0, 5.01, 0.1)
+    oledcurrent = 1e-2 * np.exp(voltage - 5.0) * (voltage > 2.0) + 1e-9
+    photons = eqe / 100.0 * oledcurrent / setup.e * (m + 1) / 2.0 * setup.sqsinalpha
+    photocurrent = photons * setup.h * setup.c / 1e-9 * np.sum(shape * setup.Rlambda) / np.sum(shape * wavelength)
+    pdvoltage = photocurrent * setup.PDresis
+    np.savetxt(os.path.join(keithleydirectory, 'keithleyPDvoltages.txt'), np.stack((voltage, oledcurrent * 1e3, pdvoltage)).T,
+               fmt='%.4f %.6e %.6e', delimiter='\t', header='\n'.join([header, 'OLEDVoltage	OLEDCurrent Photodiode Voltage', 'V	              mA               V']), comments='')
+    np.savetxt(os.path.join(keithleydirectory, 'specifickeithleyPDvoltages.txt'), np.array([3.0, current, np.interp(3.0, voltage, pdvoltage)]),
+               fmt='%.4e', delimiter='\t', header=header, comments='')
+
+    above = pdvoltage > setup.PDcutoff
+    half = angles[(angles >= normal) & (angles <= normal + 90)]
+    return {'eFACTOR': 1.0 / (m + 1), 'vFACTOR': 1.0 / (m + 1), 'lambdamax': wavelength[np.argmax(intensity)],
+            'EQE_NONLAM': np.where(above, eqe, 0.0), 'EQE_LAM': np.where(above, eqe * (m + 1) / 2.0, 0.0),
+            'lamdata': np.stack((half, np.cos(np.deg2rad(half - normal))**m))}
+
+def load_function(name):
+    """
+    Analysis function from 'module:function', e.g. 'EL_analysis:analyse_run'.
+    """
+    module, function = name.split(':')
+    return getattr(importlib.import_module(module), function)
+
+def run_case(analyse, name, case, datadirectory):
+    """
+    Make and analyse one synthetic run.
+
+    returns:
+        numbers: dict
+            numeric tables of all processed text files (key: file name without sample name) and the returned results.
+        expected: dict
+            analytic answers, see make_run().
+        duration: float
+            analysis time in s.
+    """
+    expected = make_run(datadirectory, name, **case)
+    start = time.time()
+    results = analyse(name, DATETIME, datadirectory=datadirectory)
+    duration = time.time() - start
+    numbers = {}
+    processdirectory = os.path.join(datadirectory, name, DATETIME, 'processedEL')
+    for filename in sorted(os.listdir(processdirectory)):
+        if filename.endswith('.txt') and not filename.endswith('_specdata.txt'): # _specdata.txt is not a numeric table
+            numbers[filename[len(name):-4]] = read_table(os.path.join(processdirectory, filename))
+    for key in ('eFACTOR', 'vFACTOR', 'CIE', 'lambdamax'):
+        numbers[key] = np.array(results[key], dtype=float)
+    return numbers, expected, duration
+
+def deviation(new, old, rtol=RTOL, atol=ATOL):
+    """
+    Largest deviation of new from old in units of the tolerance (<= 1 passes), NaN in the same places is equal.
+
+    returns:
+        ratio: float
+    """
+    new = np.atleast_2d(np.asarray(new, dtype=float))
+    old = np.atleast_2d(np.asarray(old, dtype=float))
+    if new.shape != old.shape:
+        return np.inf
+    if not np.array_equal(np.isnan(new), np.isnan(old)):
+        return np.inf
+    finite = np.isfinite(old) & np.isfinite(new)
+    if not np.all((new[~finite] == old[~finite]) | np.isnan(old[~finite])):
+        return np.inf # infinite values have to agree, NaN positions are checked above
+    scale = np.nanmax(np.where(np.isfinite(old), np.abs(old), np.nan), axis=0, keepdims=True)
+    tolerance = atol * np.where(np.isnan(scale), 0, scale) + rtol * np.abs(old)
+    with np.errstate(invalid='ignore'):
+        difference = np.abs(new - old)
+        ratio = np.where(tolerance > 0, difference / np.where(tolerance > 0, tolerance, 1), np.where(difference > 0, np.inf, 0))
+    return float(np.max(np.where(finite, ratio, 0))) if ratio.size else 0.0
+
+def analytic_deviation(numbers, expected):
+    """
+    Largest relative deviation of the analysed numbers from the analytic answers.
+    """
+    deviations = {}
+    deviations['eFACTOR'] = abs(numbers['eFACTOR'] / expected['eFACTOR'] - 1)
+    deviations['vFACTOR'] = abs(numbers['vFACTOR'] / expected['vFACTOR'] - 1)
+    for key, table in (('EQE_NONLAM', '_effdata_NONLAM'), ('EQE_LAM', '_effdata_LAM')):
+        valid = expected[key] > 0
+        deviations[key] = float(np.max(np.abs(numbers[table][valid, 5] / expected[key][valid] - 1)))
+    lamdata = numbers['_lamdata']
+    rows = np.in1d(lamdata[:, 0], expected['lamdata'][0])
+    for column in (2, 3):
+        deviations['lamdata'] = max(deviations.get('lamdata', 0.0), float(np.max(np.abs(lamdata[rows, column] - expected['lamdata'][1]))))
+    deviations['lambdamax'] = abs(numbers['lambdamax'] - expected['lambdamax']) / expected['lambdamax']
+    return deviations
+
+def freeze(goldendirectory=GOLDEN_DIRECTORY, analyse='EL_analysis:analyse_run', cases=CASES):
+    """
+    Analyse all cases and store their numbers as golden outputs (one .npz file per case).
+    """
+    analyse = load_function(analyse)
+    if not os.path.isdir(goldendirectory):
+        os.makedirs(goldendirectory)
+    datadirectory = tempfile.mkdtemp()
+    try:
+        for name in sorted(cases):
+            numbers, expected, duration = run_case(analyse, name, cases[name], datadirectory)
+            np.savez_compressed(os.path.join(goldendirectory, name + '.npz'), **numbers)
+            print('Frozen ' + name + ' (' + '%.2f' % duration + ' s)')
+    finally:
+        shutil.rmtree(datadirectory)
+
+def compare(goldendirectory=GOLDEN_DIRECTORY, analyse='EL_analysis:analyse_run', cases=CASES, rtol=RTOL, atol=ATOL,
+            analytic_rtol=ANALYTIC_RTOL):
+    """
+    Analyse all cases with an implementation and compare against the golden outputs and the analytic answers.
+
+    returns:
+        report: dict
+            for every case: 'golden' (deviation of every output in units of the tolerance), 'analytic' (relative
+            deviation from the analytic answers), 'time' (s) and 'passed'.
+    """
+    analyse = load_function(analyse)
+    datadirectory = tempfile.mkdtemp()
+    report = {}
+    try:
+        for name in sorted(cases):
+            numbers, expected, duration = run_case(analyse, name, cases[name], datadirectory)
+            golden = np.load(os.path.join(goldendirectory, name + '.npz'))
+            golden_deviation = {}
+            for key in golden.files:
+                golden_deviation[key] = deviation(numbers[key], golden[key], rtol, atol) if key in numbers else np.inf
+            analytic = analytic_deviation(numbers, expected)
+            passed = all(value <= 1 for value in golden_deviation.values()) and all(value <= analytic_rtol for value in analytic.values())
+            report[name] = {'golden': golden_deviation, 'analytic': analytic, 'time': duration, 'passed': passed}
+    finally:
+        shutil.rmtree(datadirectory)
+    return report
+
+def print_report(report):
+    for name in sorted(report):
+        result = report[name]
+        print('\n' + name + ':  ' + ('PASSED' if result['passed'] else 'FAILED') + '    analysis time ' + '%.2f' % result['time'] + ' s')
+        for key in sorted(result['golden']):
+            print('    golden    ' + key.ljust(22) + '%.3g' % result['golden'][key] + ' x tolerance')
+        for key in sorted(result['analytic']):
+            print('    analytic  ' + key.ljust(22) + '%.3g' % result['analytic'][key])
+
+"RUNNING FROM THE COMMAND LINE"
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'compare'
+    goldendirectory = os.path.abspath(sys.argv[2]) if len(sys.argv) > 2 else GOLDEN_DIRECTORY
+    analyse = sys.argv[3] if len(sys.argv) > 3 else 'EL_analysis:analyse_run'
+    if command == 'freeze':
+        freeze(goldendirectory, analyse)
+    elif command == 'compare':
+        report = compare(goldendirectory, analyse)
+        print_report(report)
+        sys.exit(0 if all(result['passed'] for result in report.values()) else 1)
+    else:
+        print('Usage: python golden_harness.py freeze|compare [golden folder] [module:function]')
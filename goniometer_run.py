@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the data model of one goniometer run. A run folder as written by Goniometer_measurement.py
+('data'/sample/datetime with 'raw'/'spectrumdata' and 'raw'/'keithleydata') is discovered when a GoniometerRun
+is created, but nothing is loaded until it is used:
+	- angles, wavelengths: parsed from the file names / the first spectrum file
+	- spectrum(angle): raw counts of a single angle, only this file is read
+	- spectra: (angles x pixels) matrix of raw counts of all angles
+	- spectrum_block(start, stop): raw counts of a block of angles, nothing is kept in memory (chunked analysis)
+	- background: raw counts of the background (dark) spectrum ('spectrumdata' for EL runs, 'raw' for PL runs)
+	- oled_table, pd_table, specific_pd_table: the Keithley tables (keithleyOLEDvoltages.txt, keithleyPDvoltages.txt,
+	  specifickeithleyPDvoltages.txt)
+	- header(name): the text header of any file of the run
+	- setpoints: the source values of a sweep with several setpoints per angle (None for one)
+
+A sweep with several source values at every angle ('raw'/setpoints.txt) keeps the spectra and the keithleyOLEDvoltages.txt
+of every setpoint in 'raw'/'setpoint1', 'raw'/'setpoint2', ... (each with 'spectrumdata' and 'keithleydata'), the dark
+spectrum and the photodiode scan are shared in 'raw'/'spectrumdata' and 'raw'/'keithleydata'. GoniometerRun(directory,
+setpoint=k) reads setpoint k like a run with one setpoint.
+
+Goniometer_measurement.py writes an empty 'raw'/COMPLETE file (mark_complete()) once the measurement of a run has
+finished in any mode; runs without it are still being measured or were interrupted.
+
+The first time the full spectra matrix is requested the text files are parsed once and saved as binary .npy
+files in 'raw'/'cache'. Later uses memory-map this cache, so notebooks and batch jobs only touch the pages they
+need. The cache is rebuilt when a spectrum file is newer than the cache.
+
+Runs packed by run_archive.py ('raw.npz' instead of the 'raw' folder) are read directly from the archive, only the
+files that are used are decompressed; such runs have no cache.
+
+Example:
+	run = GoniometerRun(os.path.join('data', 'S23D1', '201907031258'))
+	perp = run.spectrum(0)  # only reads Angle0.0.txt
+	spectra = run.spectra  # memory-mapped (angles x pixels) array
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+
+"DEFAULT SETTINGS"
+SPECTRUM_FOLDER = 'spectrumdata'
+KEITHLEY_FOLDER = 'keithleydata'
+CACHE_FOLDER = 'cache'
+ARCHIVE = 'raw.npz' # packed 'raw' folder, see run_archive.py
+SETPOINT_FOLDER = 'setpoint' # 'raw'/'setpoint1', ... of a sweep with several setpoints per angle
+SETPOINTS_FILE = 'setpoints.txt' # setpoint, source value (A or V)
+COMPLETE_FILE = 'COMPLETE' # marker in 'raw' of a finished measurement
+
+"FUNCTIONS"
+def read_table(path):
+    """
+    Load the numeric part of a measurement text file.
+
+    The header lines are skipped, independent of their number (spectra files can have extra source value lines).
+
+    returns:
+        data: np.array
+            numeric table of the file (1D for single-row/column files).
+    """
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    for start, line in enumerate(lines):
+        try:
+            [float(x) for x in line.split()]
+        except ValueError:
+            continue
+        if line.split():
+            break
+    return np.loadtxt(lines[start:])
+
+def read_header(path):
+    """
+    Header lines of a measurement text file (everything in front of the numeric table).
+    """
+    header = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                [float(x) for x in line.split()]
+                if line.split():
+                    break
+            except ValueError:
+                pass
+            header.append(line.rstrip('\r\n'))
+    return header
+
+def angle_from_filename(filename):
+    """
+    Angle of a spectrum file, e.g. 'Angle-10.0.txt' -> -10.0
+    """
+    return float(filename.split('Angle')[1].split('.txt')[0])
+
+def setpoint_folder(setpoint):
+    """
+    Folder of a setpoint in 'raw', e.g. 2 -> 'setpoint2'.
+    """
+    return SETPOINT_FOLDER + str(int(setpoint))
+
+def mark_complete(rawdirectory):
+    """
+    Mark the measurement of a run as finished (empty COMPLETE file in its 'raw' folder).
+    """
+    open(os.path.join(rawdirectory, COMPLETE_FILE), 'w').close()
+
+"DATA MODEL"
+class GoniometerRun(object):
+    """
+    Lazily loaded goniometer run (see module description).
+
+    directory: str
+        the datetime folder of the run or its 'raw' folder (also if the run is packed in 'raw.npz').
+    cache: bool
+        if True the spectra matrix is stored as memory-mappable .npy files in 'raw'/'cache'.
+    setpoint: int
+        setpoint (1, 2, ...) of a sweep with several setpoints per angle, None for a run with one setpoint.
+    """
+
+    def __init__(self, directory, cache=True, setpoint=None):
+        directory = os.path.abspath(directory)
+        if os.path.basename(directory) != 'raw' and (os.path.isdir(os.path.join(directory, 'raw')) or os.path.isfile(os.path.join(directory, ARCHIVE))):
+            directory = os.path.join(directory, 'raw')
+        self.archive = None
+        if not os.path.isdir(directory) and os.path.isfile(os.path.join(os.path.dirname(directory), ARCHIVE)):
+            import run_archive # imports this module
+            self.archive = run_archive.RunArchive(os.path.join(os.path.dirname(directory), ARCHIVE))
+        elif not os.path.isdir(directory):
+            raise IOError('No raw data found in ' + directory)
+        self.rawdirectory = directory
+        self.setpoint = setpoint
+        folder = '' if setpoint is None else setpoint_folder(setpoint) + '/'
+        self.spectrumfolder = folder + SPECTRUM_FOLDER # relative to 'raw'
+        self.keithleyfolder = folder + KEITHLEY_FOLDER
+        self.spectrumdirectory = os.path.join(directory, *self.spectrumfolder.split('/'))
+        self.keithleydirectory = os.path.join(directory, *self.keithleyfolder.split('/'))
+        self.cachedirectory = os.path.join(directory, folder, CACHE_FOLDER)
+        self.use_cache = cache and self.archive is None
+        self._cache = {}
+
+        # Discovering the files, nothing is read yet. Folder of every file: the files of the setpoint come before the
+        # shared files, the spectrum and Keithley files before those in 'raw' itself (PL background)
+        self.folders = {}
+        for listed in ('', SPECTRUM_FOLDER, KEITHLEY_FOLDER, self.spectrumfolder, self.keithleyfolder):
+            for name in self._listing(listed):
+                self.folders[name] = listed
+        files = self._listing(self.spectrumfolder)
+        self.keithley_files = sorted(name for name in self.folders if self.folders[name] in (KEITHLEY_FOLDER, self.keithleyfolder))
+        self.spectrum_files = [a for a in files if a.startswith('Angle')]
+        self.spectrum_files.sort(key=lambda x: (angle_from_filename(x), x))
+        self.background_files = sorted([a for a in set(files + self._listing(SPECTRUM_FOLDER)) if not a.startswith('Angle') and a.endswith('.txt')])
+        if not self.background_files and 'Background.txt' in self._listing(''):
+            self.background_files = ['Background.txt']  # PL runs save the background in the 'raw' folder
+
+    def __repr__(self):
+        return ('GoniometerRun(' + repr(self.rawdirectory) + ('' if self.setpoint is None else ', setpoint ' + str(self.setpoint)) + ', ' +
+                str(len(self.spectrum_files)) + ' angles' + (', packed)' if self.archive is not None else ')'))
+
+    def _listing(self, folder):
+        """
+        Names in a folder of 'raw' ('' for 'raw' itself), from the archive if the run is packed.
+        """
+        if self.archive is not None:
+            return list(self.archive.files(folder))
+        path = os.path.join(self.rawdirectory, *folder.split('/'))
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def _cached(self, key, load):
+        if key not in self._cache:
+            self._cache[key] = load()
+        return self._cache[key]
+
+    "FILE ACCESS"
+    def path(self, filename):
+        """
+        Full path of a file of the run (spectrum, background or Keithley file).
+        """
+        folder = self.folders.get(filename, self.spectrumfolder)
+        return os.path.join(self.rawdirectory, *(folder.split('/') + [filename]) if folder else [filename])
+
+    def member(self, filename):
+        """
+        Name of a file in the archive of a packed run, e.g. 'spectrumdata/Angle10.0.txt'.
+        """
+        return os.path.relpath(self.path(filename), self.rawdirectory).replace(os.sep, '/')
+
+    def table(self, filename):
+        """
+        Numeric table of a file of the run, from the archive if the run is packed.
+        """
+        if self.archive is not None:
+            return self.archive.table(self.member(filename))
+        return read_table(self.path(filename))
+
+    def header(self, filename):
+        """
+        Header lines of a file of the run.
+        """
+        if self.archive is not None:
+            return self.archive.header(self.member(filename))
+        return read_header(self.path(filename))
+
+    def filename(self, angle):
+        """
+        Name of the spectrum file of a given angle.
+        """
+        for title in self.spectrum_files:
+            if angle_from_filename(title) == float(angle):
+                return title
+        raise KeyError('No spectrum for angle ' + str(angle) + ' in ' + self.spectrumdirectory)
+
+    "ANGLES AND WAVELENGTHS"
+    @property
+    def angles(self):
+        """
+        Sorted angles of the spectrum files (deg).
+        """
+        return self._cached('angles', lambda: np.array([angle_from_filename(a) for a in self.spectrum_files]))
+
+    @property
+    def wavelengths(self):
+        """
+        Wavelength axis of the spectrometer (nm), taken from the first spectrum file.
+        """
+        return self._cached('wavelengths', lambda: self.table(self.spectrum_files[0])[:, 0])
+
+    "SPECTRA"
+    def spectrum(self, angle):
+        """
+        Raw counts of the spectrum at one angle; the spectra matrix is used if it is already loaded.
+        """
+        if 'spectra' in self._cache:
+            return np.array(self._cache['spectra'][int(np.where(self.angles == float(angle))[0][0])])
+        return self._cached(('spectrum', float(angle)), lambda: self.table(self.filename(angle))[:, 1])
+
+    def spectrum_block(self, start, stop):
+        """
+        (angles x pixels) raw counts of the spectrum files start to stop, from the binary cache if it is valid and
+        otherwise from the text files. Unlike spectrum() the spectra are not kept, so a long run can be read in blocks.
+        """
+        if 'spectra' not in self._cache and self.use_cache and self._cache_valid(os.path.join(self.cachedirectory, 'spectra.npy')):
+            self._cache['spectra'] = np.load(os.path.join(self.cachedirectory, 'spectra.npy'), mmap_mode='r')
+        if 'spectra' in self._cache:
+            return np.array(self._cache['spectra'][start:stop])
+        block = np.empty((len(self.spectrum_files[start:stop]), len(self.wavelengths)))
+        for i, title in enumerate(self.spectrum_files[start:stop]):
+            block[i] = self.table(title)[:, 1]
+        return block
+
+    @property
+    def background(self):
+        """
+        Raw counts of the background spectrum.
+        """
+        if not self.background_files:
+            raise IOError('No background spectrum in ' + self.spectrumdirectory)
+        return self._cached('background', lambda: self.table(self.background_files[0])[:, 1])
+
+    @property
+    def background_wavelengths(self):
+        """
+        Wavelength axis of the background spectrum (nm).
+        """
+        return self._cached('background_wavelengths', lambda: self.table(self.background_files[0])[:, 0])
+
+    @property
+    def setpoints(self):
+        """
+        Source values (A or V) of a sweep with several setpoints per angle, None for a run with one setpoint.
+        """
+        if self.folders.get(SETPOINTS_FILE) != '':
+            return None
+        return self._cached('setpoints', lambda: np.atleast_2d(self.table(SETPOINTS_FILE))[:, 1])
+
+    @property
+    def spectra(self):
+        """
+        (angles x pixels) matrix of raw counts, memory-mapped from the binary cache when caching is enabled.
+        """
+        return self._cached('spectra', self._load_spectra)
+
+    def _load_spectra(self):
+        cachefile = os.path.join(self.cachedirectory, 'spectra.npy')
+        if self.use_cache and self._cache_valid(cachefile):
+            return np.load(cachefile, mmap_mode='r')
+        spectra = np.empty((len(self.spectrum_files), len(self.wavelengths)))
+        for i, title in enumerate(self.spectrum_files):
+            spectra[i] = self.table(title)[:, 1]
+        if self.use_cache:
+            try:
+                if not os.path.isdir(self.cachedirectory):
+                    os.makedirs(self.cachedirectory)
+                np.save(os.path.join(self.cachedirectory, 'angles.npy'), self.angles)
+                np.save(cachefile, spectra)
+                return np.load(cachefile, mmap_mode='r')
+            except (IOError, OSError):
+                pass  # read-only data folder, keep the spectra in memory
+        return spectra
+
+    def _cache_valid(self, cachefile):
+        anglefile = os.path.join(self.cachedirectory, 'angles.npy')
+        if not (os.path.isfile(cachefile) and os.path.isfile(anglefile)):
+            return False
+        if not np.array_equal(np.load(anglefile), self.angles):
+            return False
+        cachetime = os.path.getmtime(cachefile)
+        return all(os.path.getmtime(self.path(title)) <= cachetime for title in self.spectrum_files)
+
+    "KEITHLEY TABLES"
+    @property
+    def oled_table(self):
+        """
+        keithleyOLEDvoltages.txt: columns angle (deg), OLED voltage (V), OLED current (A).
+        """
+        return self._cached('oled_table', lambda: self.table('keithleyOLEDvoltages.txt'))
+
+    @property
+    def pd_table(self):
+        """
+        keithleyPDvoltages.txt: columns OLED voltage (V), OLED current (mA), photodiode voltage (V).
+        """
+        return self._cached('pd_table', lambda: self.table('keithleyPDvoltages.txt'))
+
+    @property
+    def specific_pd_table(self):
+        """
+        specifickeithleyPDvoltages.txt: OLED voltage (V), OLED current (A), photodiode voltage (V).
+        """
+        return self._cached('specific_pd_table', lambda: self.table('specifickeithleyPDvoltages.txt'))
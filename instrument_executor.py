@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for running the blocking instrument calls of Goniometer_measurement.py (VISA for the Keithley
+sourcemeter and multimeter, seabreeze for the spectrometer, apt for the motors, and writing the data files) on one
+worker thread per instrument, so that calls to different instruments overlap while the calls to one instrument stay
+in order:
+	- worker.submit(function, *args) starts a call and returns a Pending result at once
+	- pending.result() waits for it; a call that takes longer than the timeout of its instrument raises
+	  InstrumentTimeout instead of hanging the measurement, an exception of the call is raised again with the
+	  traceback of the worker thread (where the VISA or seabreeze call failed)
+	- gather(*pending) waits for several calls that run at the same time
+A function of an instrument must only be called directly from the measurement thread while no call of its worker is
+pending (every submit is followed by result() or gather() before the instrument is used again).
+
+Python 2 has no asyncio, the workers give the same overlap of independent waits with threads.
+
+Example, SMU and multimeter read at the same time:
+	smu, dmm = InstrumentWorker('Sourcemeter'), InstrumentWorker('Multimeter')
+	current, pdvoltage = gather(smu.submit(keith.query, 'Read?'), dmm.submit(reader.read))
+"""
+
+"IMPORTING REQUIRED MODULES"
+import sys
+import time
+import threading
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
+
+"DEFAULT SETTINGS"
+TIMEOUT = 30.0 # s, VISA and seabreeze calls (adaptive photodiode readings can take several seconds)
+MOVE_TIMEOUT = 120.0 # s, motor moves
+DISK_TIMEOUT = 60.0 # s, writing the data files
+
+"FUNCTIONS"
+if sys.version_info[0] < 3:
+    exec('def reraise(error, trace):\n    raise type(error), error, trace\n') # Python 2 syntax, not parsed by Python 3
+else:
+    def reraise(error, trace):
+        """
+        Raise an exception again with the traceback of the thread it was caught in.
+        """
+        raise error.with_traceback(trace)
+
+class InstrumentTimeout(RuntimeError):
+    """
+    An instrument did not finish a call within its timeout.
+    """
+
+def gather(*pending):
+    """
+    Results of several calls, in the order they are given.
+    """
+    return [p.result() for p in pending]
+
+"PENDING RESULT"
+class Pending(object):
+    """
+    Result of a call that runs on an instrument worker.
+    """
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+        self.trace = None # traceback of the error in the worker thread
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self, timeout=None):
+        """
+        Value of the call, waits at most timeout (default: the timeout of the instrument) seconds.
+        """
+        if not self.finished.wait(self.timeout if timeout is None else timeout):
+            raise InstrumentTimeout(self.name + ' did not answer within ' + str(self.timeout if timeout is None else timeout) + ' s')
+        if self.error is not None:
+            reraise(self.error, self.trace)
+        return self.value
+
+"WORKER"
+class InstrumentWorker(threading.Thread):
+    """
+    Thread that runs the calls of one instrument one after the other.
+
+    name: str
+        name of the instrument, used in the timeout message.
+    timeout: float
+        time in s after which result() gives up on a call.
+    """
+
+    def __init__(self, name, timeout=TIMEOUT):
+        threading.Thread.__init__(self)
+        self.daemon = True # a call that hangs must not keep the program open
+        self.name_ = name
+        self.timeout = timeout
+        self.calls = queue.Queue()
+        self.busy = 0.0 # time in s spent in calls
+        self.start()
+
+    def run(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                return
+            pending, function, args, kwargs = call
+            start = time.time()
+            try:
+                pending.value = function(*args, **kwargs)
+            except Exception as error:
+                pending.error = error
+                pending.trace = sys.exc_info()[2]
+            self.busy += time.time() - start
+            pending.finished.set()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Start a call, returns its Pending result.
+        """
+        pending = Pending(self.name_, self.timeout)
+        self.calls.put((pending, function, args, kwargs))
+        return pending
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call and wait for the result (with the timeout of the instrument).
+        """
+        return self.submit(function, *args, **kwargs).result()
+
+    def wait(self, timeout=None):
+        """
+        Wait until all calls submitted so far are finished.
+        """
+        self.submit(lambda: None).result(timeout)
+
+    def close(self):
+        self.calls.put(None)
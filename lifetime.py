@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the lifetime measurement of an OLED: the perpendicular EL spectrum, the OLED voltage and the
+photodiode signal are recorded at constant current for hours to days (Lifetime mode of the EL Measurement tab).
+
+	- schedule(): sampling times, dense at the beginning (every dense_interval s during dense_duration) and log-spaced
+	  afterwards (points_per_decade), so the number of samples grows only logarithmically with the duration
+	- LifetimeLog: append-only binary log ('raw'/'lifetime'/'lifetime.bin'), one fixed-size record per sample
+	  (time, voltage, current, photodiode voltage, spectrum as float32); read_log() loads it as a structured array
+	- DecimatingRing: in-memory trace for the live plot with a fixed capacity; when it is full every second point is
+	  dropped and only every second new point is kept, so it always covers the whole run up to the latest point
+	- LifetimeEstimate: LT95 and LT50 (time until the signal dropped to 95% and 50% of its initial value), from the
+	  crossing once it has happened and from an incremental fit of a stretched exponential L0 exp(-(t/tau)^beta)
+	  before, the fit only keeps running sums
+	- LifetimeTracker: all of the above for one run, with a summary file that is rewritten after every sample
+
+A week-long run with the default schedule has about 400 samples (~3 MB log for a 2068 pixel spectrometer).
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+
+"DEFAULT SETTINGS"
+DENSE_INTERVAL = 10.0 # s
+DENSE_DURATION = 3600.0 # s
+POINTS_PER_DECADE = 20
+RING_CAPACITY = 1000
+THRESHOLDS = (0.95, 0.5) # LT95, LT50
+
+"FUNCTIONS"
+def schedule(duration, dense_interval=DENSE_INTERVAL, dense_duration=DENSE_DURATION, points_per_decade=POINTS_PER_DECADE):
+    """
+    Sampling times in s from the start of the run, up to duration.
+    """
+    t = 0.0
+    while t <= min(dense_duration, duration):
+        yield t
+        t += dense_interval
+    k = 1
+    while True:
+        t = max(dense_duration * 10**(float(k) / points_per_decade), dense_duration + dense_interval)
+        if t > duration:
+            break
+        yield t
+        k += 1
+
+def record_dtype(pixels):
+    """
+    Layout of one record of the binary log.
+    """
+    return np.dtype([('time', '<f8'), ('voltage', '<f8'), ('current', '<f8'), ('pd_voltage', '<f8'),
+                     ('spectrum', '<f4', (pixels,))])
+
+def read_log(directory):
+    """
+    Load the binary log of a lifetime run ('lifetime' folder).
+
+    returns:
+        wavelengths: np.array
+        records: np.array
+            structured array with the fields 'time' (s), 'voltage' (V), 'current' (A), 'pd_voltage' (V) and
+            'spectrum' (raw counts); a record that was only partly written (e.g. power cut) is ignored.
+    """
+    wavelengths = np.loadtxt(os.path.join(directory, 'lifetime_wavelengths.txt'))
+    dtype = record_dtype(len(wavelengths))
+    path = os.path.join(directory, 'lifetime.bin')
+    count = os.path.getsize(path) // dtype.itemsize
+    return wavelengths, np.fromfile(path, dtype=dtype, count=count)
+
+"STORAGE"
+class LifetimeLog(object):
+    """
+    Append-only binary log, every record is flushed to disk when it is written.
+    """
+
+    def __init__(self, directory, wavelengths, header_lines):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.dtype = record_dtype(len(wavelengths))
+        np.savetxt(os.path.join(directory, 'lifetime_wavelengths.txt'), wavelengths, fmt='%.4f')
+        with open(os.path.join(directory, 'lifetime_header.txt'), 'w') as f:
+            f.write('\n'.join(list(header_lines) + ['Binary log lifetime.bin, little endian records of ' + str(self.dtype.itemsize) + ' bytes:',
+                                                    'time (s, float64), voltage (V, float64), current (A, float64), photodiode voltage (V, float64),',
+                                                    'spectrum (counts, ' + str(len(wavelengths)) + ' x float32, wavelengths in lifetime_wavelengths.txt)']) + '\n')
+        self.file = open(os.path.join(directory, 'lifetime.bin'), 'ab')
+
+    def append(self, time, voltage, current, pd_voltage, spectrum):
+        record = np.zeros(1, dtype=self.dtype)
+        record['time'], record['voltage'], record['current'], record['pd_voltage'] = time, voltage, current, pd_voltage
+        record['spectrum'] = spectrum
+        self.file.write(record.tobytes())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+class DecimatingRing(object):
+    """
+    Trace of (time, value) pairs with a fixed capacity that always covers the whole run at decreasing resolution.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity - capacity % 2
+        self._times = np.zeros(self.capacity)
+        self._values = np.zeros(self.capacity)
+        self.length = 0
+        self.stride = 1 # every stride-th new point is stored
+        self._skipped = 0
+        self._last = None # latest point if it was not stored
+
+    def add(self, time, value):
+        self._skipped += 1
+        if self._skipped < self.stride:
+            self._last = (time, value)
+            return
+        self._skipped = 0
+        self._last = None
+        if self.length == self.capacity:
+            half = self.capacity // 2
+            self._times[:half] = self._times[::2]
+            self._values[:half] = self._values[::2]
+            self.length = half
+            self.stride *= 2
+        self._times[self.length] = time
+        self._values[self.length] = value
+        self.length += 1
+
+    @property
+    def times(self):
+        if self._last is not None:
+            return np.append(self._times[:self.length], self._last[0])
+        return self._times[:self.length]
+
+    @property
+    def values(self):
+        if self._last is not None:
+            return np.append(self._values[:self.length], self._last[1])
+        return self._values[:self.length]
+
+"LIFETIME ESTIMATE"
+class LifetimeEstimate(object):
+    """
+    Incremental LT estimates of a decaying signal.
+
+    thresholds: tuple of float
+        remaining fractions of the initial signal, e.g. (0.95, 0.5) for LT95 and LT50.
+    """
+
+    def __init__(self, thresholds=THRESHOLDS):
+        self.thresholds = thresholds
+        self.initial = None
+        self.crossed = {}
+        self.previous = None
+        # Running sums of the linear fit ln(-ln(L/L0)) = beta ln(t) - beta ln(tau)
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = 0.0
+
+    def add(self, time, value):
+        if self.initial is None:
+            self.initial = float(value)
+            self.previous = (time, 1.0)
+            return
+        fraction = value / self.initial
+        for threshold in self.thresholds:
+            if threshold not in self.crossed and fraction <= threshold:
+                t0, f0 = self.previous
+                self.crossed[threshold] = t0 + (threshold - f0) * (time - t0) / (fraction - f0) if fraction != f0 else time
+        self.previous = (time, fraction)
+        if time > 0 and 0 < fraction < 0.999:
+            x = np.log(time)
+            y = np.log(-np.log(fraction))
+            self.n += 1
+            self.sx += x
+            self.sy += y
+            self.sxx += x * x
+            self.sxy += x * y
+
+    def fit(self):
+        """
+        Parameters tau (s) and beta of the stretched exponential, None before two points are fitted.
+        """
+        if self.n < 2:
+            return None
+        denominator = self.n * self.sxx - self.sx**2
+        if denominator <= 0:
+            return None
+        beta = (self.n * self.sxy - self.sx * self.sy) / denominator
+        if beta <= 0:
+            return None
+        tau = np.exp(-(self.sy - beta * self.sx) / self.n / beta)
+        return tau, beta
+
+    def lifetime(self, threshold):
+        """
+        LT of a threshold in s: measured crossing if it has happened, else extrapolated from the fit (NaN if unknown).
+
+        returns:
+            time: float
+            measured: bool
+        """
+        if threshold in self.crossed:
+            return self.crossed[threshold], True
+        fit = self.fit()
+        if fit is None:
+            return np.nan, False
+        tau, beta = fit
+        return tau * (-np.log(threshold))**(1.0 / beta), False
+
+"LIFETIME RUN"
+class LifetimeTracker(object):
+    """
+    Storage, live trace and LT estimates of one lifetime run.
+
+    directory: str
+        'raw' folder of the run, the data is written to its 'lifetime' folder.
+    wavelengths: np.array
+        wavelength axis of the spectrometer.
+    header_lines: list of str
+        general header lines of the run.
+    """
+
+    def __init__(self, directory, wavelengths, header_lines, thresholds=THRESHOLDS, capacity=RING_CAPACITY):
+        self.directory = os.path.join(directory, 'lifetime')
+        self.header_lines = list(header_lines)
+        self.log = LifetimeLog(self.directory, wavelengths, self.header_lines)
+        self.ring = DecimatingRing(capacity)
+        self.estimate = LifetimeEstimate(thresholds)
+        self.count = 0
+
+    def add(self, time, voltage, current, pd_voltage, spectrum):
+        """
+        Add one sample: append it to the log, the live trace and the LT estimates, and rewrite the summary.
+        """
+        self.log.append(time, voltage, current, pd_voltage, spectrum)
+        self.ring.add(time, pd_voltage)
+        self.estimate.add(time, pd_voltage)
+        self.count += 1
+        self.save_summary()
+
+    def summary(self):
+        """
+        One line per threshold, e.g. 'LT50 :  1.23e+05 s (extrapolated)'.
+        """
+        lines = []
+        for threshold in self.estimate.thresholds:
+            value, measured = self.estimate.lifetime(threshold)
+            lines.append('LT' + str(int(round(threshold * 100))) + ' :  ' + '%.4g' % value + ' s' + ('' if measured else ' (extrapolated)'))
+        return lines
+
+    def save_summary(self):
+        with open(os.path.join(self.directory, 'lifetime_summary.txt'), 'w') as f:
+            f.write('\n'.join(self.header_lines + ['Samples :  ' + str(self.count)] + self.summary()) + '\n')
+
+    def close(self):
+        self.log.close()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the low-rank approximation of the angle-resolved spectra in EL_analysis.py. The emission spectrum
+changes slowly with the angle, so the (angles x wavelengths) matrix of the processed spectra is described by a few
+components: spectra = scores (angles x rank) times components (rank x wavelengths), the truncated singular value
+decomposition. This is used to
+	- denoise the spectra: the integrals (RI/LI, eFACTOR/vFACTOR), the colour, the map and spectra plots and the
+	  _specdata files use the approximation, the noise of the discarded components is removed (shorter integration
+	  times at high angles for the same accuracy of eFACTOR/vFACTOR)
+	- store the map compactly: 'sample_name'_factors.npz holds scores, components and singular values as float32, e.g.
+	  (181 + 401) x 4 instead of 181 x 401 values
+The rank is given, or 'auto': the smallest rank for which the discarded part is not larger than the noise. The noise
+is estimated from the second differences of the spectra of neighbouring angles (the emission changes slowly with the
+angle, the noise of every spectrum is independent; the smoothing of the spectra does not bias the estimate, unlike a
+threshold from the median singular value). The error bound stored with the factors is exact for the truncated SVD:
+	error = |spectra - approximation| / |spectra| (Frobenius norm), i.e. sqrt(sum of the discarded s^2 / sum of s^2)
+	rms = |spectra - approximation| / sqrt(angles x wavelengths) in W/nm/sr
+The decomposition is found from the (wavelengths x wavelengths) Gram matrix that is summed block by block, so long
+runs analysed in blocks of angles (see chunked_analysis.py) are decomposed without holding the whole matrix. NMF is
+not used: the background-subtracted spectra are negative where there is no emission.
+
+Example:
+	decomposition = Decomposition(len(wavelength))
+	decomposition.add(spectra)  # once or block by block
+	model = decomposition.fit('auto', len(spectra))
+	denoised = model.denoise(spectra, 0)
+	model.save('S23D1_factors.npz', angles, wavelength)
+"""
+
+"IMPORTING REQUIRED MODULES"
+import numpy as np
+
+"DEFAULT SETTINGS"
+AUTO = 'auto' # rank from the noise level
+DTYPE = np.float32 # stored factors
+SUFFIX = '_factors.npz'
+
+"DECOMPOSITION"
+class Decomposition(object):
+    """
+    Gram matrix of the spectra and their noise, summed over all blocks of angles (added in the order of the angles).
+
+    wavelengths: int
+        points of the wavelength axis.
+    """
+
+    def __init__(self, wavelengths):
+        self.gram = np.zeros((wavelengths, wavelengths))
+        self.angles = 0
+        self.roughness = 0.0 # sum of the squared second differences between neighbouring angles
+        self.differences = 0
+        self.tail = np.zeros((0, wavelengths)) # last two spectra of the previous block
+
+    def add(self, spectra):
+        spectra = np.asarray(spectra, dtype=float)
+        self.gram += np.dot(spectra.T, spectra)
+        self.angles += len(spectra)
+        rows = np.vstack((self.tail, spectra))
+        if len(rows) > 2:
+            self.roughness += np.sum((rows[2:] - 2*rows[1:-1] + rows[:-2])**2)
+            self.differences += len(rows) - 2
+        self.tail = rows[-2:]
+
+    def noise(self):
+        """
+        Estimated squared Frobenius norm of the noise of all spectra (a second difference has 6 times the variance of
+        the noise).
+        """
+        return self.roughness / 6.0 / self.differences * self.angles if self.differences else 0.0
+
+    def fit(self, rank=AUTO, angles=None):
+        """
+        Components of the truncated SVD.
+
+        rank: int or str
+            number of components, 'auto' for the smallest rank that leaves out no more than the noise.
+        angles: int
+            number of angles (for the scores kept by the model), by default the number of spectra added.
+
+        returns:
+            model: LowRankModel
+        """
+        eigenvalues, eigenvectors = np.linalg.eigh(self.gram)
+        order = np.argsort(eigenvalues)[::-1]
+        singular_values = np.sqrt(np.clip(eigenvalues[order], 0, None))
+        if rank == AUTO:
+            discarded = np.cumsum((singular_values**2)[::-1])[::-1] # discarded part for rank 0, 1, ...
+            rank = int(np.argmax(np.append(discarded, 0.0) <= self.noise()))
+        rank = min(max(int(rank), 1), len(singular_values))
+        return LowRankModel(eigenvectors[:, order[:rank]].T, singular_values, self.angles if angles is None else angles)
+
+"LOW-RANK MODEL"
+class LowRankModel(object):
+    """
+    Truncated SVD of the spectra of a run: spectra ~ scores x components.
+
+    components: numpy.ndarray
+        (rank x wavelengths) orthonormal spectral components.
+    singular_values: numpy.ndarray
+        all singular values of the spectra, largest first.
+    angles: int
+        number of angles, the scores are filled by denoise().
+    """
+
+    def __init__(self, components, singular_values, angles):
+        self.components = components
+        self.singular_values = singular_values
+        self.scores = np.zeros((angles, len(components)))
+
+    def __repr__(self):
+        return 'LowRankModel(rank ' + str(self.rank) + ', error ' + '%.2e' % self.error + ')'
+
+    @property
+    def rank(self):
+        return len(self.components)
+
+    @property
+    def error(self):
+        """
+        Relative error (Frobenius norm) of the approximation.
+        """
+        total = np.sum(self.singular_values**2)
+        return float(np.sqrt(np.sum(self.singular_values[self.rank:]**2) / total)) if total > 0 else 0.0
+
+    @property
+    def rms(self):
+        """
+        Root mean square difference between the spectra and the approximation.
+        """
+        return float(np.sqrt(np.sum(self.singular_values[self.rank:]**2) / (len(self.scores) * self.components.shape[1])))
+
+    def compression(self):
+        """
+        Values of the map divided by the values of the stored factors.
+        """
+        angles, wavelengths = len(self.scores), self.components.shape[1]
+        return angles * wavelengths / float(self.rank * (angles + wavelengths + 1))
+
+    def denoise(self, spectra, start=None):
+        """
+        Approximation of spectra (angles x wavelengths); the scores of the angles from start on are kept for save().
+        """
+        scores = np.dot(np.asarray(spectra, dtype=float), self.components.T)
+        if start is not None:
+            self.scores[start:start + len(scores)] = scores
+        return np.dot(scores, self.components)
+
+    def reconstruct(self, start=0, stop=None):
+        """
+        Approximated spectra of the angles start to stop.
+        """
+        return np.dot(self.scores[start:stop], self.components)
+
+    def save(self, path, angles, wavelength):
+        """
+        Write scores, components and singular values (float32) with the error bound.
+        """
+        np.savez_compressed(path, scores=self.scores.astype(DTYPE), components=self.components.astype(DTYPE),
+                            singular_values=self.singular_values.astype(DTYPE), angles=np.asarray(angles, dtype=float),
+                            wavelength=np.asarray(wavelength, dtype=float), error=self.error, rms=self.rms)
+
+def load(path):
+    """
+    Low-rank model of a run from its _factors.npz file, with the angles and the wavelength axis.
+
+    returns:
+        model: LowRankModel
+        angles: numpy.ndarray
+        wavelength: numpy.ndarray
+    """
+    factors = np.load(path)
+    model = LowRankModel(np.asarray(factors['components'], dtype=float), np.asarray(factors['singular_values'], dtype=float), len(factors['scores']))
+    model.scores = np.asarray(factors['scores'], dtype=float)
+    angles, wavelength = factors['angles'], factors['wavelength']
+    factors.close()
+    return model, angles, wavelength
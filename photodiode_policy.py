@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for reading the photodiode voltage with the Keithley 2100 multimeter during the voltage scan (IVL) of
+Goniometer_measurement.py. Instead of one reading at a fixed 10V range and 1 NPLC for every voltage, the range, the
+integration time (NPLC, number of power line cycles) and the number of readings that are averaged are chosen for
+every point from the signal and a target relative noise:
+	- range: the smallest range above the expected signal (with some headroom)
+	- NPLC and readings: the combination with the shortest measurement time whose noise is below the target relative
+	  noise of the signal, or below an absolute floor for signals close to zero; the noise of one reading is the noise
+	  of the multimeter (ppm of the range for the NPLC) and the white noise of the photodiode amplifier averaged over
+	  the integration time, the mean of several readings divides it by the square root of their number
+The expected signal is the previous reading (the IVL scan changes slowly from point to point), the first point uses
+a fast probe reading. A reading that overloads the range is repeated on the next range, a reading far below the
+expected signal is repeated with the setting it needs.
+
+The setting used for every point is kept (reader.used), Goniometer_measurement.py writes it into keithleyPDvoltages.txt
+(range, NPLC, readings and the effective integration time readings x NPLC / line frequency).
+"""
+
+"IMPORTING REQUIRED MODULES"
+import numpy as np
+
+"DEFAULT SETTINGS"
+LINE_FREQUENCY = 50.0 # Hz
+RANGES = [0.1, 1.0, 10.0, 100.0] # V, DC voltage ranges of the 2100
+NOISE_PPM = {0.02: 60.0, 0.2: 10.0, 1.0: 3.0, 10.0: 1.0, 100.0: 0.5} # rms noise in ppm of the range for every NPLC
+OVERHEAD = 0.005 # s per reading (conversion and transfer)
+PD_NOISE = 3e-4 # V, rms output noise of the PDA100A2 amplifier (0.3-1.1 mV depending on the gain)
+PD_BANDWIDTH = 1e3 # Hz, bandwidth of the amplifier at high gain
+MAX_READINGS = 50
+MAX_DURATION = 2.5 # s per point
+OVERRANGE = 1.2 # readings up to 120% of the range are valid
+HEADROOM = 1.1 # margin between the expected signal and the end of the range
+FLOOR = 1e-5 # V, absolute noise that is good enough for signals close to zero (below the cutoff of the analysis)
+OVERLOAD = 9.0e37 # value returned by the 2100 for an overloaded range
+FIXED = (10.0, 1.0, 1) # range, NPLC, readings without target (as before)
+PROBE = (10.0, 0.02, 1) # fast reading of the signal level for the first point
+
+"FUNCTIONS"
+def noise(setting):
+    """
+    Expected rms noise in V of the mean of a setting (range, NPLC, readings).
+    """
+    voltage_range, nplc, readings = setting
+    integration = nplc / LINE_FREQUENCY
+    amplifier = PD_NOISE / max(np.sqrt(2 * PD_BANDWIDTH * integration), 1.0)
+    return np.sqrt((NOISE_PPM[nplc] * 1e-6 * voltage_range)**2 + amplifier**2) / np.sqrt(readings)
+
+def duration(setting):
+    """
+    Expected measurement time in s of a setting.
+    """
+    voltage_range, nplc, readings = setting
+    return readings * (nplc / LINE_FREQUENCY + OVERHEAD)
+
+def choose(signal, target, floor=FLOOR):
+    """
+    Fastest setting (range, NPLC, readings) that reaches the target relative noise for a signal, the setting with the
+    lowest noise within MAX_DURATION if the target cannot be reached.
+
+    signal: float
+        expected photodiode voltage (V).
+    target: float
+        relative noise, e.g. 0.001 for 0.1%.
+    """
+    voltage_range = RANGES[-1]
+    for r in RANGES:
+        if abs(signal) * HEADROOM <= r * OVERRANGE:
+            voltage_range = r
+            break
+    allowed = max(target * abs(signal), floor)
+    candidates = []
+    for nplc in sorted(NOISE_PPM):
+        most = min(MAX_READINGS, int(MAX_DURATION / duration((voltage_range, nplc, 1))))
+        if most < 1:
+            continue
+        readings = max(int(np.ceil((noise((voltage_range, nplc, 1)) / allowed)**2 - 1e-9)), 1)
+        candidates.append((voltage_range, nplc, min(readings, most)))
+    reached = [setting for setting in candidates if noise(setting) <= allowed]
+    if reached:
+        return min(reached, key=duration)
+    return min(candidates, key=noise)
+
+"READER"
+class AdaptiveReader(object):
+    """
+    Photodiode voltage readings of the 2100 multimeter with a setting chosen for every reading.
+
+    dmm: pyvisa resource
+        the multimeter.
+    target: float
+        relative noise (e.g. 0.001 for 0.1%), 0 for the fixed setting.
+    """
+
+    def __init__(self, dmm, target=0.001, floor=FLOOR):
+        self.dmm = dmm
+        self.target = target
+        self.floor = floor
+        self.setting = None # setting the multimeter is configured with
+        self.last = None # last reading, the expected signal of the next one
+        self.used = None # setting and integration time of the last reading
+
+    def configure(self, setting):
+        if setting == self.setting:
+            return
+        voltage_range, nplc, readings = setting
+        self.dmm.write('CONFigure:VOLTage:DC ' + str(voltage_range)) # fixed range
+        self.dmm.write('VOLTage:DC:NPLCycles ' + str(nplc))
+        self.dmm.write('SAMPle:COUNt ' + str(readings)) # readings per trigger
+        self.dmm.write('TRIGger:SOURce IMMediate')
+        self.dmm.write('TRIGger:DELay 0')
+        self.setting = setting
+
+    def acquire(self, setting):
+        self.configure(setting)
+        return np.array([float(value) for value in self.dmm.query('READ?').split(',')])
+
+    def read(self):
+        """
+        Mean photodiode voltage in V, the setting used is in self.used.
+        """
+        if self.target <= 0:
+            setting = FIXED
+        else:
+            if self.last is None:
+                self.last = float(np.mean(self.acquire(PROBE)))
+            setting = choose(self.last, self.target, self.floor)
+        for attempt in range(len(RANGES) + 1):
+            values = self.acquire(setting)
+            overload = np.any(np.abs(values) >= OVERLOAD)
+            mean = float(np.mean(values[np.abs(values) < OVERLOAD])) if not np.all(np.abs(values) >= OVERLOAD) else np.nan
+            if self.target <= 0:
+                break
+            if overload:
+                if setting[0] == RANGES[-1]:
+                    break
+                setting = choose(setting[0] * OVERRANGE, self.target, self.floor) # next range up
+                continue
+            needed = choose(mean, self.target, self.floor)
+            if noise(setting) > max(self.target * abs(mean), self.floor) * 1.5 and needed != setting and attempt == 0:
+                setting = needed # signal lower than expected
+                continue
+            break
+        if not np.isnan(mean):
+            self.last = mean
+        self.used = {'range': setting[0], 'nplc': setting[1], 'readings': setting[2],
+                     'integration': setting[2] * setting[1] / LINE_FREQUENCY}
+        return mean
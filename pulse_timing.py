@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the SMU-timed EL pulse of the goniometer sweep. Instead of switching the output on, sleeping,
+reading and switching off from Python (where the on-time depends on the processing time of the previous angle),
+the trigger model of the Keithley 2450 sourcemeter produces the pulse:
+
+	block 1: clear the reading buffer
+	block 2: output ON
+	block 3: constant delay (settle_time), the OLED reaches steady state
+	block 4: (optional) notify on a digital line, hardware start of the spectrometer integration
+	block 5: measure a number of readings into the buffer, they cover the spectrometer integration
+	block 6: constant delay (rest of the on-time)
+	block 7: output OFF
+
+The spectrometer integration is started after the settle time, so one full integration lies inside the pulse. The
+on-time is settle_time + integration time + margin and is timed by the sourcemeter, the SMU reading is the mean of
+the buffer readings taken during the pulse.
+
+The sourcemeter has to be configured (source function, value, limit, NPLC) before load() is called, as in
+Goniometer_measurement.py.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import time
+
+"DEFAULT SETTINGS"
+SETTLE_TIME = 0.05  # s, from output ON to the start of the spectrometer integration
+MARGIN = 0.05  # s, allowance for the USB latency of the spectrometer request and the readout
+LINE_FREQUENCY = 50  # Hz, one NPLC is 20 ms
+
+"FUNCTIONS"
+def reading_time(nplc, line_frequency=LINE_FREQUENCY):
+    """
+    Approximate duration of one SMU reading in s (integration of nplc power line cycles, autozero off).
+    """
+    return float(nplc) / line_frequency
+
+def trigger_model(settle_time, readings, rest_time, buffer_name='pulsebuffer', trigger_line=None):
+    """
+    SCPI commands that load the pulse into the trigger model of the 2450.
+
+    settle_time: float
+        delay between output ON and the first reading (s).
+    readings: int
+        number of readings taken into the buffer during the pulse.
+    rest_time: float
+        delay between the readings and output OFF (s).
+    trigger_line: int
+        digital I/O line that is pulsed to start the spectrometer (external edge trigger), None for software start.
+
+    returns:
+        commands: list of str
+    """
+    commands = ['TRIGger:LOAD "Empty"']
+    block = 1
+    commands.append('TRIGger:BLOCk:BUFFer:CLEar ' + str(block) + ', "' + buffer_name + '"')
+    block += 1
+    commands.append('TRIGger:BLOCk:SOURce:STATe ' + str(block) + ', ON')
+    block += 1
+    commands.append('TRIGger:BLOCk:DELay:CONStant ' + str(block) + ', ' + '%.6g' % settle_time)
+    if trigger_line is not None:
+        commands.insert(0, 'DIGital:LINE' + str(trigger_line) + ':MODE TRIGger, OUT')
+        commands.insert(1, 'TRIGger:DIGital' + str(trigger_line) + ':OUT:STIMulus NOTify1')
+        block += 1
+        commands.append('TRIGger:BLOCk:NOTify ' + str(block) + ', 1')
+    block += 1
+    commands.append('TRIGger:BLOCk:MEASure ' + str(block) + ', "' + buffer_name + '", ' + str(int(readings)))
+    block += 1
+    commands.append('TRIGger:BLOCk:DELay:CONStant ' + str(block) + ', ' + '%.6g' % max(rest_time, 0))
+    block += 1
+    commands.append('TRIGger:BLOCk:SOURce:STATe ' + str(block) + ', OFF')
+    return commands
+
+"PULSE ENGINE"
+class TriggeredPulse(object):
+    """
+    SMU-timed pulse around one spectrometer integration.
+
+    keith: pyvisa resource of the 2450
+    integrationtime: float
+        spectrometer integration time in microseconds.
+    nplc: float
+        NPLC of the SMU readings (as set on the instrument).
+    trigger_line: int
+        digital line wired to the external trigger input of the spectrometer, None to start it from software.
+    """
+
+    def __init__(self, keith, integrationtime, settle_time=SETTLE_TIME, margin=MARGIN, nplc=1,
+                 buffer_name='pulsebuffer', trigger_line=None, timeout=10.0):
+        self.keith = keith
+        self.integration = float(integrationtime) * 1e-6
+        self.settle_time = settle_time
+        self.margin = margin
+        self.buffer_name = buffer_name
+        self.trigger_line = trigger_line
+        self.timeout = timeout
+        # Readings back-to-back during the integration, the rest of the pulse is a constant delay
+        self.readings = max(1, int(self.integration / reading_time(nplc)))
+        self.rest_time = self.integration + self.margin - self.readings * reading_time(nplc)
+
+    @property
+    def on_time(self):
+        """
+        Nominal duration of the pulse in s.
+        """
+        return self.settle_time + self.integration + self.margin
+
+    def load(self):
+        """
+        Load the trigger model, once per sweep.
+        """
+        for command in trigger_model(self.settle_time, self.readings, self.rest_time, self.buffer_name, self.trigger_line):
+            self.keith.write(command)
+
+    def fire(self, acquire):
+        """
+        Run one pulse and acquire one spectrum inside it.
+
+        acquire: callable
+            spectrometer acquisition, e.g. DEVICES.spec.intensities (blocks until the spectrum is read).
+
+        returns:
+            spectrum: result of acquire()
+            smu_reading: float
+                mean of the SMU readings taken during the pulse.
+        """
+        self.keith.write('INITiate')
+        if self.trigger_line is None:
+            time.sleep(self.settle_time)  # only the start of the integration is timed in software
+        spectrum = acquire()
+        self.wait()
+        data = self.keith.query('TRACe:DATA? 1, ' + str(self.readings) + ', "' + self.buffer_name + '", READ')
+        readings = [float(x) for x in data.strip().split(',') if x.strip()]
+        return spectrum, sum(readings) / len(readings)
+
+    def wait(self):
+        """
+        Wait until the trigger model has finished (output OFF).
+        """
+        start = time.time()
+        while not self.keith.query('TRIGger:STATe?').strip().upper().startswith(('IDLE', 'ABORTED', 'EMPTY')):
+            if time.time() - start > self.timeout:
+                self.keith.write('ABORt')
+                self.keith.write('Output OFF')
+                raise RuntimeError('Trigger model of the sourcemeter did not finish within ' + str(self.timeout) + ' s.')
+            time.sleep(0.005)
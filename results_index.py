@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the results index of the EL analysis. Every run analysed by EL_analysis.py is stored
+as one summary row in a local SQLite database, so that runs can be found by an indexed query instead of
+crawling the 'data' folder and re-parsing the headers of the processed text files.
+
+The index is created in the 'data' folder as 'results_index.sqlite'. One row per run (sample, datetime) holds:
+	- the analysis parameters (OLED area, distance OLED - photodiode, photodiode area, resistance and cutoff)
+	- the peak values of the non-Lambertian efficiency data (EQE, LE, CE, luminance) and the peak Lambertian EQE
+	- CIE coordinates, wavelength of maximum intensity, eFACTOR and vFACTOR
+	- the processed directory and the names of the written files
+
+Example, all devices of batch 190812 with EQE above 10%:
+	import results_index
+	index = results_index.connect()
+	runs = results_index.find_runs(index, sample='190812*', min_peak_eqe=10)
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import json
+import sqlite3
+
+"DEFAULT SETTINGS"
+DEFAULT_INDEX = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'results_index.sqlite'))
+
+# Column name and SQLite type of a summary row; sample and datetime form the primary key
+COLUMNS = [
+    ('sample', 'TEXT NOT NULL'),
+    ('datetime', 'TEXT NOT NULL'),
+    ('analysis_time', 'TEXT'),
+    ('oled_area', 'REAL'),  # m2
+    ('distance', 'REAL'),  # m
+    ('pd_area', 'REAL'),  # m2
+    ('pd_resistance', 'REAL'),  # Ohm
+    ('pd_cutoff', 'REAL'),  # V
+    ('peak_eqe', 'REAL'),  # %, non-Lambertian
+    ('peak_eqe_lam', 'REAL'),  # %, Lambertian
+    ('peak_le', 'REAL'),  # lm/W, non-Lambertian
+    ('peak_ce', 'REAL'),  # cd/A, non-Lambertian
+    ('peak_lum', 'REAL'),  # cd/m2, non-Lambertian
+    ('cie_x', 'REAL'),
+    ('cie_y', 'REAL'),
+    ('lambda_max', 'REAL'),  # nm
+    ('efactor', 'REAL'),
+    ('vfactor', 'REAL'),
+    ('process_directory', 'TEXT'),
+    ('files', 'TEXT'),  # JSON list of file names in the processed directory
+]
+COLUMN_NAMES = [name for name, sqltype in COLUMNS]
+INDEXED = ['peak_eqe', 'peak_le', 'peak_ce', 'lambda_max', 'cie_x', 'cie_y', 'datetime']
+
+"FUNCTIONS"
+def connect(path=DEFAULT_INDEX):
+    """
+    Open (and if needed create) the results index.
+
+    path: str
+        location of the SQLite file, by default 'data/results_index.sqlite'.
+
+    returns:
+        connection: sqlite3.Connection
+            connection with rows returned as sqlite3.Row (accessible by column name).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.execute('CREATE TABLE IF NOT EXISTS runs (' +
+                       ', '.join(name + ' ' + sqltype for name, sqltype in COLUMNS) +
+                       ', PRIMARY KEY (sample, datetime))')
+    for name in INDEXED:
+        connection.execute('CREATE INDEX IF NOT EXISTS runs_' + name + ' ON runs (' + name + ')')
+    connection.commit()
+    return connection
+
+def peak(values):
+    """
+    Maximum of the finite values of an array (division by zero at V = 0 gives inf in LE), None if there are none.
+    """
+    values = [float(v) for v in values if abs(float(v)) != float('inf') and float(v) == float(v)]
+    if not values:
+        return None
+    return max(values)
+
+def upsert_run(connection, summary):
+    """
+    Insert the summary row of one run or replace the existing row of the same sample and datetime.
+
+    connection: sqlite3.Connection
+        connection returned by connect().
+    summary: dict
+        column name -> value, at least 'sample' and 'datetime'. Missing columns are stored as NULL.
+    """
+    unknown = set(summary) - set(COLUMN_NAMES)
+    if unknown:
+        raise KeyError('Unknown results index columns: ' + ', '.join(sorted(unknown)))
+    values = []
+    for name in COLUMN_NAMES:
+        value = summary.get(name)
+        if name == 'files' and value is not None and not isinstance(value, str):
+            value = json.dumps(sorted(value))
+        elif hasattr(value, 'item'):  # numpy scalars are not understood by sqlite3
+            value = value.item()
+        if isinstance(value, float) and value != value:  # NaN is stored as NULL
+            value = None
+        values.append(value)
+    connection.execute('INSERT OR REPLACE INTO runs (' + ', '.join(COLUMN_NAMES) + ') VALUES (' +
+                       ', '.join(['?'] * len(COLUMN_NAMES)) + ')', values)
+    connection.commit()
+
+def find_runs(connection, sample=None, order_by='peak_eqe', descending=True, limit=None, **limits):
+    """
+    Query the results index.
+
+    sample: str
+        sample name or glob pattern (e.g. '190812*' for all devices of a batch).
+    order_by: str
+        column used to sort the results.
+    limit: int
+        maximum number of rows returned.
+    limits:
+        'min_<column>' or 'max_<column>' for any numeric column, e.g. min_peak_eqe=10 or max_lambda_max=520.
+        'min_datetime' / 'max_datetime' restrict the measurement time (YYYYMMDDHHMM strings).
+
+    returns:
+        rows: list of dict
+            one dict per run with all columns; 'files' is returned as a list.
+    """
+    clauses = []
+    arguments = []
+    if sample is not None:
+        clauses.append('sample GLOB ?')
+        arguments.append(sample)
+    for key, value in sorted(limits.items()):
+        bound, column = key[:4], key[4:]
+        if bound not in ('min_', 'max_') or column not in COLUMN_NAMES:
+            raise KeyError('Unknown query limit: ' + key)
+        clauses.append(column + (' >= ?' if bound == 'min_' else ' <= ?'))
+        arguments.append(value)
+    if order_by not in COLUMN_NAMES:
+        raise KeyError('Unknown column to order by: ' + order_by)
+    query = 'SELECT * FROM runs'
+    if clauses:
+        query += ' WHERE ' + ' AND '.join(clauses)
+    query += ' ORDER BY ' + order_by + (' DESC' if descending else ' ASC')
+    if limit is not None:
+        query += ' LIMIT ' + str(int(limit))
+    rows = []
+    for row in connection.execute(query, arguments):
+        row = dict(zip(row.keys(), tuple(row)))
+        if row['files'] is not None:
+            row['files'] = json.loads(row['files'])
+        rows.append(row)
+    return rows
+
+def remove_run(connection, sample, datetime):
+    """
+    Delete the summary row of one run, e.g. after its processed data was removed.
+    """
+    connection.execute('DELETE FROM runs WHERE sample = ? AND datetime = ?', (sample, datetime))
+    connection.commit()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for packing completed runs into a compressed archive. A run folder holds hundreds of small text
+files (Angle_.txt with the same header and wavelength column in every file, the Keithley tables, the background), so
+the 'data' folder gets slow to scan and expensive to back up. pack() writes the 'raw' folder of a run into a single
+'raw.npz' next to it:
+	- every file of 'raw' is one compressed member of the archive (zip), so a reader decompresses only the files it
+	  needs, e.g. the spectra of some angles
+	- numeric tables are stored binary (int32, float32 or float64, the smallest type that holds every value exactly),
+	  the wavelength column that all spectra share is stored once; the headers are kept in the manifest
+	- other files (journal.jsonl, ...) are stored as they are; the 'cache' folders (of the run and of every setpoint)
+	  are left out (they are rebuilt)
+The archive is read back and compared with the text files before the 'raw' folder is deleted. GoniometerRun reads
+packed runs directly (EL_analysis.py and PL_analysis.py analyse them like unpacked runs), unpack() restores the
+text files.
+
+Only completed runs are packed: EL and PL runs with the 'raw'/COMPLETE marker that Goniometer_measurement.py writes
+at the end of every mode (see goniometer_run.py). Runs that are still measured or were interrupted have none; runs
+measured before the marker was introduced are marked with the 'mark' command.
+
+Usage:
+	python run_archive.py pack [folder]      # all completed runs in folder ('data' folder or one run folder)
+	python run_archive.py unpack run_folder
+	python run_archive.py mark run_folder    # mark a finished run that has no COMPLETE marker
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import sys
+import json
+import shutil
+import numpy as np
+from goniometer_run import read_table, read_header, mark_complete, SPECTRUM_FOLDER, KEITHLEY_FOLDER, CACHE_FOLDER, COMPLETE_FILE
+
+"DEFAULT SETTINGS"
+EXTENSION = '.npz'
+VERSION = 1
+DATA_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
+
+"FUNCTIONS"
+def smallest(table):
+    """
+    Table in the smallest type that holds every value exactly (int32, float32 or float64).
+    """
+    table = np.asarray(table, dtype=float)
+    if np.all(np.isfinite(table)) and np.all(table == np.round(table)) and np.all(np.abs(table) < 2**31):
+        return table.astype(np.int32)
+    if np.array_equal(table.astype(np.float32), table):
+        return table.astype(np.float32)
+    return table
+
+def parse(path):
+    """
+    Header lines and numeric table of a text file, None if it is not a table.
+    """
+    try:
+        table = read_table(path)
+        header = read_header(path)
+    except (ValueError, IndexError, NameError): # no numeric table (NameError for empty files)
+        return None
+    return header, table
+
+def completed(rawdirectory):
+    """
+    True if the measurement of a run has finished: COMPLETE marker and spectrum data, with the Keithley data (EL) or
+    the background in 'raw' (PL).
+    """
+    if not (os.path.isfile(os.path.join(rawdirectory, COMPLETE_FILE)) and os.path.isdir(os.path.join(rawdirectory, SPECTRUM_FOLDER))):
+        return False
+    return os.path.isdir(os.path.join(rawdirectory, KEITHLEY_FOLDER)) or os.path.isfile(os.path.join(rawdirectory, 'Background.txt'))
+
+def pack(rawdirectory, remove=True):
+    """
+    Pack the 'raw' folder of a run into 'raw.npz' next to it.
+
+    rawdirectory: str
+        'raw' folder of the run.
+    remove: bool
+        delete the 'raw' folder once the archive has been checked against it.
+
+    returns:
+        archive: str
+            path of the archive.
+    """
+    rawdirectory = os.path.abspath(rawdirectory)
+    members = {}
+    manifest = {'version': VERSION, 'files': []}
+    # The spectra share one wavelength axis
+    spectra = sorted(os.listdir(os.path.join(rawdirectory, SPECTRUM_FOLDER))) if os.path.isdir(os.path.join(rawdirectory, SPECTRUM_FOLDER)) else []
+    first = [name for name in spectra if name.startswith('Angle')]
+    wavelengths = read_table(os.path.join(rawdirectory, SPECTRUM_FOLDER, first[0]))[:, 0] if first else None
+    if wavelengths is not None:
+        members['wavelengths'] = wavelengths
+    for folder, subfolders, files in os.walk(rawdirectory):
+        if CACHE_FOLDER in os.path.relpath(folder, rawdirectory).split(os.sep):
+            continue
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            relative = os.path.relpath(path, rawdirectory).replace(os.sep, '/')
+            member = 'f' + str(len(manifest['files'])).zfill(5)
+            entry = {'name': relative, 'member': member}
+            parsed = parse(path) if name.endswith('.txt') else None
+            if parsed is None:
+                with open(path, 'rb') as f:
+                    members[member] = np.frombuffer(f.read(), dtype=np.uint8)
+                entry['kind'] = 'file'
+            else:
+                header, table = parsed
+                entry['kind'] = 'table'
+                entry['header'] = header
+                entry['shape'] = list(table.shape)
+                if (wavelengths is not None and table.ndim == 2 and table.shape[0] == len(wavelengths)
+                        and np.array_equal(table[:, 0], wavelengths)):
+                    table = table[:, 1:]
+                    entry['wavelengths'] = True # first column is the shared wavelength axis
+                members[member] = smallest(table)
+            manifest['files'].append(entry)
+    members['manifest'] = np.frombuffer(json.dumps(manifest).encode('utf-8'), dtype=np.uint8)
+    archive = rawdirectory + EXTENSION
+    temporary = archive + '.tmp' + EXTENSION
+    np.savez_compressed(temporary, **members)
+    packed = RunArchive(temporary)
+    try:
+        check(packed, rawdirectory)
+    except ValueError:
+        packed.close()
+        os.remove(temporary)
+        raise
+    packed.close()
+    os.rename(temporary, archive)
+    if remove:
+        shutil.rmtree(rawdirectory)
+    return archive
+
+def check(archive, rawdirectory):
+    """
+    Compare an archive with the 'raw' folder it was packed from, raises ValueError if anything differs.
+    """
+    for entry in archive.manifest['files']:
+        path = os.path.join(rawdirectory, *entry['name'].split('/'))
+        if entry['kind'] == 'file':
+            with open(path, 'rb') as f:
+                same = f.read() == archive.data(entry['name'])
+        else:
+            same = (np.array_equal(read_table(path), archive.table(entry['name']))
+                    and read_header(path) == archive.header(entry['name']))
+        if not same:
+            raise ValueError('Archive differs from ' + path)
+
+def unpack(archivepath, remove=False):
+    """
+    Restore the 'raw' folder of a packed run (tables are written with the shortest exact representation).
+    """
+    archive = RunArchive(archivepath)
+    rawdirectory = archivepath[:-len(EXTENSION)]
+    for entry in archive.manifest['files']:
+        path = os.path.join(rawdirectory, *entry['name'].split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if entry['kind'] == 'file':
+            with open(path, 'wb') as f:
+                f.write(archive.data(entry['name']))
+        else:
+            table = archive.table(entry['name'])
+            with open(path, 'w') as f:
+                for line in entry['header']:
+                    f.write(line + '\n')
+                for row in table if table.ndim == 2 else table.reshape(-1, 1):
+                    f.write('\t'.join(repr(float(x)) for x in row) + '\n')
+    archive.close()
+    if remove:
+        os.remove(archivepath)
+    return rawdirectory
+
+"READER"
+class RunArchive(object):
+    """
+    Packed run, the members are only decompressed when they are read.
+
+    path: str
+        the 'raw.npz' file of the run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.npz = np.load(path)
+        self.manifest = json.loads(self.npz['manifest'].tobytes().decode('utf-8'))
+        self.entries = dict((entry['name'], entry) for entry in self.manifest['files'])
+        self.listing = {}
+
+    def __repr__(self):
+        return 'RunArchive(' + repr(self.path) + ', ' + str(len(self.entries)) + ' files)'
+
+    def files(self, folder=''):
+        """
+        Names of the files in a folder of 'raw' ('' for 'raw' itself).
+        """
+        if folder not in self.listing:
+            prefix = folder + '/' if folder else ''
+            self.listing[folder] = sorted(name[len(prefix):] for name in self.entries if name.startswith(prefix) and '/' not in name[len(prefix):])
+        return self.listing[folder]
+
+    def isdir(self, folder):
+        return any(name.startswith(folder + '/') for name in self.entries)
+
+    def table(self, name):
+        """
+        Numeric table of a file, as read_table() of the text file returns it.
+        """
+        entry = self.entries[name]
+        table = np.asarray(self.npz[entry['member']], dtype=float)
+        if entry.get('wavelengths'):
+            table = np.column_stack((self.npz['wavelengths'], table))
+        return table.reshape(entry['shape'])
+
+    def header(self, name):
+        return list(self.entries[name]['header'])
+
+    def data(self, name):
+        """
+        Content of a file that is not a table.
+        """
+        return self.npz[self.entries[name]['member']].tobytes()
+
+    def close(self):
+        self.npz.close()
+
+"RUNNING FROM THE COMMAND LINE"
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'pack'
+    if command == 'pack':
+        folder = os.path.abspath(sys.argv[2]) if len(sys.argv) > 2 else DATA_DIRECTORY
+        raws = [os.path.join(folder, 'raw')] if os.path.isdir(os.path.join(folder, 'raw')) else \
+               [os.path.join(folder, sample, datetime, 'raw') for sample in sorted(os.listdir(folder)) if os.path.isdir(os.path.join(folder, sample))
+                for datetime in sorted(os.listdir(os.path.join(folder, sample))) if os.path.isdir(os.path.join(folder, sample, datetime, 'raw'))]
+        for raw in raws:
+            if not completed(raw):
+                print('Skipped (not completed) : ' + raw)
+                continue
+            before = sum(os.path.getsize(os.path.join(f, name)) for f, d, names in os.walk(raw) for name in names)
+            archive = pack(raw)
+            print('Packed : ' + archive + '  ' + str(before // 1024) + ' kB -> ' + str(os.path.getsize(archive) // 1024) + ' kB')
+    elif command == 'unpack':
+        print('Unpacked : ' + unpack(os.path.join(os.path.abspath(sys.argv[2]), 'raw' + EXTENSION)))
+    elif command == 'mark':
+        mark_complete(os.path.join(os.path.abspath(sys.argv[2]), 'raw'))
+        print('Marked as completed : ' + os.path.abspath(sys.argv[2]))
+    else:
+        print('Usage: python run_archive.py pack|unpack|mark [folder]')
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for resuming an interrupted sweep (step mode, single sweep) of Goniometer_measurement.py. Every run
+keeps a journal 'raw'/'journal.jsonl', one JSON record per line, every line is flushed to disk when it is written:
+	- 'start': settings of the run, mean dark counts (background) and the time
+	- 'angle': one per completed angle (motor angle, file angle, SMU reading, integrated background-subtracted counts),
+	  written after its Angle_.txt file, so an angle is only complete once its line is in the journal
+	- 'resume' / 'abandon': drift of the dark counts and the perpendicular intensity found when the run was restarted
+	- 'complete': the sweep has finished
+A line that was only partly written (crash, power cut) is ignored when the journal is read.
+
+When a measurement is started, the latest run of the sample is resumed if its journal has no 'complete' record and it
+was taken with the same settings. Before the sweep continues the dark frame and (if it was already measured) the
+perpendicular intensity are taken again; if either changed by more than its tolerance, the interrupted run is
+abandoned and a new run folder is started instead.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import json
+import time
+import numpy as np
+
+"DEFAULT SETTINGS"
+JOURNAL = 'journal.jsonl'
+DARK_TOLERANCE = 0.05 # relative change of the mean dark counts
+REFERENCE_TOLERANCE = 0.05 # relative change of the perpendicular intensity
+
+"FUNCTIONS"
+def sweep_settings(parameters, indices):
+    """
+    Settings of a run that must match to resume it, e.g. {'1': '318', '2': '1', ...}.
+
+    parameters: list
+        parameters of the measurement task.
+    indices: list of int
+        the parameters that define the sweep (angles, integration time, source, ...).
+    """
+    return dict((str(x), str(parameters[x])) for x in indices)
+
+def read_journal(path):
+    """
+    Records of a journal, a line that was not completely written is skipped.
+    """
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def find_interrupted(sampledirectory, settings):
+    """
+    Journal of the latest run of a sample if it was interrupted and taken with the same settings, else None.
+    """
+    if not os.path.isdir(sampledirectory) or not os.listdir(sampledirectory):
+        return None
+    path = os.path.join(sampledirectory, max(os.listdir(sampledirectory)), 'raw', JOURNAL)
+    if not os.path.isfile(path):
+        return None
+    journal = RunJournal(os.path.dirname(path))
+    if journal.finished or journal.settings != settings:
+        return None
+    return journal
+
+def integrated(intensity, dark):
+    """
+    Integrated background-subtracted counts of a spectrum.
+    """
+    return float(np.sum(np.asarray(intensity, dtype=float) - np.asarray(dark, dtype=float)))
+
+"JOURNAL"
+class RunJournal(object):
+    """
+    Journal of one run.
+
+    directory: str
+        'raw' folder of the run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL)
+        self.datetime = os.path.basename(os.path.dirname(os.path.abspath(directory)))
+        self.records = read_journal(self.path) if os.path.isfile(self.path) else []
+        self.torn = False # last line was only partly written, the next record starts on a new line
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                self.torn = f.read(1) != b'\n'
+
+    def write(self, record):
+        record['time'] = time.time()
+        with open(self.path, 'a') as f:
+            f.write(('\n' if self.torn else '') + json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.torn = False
+        self.records.append(record)
+
+    def events(self, event):
+        return [record for record in self.records if record['event'] == event]
+
+    @property
+    def settings(self):
+        start = self.events('start')
+        return start[0]['settings'] if start else None
+
+    @property
+    def finished(self):
+        """
+        True if the sweep was completed or the run was abandoned.
+        """
+        return bool(self.events('complete') or self.events('abandon'))
+
+    @property
+    def angles(self):
+        """
+        Completed angles in the order they were measured.
+        """
+        return self.events('angle')
+
+    @property
+    def reference(self):
+        """
+        Integrated counts of the perpendicular spectrum, None if it was not measured yet.
+        """
+        for record in self.angles:
+            if record['reference']:
+                return record['integral']
+        return None
+
+    def start(self, settings, dark):
+        if os.path.isfile(self.path): # journal of an abandoned run in the same folder (same minute)
+            os.rename(self.path, self.path + '.' + str(int(time.time())))
+            self.records = []
+            self.torn = False
+        self.write({'event': 'start', 'settings': settings, 'dark': float(np.mean(dark))})
+
+    def done(self, angle):
+        """
+        True if the motor angle was already completed.
+        """
+        return any(abs(record['angle'] - float(angle)) < 1e-6 for record in self.angles)
+
+    def angle(self, angle, label, voltage, current, integral, reference=False):
+        self.write({'event': 'angle', 'angle': float(angle), 'label': float(label),
+                    'voltage': None if voltage is None else float(voltage), 'current': None if current is None else float(current),
+                    'integral': float(integral), 'reference': bool(reference)})
+
+    def drift(self, dark, reference=None):
+        """
+        Relative change of the mean dark counts and of the perpendicular intensity (None if not measured).
+        """
+        old = self.events('start')[0]['dark']
+        drift = {'dark': abs(float(np.mean(dark)) - old) / abs(old) if old else 0.0, 'reference': None}
+        if reference is not None and self.reference:
+            drift['reference'] = abs(reference - self.reference) / abs(self.reference)
+        return drift
+
+    def resumable(self, drift):
+        return drift['dark'] <= DARK_TOLERANCE and (drift['reference'] is None or drift['reference'] <= REFERENCE_TOLERANCE)
+
+    def resume(self, drift):
+        self.write({'event': 'resume', 'drift': drift, 'completed': len(self.angles)})
+
+    def abandon(self, drift):
+        self.write({'event': 'abandon', 'drift': drift})
+
+    def complete(self):
+        self.write({'event': 'complete'})
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for sharing the spectrometer between the EL and the PL stage. Both stages have their own motor and
+can be measured at the same time (one ELTASK and one PLTASK thread in Goniometer_measurement.py), but there is only one
+OceanOptics spectrometer:
+	- SharedSpectrometer owns the seabreeze spectrometer and a lock, every acquisition holds the lock
+	- every stage gets a SpectrometerChannel with its own integration time; it has the methods of the seabreeze
+	  spectrometer used by the measurement (wavelengths, intensities, spectrum, integration_time_micros), so the
+	  measurement code and flyscan.py use it like the spectrometer itself
+	- the integration time is only set on the spectrometer when the other stage used a different one, the first
+	  spectrum after a change is discarded as it can still be integrated with the old integration time
+
+A stage that needs the spectrometer for longer than one acquisition (e.g. an SMU-timed pulse around one integration)
+holds channel.lock for the whole operation.
+
+A channel can reduce its spectra at acquisition (channel.reduction, a spectral_roi.SpectralReduction): wavelengths(),
+intensities() and spectrum() then return the reduced spectra, raw_wavelengths() the full axis of the spectrometer.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import threading
+import numpy as np
+
+"SHARED DEVICE"
+class SharedSpectrometer(object):
+    """
+    Spectrometer shared by several stages.
+
+    spec: seabreeze.spectrometers.Spectrometer
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.lock = threading.RLock()
+        self.integrationtime = None
+        self._wavelengths = None
+
+    def wavelengths(self):
+        """
+        Wavelength axis of the spectrometer (read once).
+        """
+        with self.lock:
+            if self._wavelengths is None:
+                self._wavelengths = self.spec.wavelengths()
+            return self._wavelengths
+
+    def acquire(self, integrationtime):
+        """
+        One spectrum (intensities) with the given integration time in microseconds.
+        """
+        with self.lock:
+            if integrationtime is not None and integrationtime != self.integrationtime:
+                self.spec.integration_time_micros(integrationtime)
+                self.integrationtime = integrationtime
+                self.spec.intensities()  # still integrated (partly) with the previous integration time
+            return self.spec.intensities()
+
+    def channel(self, integrationtime=None):
+        """
+        Access to the spectrometer for one stage.
+        """
+        return SpectrometerChannel(self, integrationtime)
+
+class SpectrometerChannel(object):
+    """
+    Spectrometer as seen by one stage, see module description.
+    """
+
+    def __init__(self, shared, integrationtime=None):
+        self.shared = shared
+        self.integrationtime = integrationtime
+        self.reduction = None
+
+    @property
+    def lock(self):
+        return self.shared.lock
+
+    def integration_time_micros(self, integrationtime):
+        self.integrationtime = integrationtime
+
+    def raw_wavelengths(self):
+        return self.shared.wavelengths()
+
+    def wavelengths(self):
+        if self.reduction is not None:
+            return self.reduction.wavelengths
+        return self.shared.wavelengths()
+
+    def intensities(self):
+        if self.reduction is not None:
+            return self.reduction.apply(self.shared.acquire(self.integrationtime))
+        return self.shared.acquire(self.integrationtime)
+
+    def spectrum(self):
+        """
+        Pre-stacked array of wavelengths and intensities, as seabreeze's spectrum().
+        """
+        with self.shared.lock:
+            return np.vstack((self.wavelengths(), self.intensities()))
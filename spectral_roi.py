@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for reducing the spectra at acquisition. The MayaLSL has 2068 pixels from about 348 to 1100nm, but the
+analysis (EL_analysis.py, PL_analysis.py) interpolates every spectrum onto the 400-800nm axis of 'Photopic_response.txt'
+straight away. The spectra can therefore be reduced before they are saved:
+	- 'Raw': all pixels (default)
+	- 'ROI': only the pixels in the region of interest (plus one pixel on both sides for the interpolation)
+	- 'Bin': the region of interest (plus one bin on both sides) with the mean of every BINNING adjacent pixels
+	- 'Grid': the region of interest linearly interpolated onto the 1nm analysis axis, the interpolation of the
+	  analysis then returns the spectra unchanged
+'ROI' and 'Grid' give the same analysis results as 'Raw', 'Bin' averages neighbouring pixels (like a slightly wider
+smoothing than the 10 nm sliding average of the analysis).
+
+The pixel indices and interpolation weights are calculated once for the wavelength axis of the spectrometer, apply()
+only does array indexing. The reduction is set on the spectrometer channel of a stage (shared_spectrometer.py), so all
+saved spectra of a run, including the background, are reduced in the same way.
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+
+"DEFAULT SETTINGS"
+MODES = ('Raw', 'ROI', 'Bin', 'Grid')
+ROI = (400.0, 800.0) # nm, wavelength range of the analysis
+BINNING = 4 # pixels per bin
+GRID = np.loadtxt(os.path.join(os.path.dirname(__file__), 'library', 'Photopic_response.txt'))[:, 0] # analysis axis
+
+"SPECTRAL REDUCTION"
+class SpectralReduction(object):
+    """
+    Reduction of the spectra of one spectrometer.
+
+    wavelengths: np.array
+        wavelength axis of the spectrometer (nm).
+    mode: str
+        'Raw', 'ROI', 'Bin' or 'Grid', see module description.
+    roi: tuple of float
+        wavelength range that is kept (nm).
+    binning: int
+        pixels per bin for 'Bin'.
+    grid: np.array
+        wavelength axis for 'Grid'.
+    """
+
+    def __init__(self, wavelengths, mode='Raw', roi=ROI, binning=BINNING, grid=GRID):
+        if mode not in MODES:
+            raise ValueError('Unknown spectral reduction ' + str(mode) + ', use one of ' + ', '.join(MODES))
+        self.mode = mode
+        self.fmt = '%.0f' if mode in ('Raw', 'ROI') else '%.1f' # intensities stay integer counts without averaging
+        self.raw_wavelengths = np.asarray(wavelengths, dtype=float)
+        # Pixels of the region of interest with one neighbour (one bin for 'Bin') on both sides
+        margin = int(binning) if mode == 'Bin' else 1
+        first = max(np.searchsorted(self.raw_wavelengths, roi[0]) - margin, 0)
+        last = min(np.searchsorted(self.raw_wavelengths, roi[1], side='right') + margin, len(self.raw_wavelengths))
+        self.pixels = slice(first, last)
+
+        if mode == 'Raw':
+            self.wavelengths = self.raw_wavelengths
+        elif mode == 'ROI':
+            self.wavelengths = self.raw_wavelengths[self.pixels]
+        elif mode == 'Bin':
+            self.binning = int(binning)
+            self.bins = (last - first) // self.binning
+            self.pixels = slice(first, first + self.bins * self.binning)
+            self.wavelengths = self.raw_wavelengths[self.pixels].reshape(self.bins, self.binning).mean(axis=1)
+        elif mode == 'Grid':
+            self.wavelengths = np.asarray(grid, dtype=float)
+            self.upper = np.clip(np.searchsorted(self.raw_wavelengths, self.wavelengths), 1, len(self.raw_wavelengths) - 1)
+            self.lower = self.upper - 1
+            self.weight = np.clip((self.wavelengths - self.raw_wavelengths[self.lower]) /
+                                  (self.raw_wavelengths[self.upper] - self.raw_wavelengths[self.lower]), 0, 1)
+
+    def description(self):
+        """
+        Line for the file headers, e.g. 'Spectra :  Bin, 400-800nm, 4 pixels per bin (132 values)'.
+        """
+        if self.mode == 'Raw':
+            return 'Spectra :  Raw, all pixels (' + str(len(self.wavelengths)) + ' values)'
+        if self.mode == 'Bin':
+            details = ', ' + str(self.binning) + ' pixels per bin'
+        elif self.mode == 'Grid':
+            details = ', interpolated onto the analysis axis'
+        else:
+            details = ''
+        return ('Spectra :  ' + self.mode + ', ' + '%.0f' % self.wavelengths[0] + '-' + '%.0f' % self.wavelengths[-1] + 'nm' +
+                details + ' (' + str(len(self.wavelengths)) + ' values)')
+
+    def apply(self, intensities):
+        """
+        Reduce one spectrum (pixels) or several spectra (spectra x pixels).
+        """
+        intensities = np.asarray(intensities)
+        if self.mode == 'Raw':
+            return intensities
+        if self.mode == 'ROI':
+            return intensities[..., self.pixels]
+        if self.mode == 'Bin':
+            cropped = np.asarray(intensities[..., self.pixels], dtype=float)
+            return cropped.reshape(cropped.shape[:-1] + (self.bins, self.binning)).mean(axis=-1)
+        return intensities[..., self.lower] * (1 - self.weight) + intensities[..., self.upper] * self.weight
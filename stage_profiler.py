@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for profiling the stages of the EL analysis (EL_analysis.py, profiling = True). Every run is split
+into stages that are marked one after the other (profiler.stage('figures') ends the stage before), for every stage
+and run the profiler records:
+	- wall time and CPU time (user + system of the process; above the wall time if numpy uses several threads)
+	- the peak memory of the process at the end of the stage and how much the stage raised it (high-water mark of the
+	  resident memory: resource on Linux/macOS, psutil on Windows if installed, otherwise not recorded)
+A stage that occurs several times in a run (e.g. figures and text export alternate) is summed. The summary of a
+batch lists the stages by their total wall time with the share of the batch, the mean per run and the largest peak
+memory, and the slowest runs; save() writes it with the table of every run and stage to
+'data'/'profiles'/profile_<time>.txt.
+
+Stages named in profile_stages ('*' for all) are also profiled function by function:
+	- 'sample': a thread samples the stack of the analysis every SAMPLE_INTERVAL s (low overhead; the time of a
+	  function is its share of the samples times the wall time of the stage, the samples are further apart while C
+	  code holds the GIL, e.g. writing PNG files)
+	- 'deterministic': cProfile (exact call counts, slows down Python-heavy stages); the stats of every profiled
+	  stage are also saved as <stage>.prof for pstats or snakeviz
+The top TOP functions of every profiled stage are added to the summary.
+
+Example:
+	profiler = StageProfiler(profile_stages=['figures'])
+	profiler.run('S23D1 201907031258')
+	profiler.stage('parsing')
+	...
+	profiler.stop()
+	print(profiler.summary())
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import sys
+import time
+import threading
+import cProfile
+import pstats
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+"DEFAULT SETTINGS"
+PROFILE_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'profiles'))
+SAMPLE_INTERVAL = 0.005 # s between two stack samples
+TOP = 15 # functions listed per profiled stage
+MODES = ('sample', 'deterministic')
+
+"FUNCTIONS"
+def peak_memory():
+    """
+    High-water mark of the resident memory of the process in MB, None if it cannot be read.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0**2 if sys.platform == 'darwin' else peak / 1024.0 # bytes on macOS, kB on Linux
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024.0**2
+    return None
+
+def snapshot():
+    """
+    Wall time, CPU time (s) and peak memory (MB) now.
+    """
+    times = os.times()
+    return time.time(), times[0] + times[1], peak_memory()
+
+def elapsed(start):
+    """
+    Wall time, CPU time, peak memory and its increase since a snapshot().
+    """
+    end = snapshot()
+    return {'wall': end[0] - start[0], 'cpu': end[1] - start[1], 'peak': end[2],
+            'growth': None if end[2] is None or start[2] is None else end[2] - start[2]}
+
+def function_name(key):
+    filename, line, name = key
+    return os.path.basename(filename) + ':' + str(line) + '(' + name + ')'
+
+"SAMPLING PROFILER"
+class Sampler(threading.Thread):
+    """
+    Samples the stack of one thread until stop() (own and cumulative samples of every function).
+
+    thread_id: int
+        ident of the sampled thread.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.own = {} # (file, line, function) -> samples in which it was running
+        self.cumulative = {} # (file, line, function) -> samples in which it was on the stack
+        self.stopped = threading.Event()
+        self.wall = 0.0 # s from start to stop
+        self.started = time.time()
+        self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if leaf:
+                    self.own[key] = self.own.get(key, 0) + 1
+                    leaf = False
+                if key not in seen: # recursion is counted once per sample
+                    seen.add(key)
+                    self.cumulative[key] = self.cumulative.get(key, 0) + 1
+                frame = frame.f_back
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.wall = time.time() - self.started
+
+"STAGE PROFILER"
+class StageProfiler(object):
+    """
+    Wall time, CPU time and peak memory of the stages of every run of a batch (see module description).
+
+    profile_stages: list of str
+        stages that are also profiled function by function, '*' for all.
+    mode: str
+        'sample' or 'deterministic' (cProfile).
+    """
+
+    def __init__(self, profile_stages=(), mode='sample'):
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode: ' + str(mode) + ' (' + ', '.join(MODES) + ')')
+        self.profile_stages = set(profile_stages or ())
+        self.mode = mode
+        self.records = [] # (run, stage, measurement) in the order they were finished
+        self.functions = {} # stage -> sampled counts or pstats.Stats
+        self.current_run = None
+        self.current = None # (stage, start snapshot, function profiler)
+
+    def add(self, run, stage, measurement):
+        """
+        Record a measurement taken elsewhere, e.g. elapsed() of loading the library at import.
+        """
+        self.records.append((run, stage, measurement))
+
+    def run(self, name):
+        """
+        Start a run, the stages from here on belong to it.
+        """
+        self.stop()
+        self.current_run = name
+
+    def stage(self, name):
+        """
+        End the current stage and start the next one.
+        """
+        self.end_stage()
+        start = snapshot()
+        functions = None
+        if name in self.profile_stages or '*' in self.profile_stages:
+            if self.mode == 'deterministic':
+                functions = cProfile.Profile()
+                functions.enable()
+            else:
+                functions = Sampler(threading.current_thread().ident)
+        self.current = (name, start, functions)
+
+    def end_stage(self):
+        if self.current is None:
+            return
+        name, start, functions = self.current
+        self.current = None
+        if isinstance(functions, Sampler):
+            functions.stop()
+            counts = self.functions.setdefault(name, {'samples': 0, 'wall': 0.0, 'own': {}, 'cumulative': {}})
+            counts['samples'] += functions.samples
+            counts['wall'] += functions.wall
+            for kind in ('own', 'cumulative'):
+                for key, value in getattr(functions, kind).items():
+                    counts[kind][key] = counts[kind].get(key, 0) + value
+        elif functions is not None:
+            functions.disable()
+            if name in self.functions:
+                self.functions[name].add(functions)
+            else:
+                self.functions[name] = pstats.Stats(functions)
+        self.records.append((self.current_run, name, elapsed(start)))
+
+    def stop(self):
+        """
+        End the current stage and run.
+        """
+        self.end_stage()
+        self.current_run = None
+
+    "SUMMARY"
+    def totals(self):
+        """
+        Stages summed over the runs: stage -> dict with 'wall', 'cpu', 'peak', 'runs' (runs in which it occurred).
+        """
+        stages = {}
+        for run, stage, measurement in self.records:
+            total = stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0, 'peak': None, 'runs': set()})
+            total['wall'] += measurement['wall']
+            total['cpu'] += measurement['cpu']
+            if measurement['peak'] is not None:
+                total['peak'] = max(total['peak'], measurement['peak']) if total['peak'] is not None else measurement['peak']
+            total['runs'].add(run)
+        return stages
+
+    def run_times(self):
+        """
+        Wall time of every run (stages summed), in the order of the runs.
+        """
+        runs, order = {}, []
+        for run, stage, measurement in self.records:
+            if run not in runs:
+                order.append(run)
+            runs[run] = runs.get(run, 0.0) + measurement['wall']
+        return [(run, runs[run]) for run in order]
+
+    def summary(self):
+        """
+        Text summary of the batch: stages by total wall time, slowest runs and the top functions of profiled stages.
+        """
+        self.end_stage()
+        stages = self.totals()
+        batch = sum(total['wall'] for total in stages.values())
+        runs = [run for run, wall in self.run_times() if run is not None]
+        lines = ['Profile of ' + str(len(runs)) + ' runs, ' + '%.2f' % batch + ' s',
+                 '%-16s %10s %7s %10s %10s %9s %10s' % ('Stage', 'Wall (s)', 'Share', 'Per run', 'CPU (s)', 'CPU/wall', 'Peak (MB)')]
+        for name in sorted(stages, key=lambda name: -stages[name]['wall']):
+            total = stages[name]
+            lines.append('%-16s %10.3f %6.1f%% %10.3f %10.3f %9.2f %10s' % (
+                name, total['wall'], 100 * total['wall'] / batch if batch else 0, total['wall'] / max(len(total['runs']), 1),
+                total['cpu'], total['cpu'] / total['wall'] if total['wall'] else 0,
+                '-' if total['peak'] is None else '%.0f' % total['peak']))
+        slowest = sorted(((wall, run) for run, wall in self.run_times() if run is not None), reverse=True)[:5]
+        if slowest:
+            lines.append('Slowest runs : ' + ',  '.join(run + ' ' + '%.2f' % wall + ' s' for wall, run in slowest))
+        for name in sorted(self.functions):
+            lines.append('')
+            lines.extend(self.function_summary(name))
+        return '\n'.join(lines)
+
+    def function_summary(self, name):
+        """
+        Top functions of a profiled stage by cumulative time.
+        """
+        functions = self.functions[name]
+        if isinstance(functions, dict):
+            lines = ['Stage ' + name + ', ' + str(functions['samples']) + ' samples in ' + '%.2f' % functions['wall'] + ' s',
+                     '%9s %9s  %s' % ('Own (s)', 'Cum. (s)', 'Function')]
+            sample = functions['wall'] / max(functions['samples'], 1) # s per sample
+            for key in sorted(functions['cumulative'], key=lambda key: -functions['cumulative'][key])[:TOP]:
+                lines.append('%9.3f %9.3f  %s' % (functions['own'].get(key, 0) * sample, functions['cumulative'][key] * sample,
+                                                   function_name(key)))
+            return lines
+        lines = ['Stage ' + name + ', ' + str(functions.total_calls) + ' calls (cProfile)',
+                 '%9s %9s %9s  %s' % ('Calls', 'Own (s)', 'Cum. (s)', 'Function')]
+        for key, (primitive, calls, own, cumulative, callers) in sorted(functions.stats.items(), key=lambda item: -item[1][3])[:TOP]:
+            lines.append('%9d %9.3f %9.3f  %s' % (calls, own, cumulative, function_name(key)))
+        return lines
+
+    def save(self, directory=PROFILE_DIRECTORY):
+        """
+        Write the summary and the table of every run and stage (and the cProfile stats of the profiled stages).
+
+        returns:
+            path: str
+        """
+        self.end_stage()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        now = time.strftime('%Y%m%d%H%M%S')
+        path = os.path.join(directory, 'profile_' + now + '.txt')
+        with open(path, 'w') as f:
+            f.write(self.summary() + '\n\n### Stages of every run ###\n')
+            f.write('Run\tStage\tWall (s)\tCPU (s)\tPeak (MB)\tIncrease (MB)\n')
+            for run, stage, measurement in self.records:
+                f.write('\t'.join([str(run), stage, '%.4f' % measurement['wall'], '%.4f' % measurement['cpu'],
+                                   '-' if measurement['peak'] is None else '%.1f' % measurement['peak'],
+                                   '-' if measurement['growth'] is None else '%.1f' % measurement['growth']]) + '\n')
+        for name, functions in self.functions.items():
+            if not isinstance(functions, dict):
+                functions.dump_stats(os.path.join(directory, 'profile_' + now + '_' + name + '.prof'))
+        return path
+
+class NullProfiler(object):
+    """
+    Stands in for StageProfiler when the analysis is not profiled.
+    """
+
+    def add(self, run, stage, measurement):
+        pass
+
+    def run(self, name):
+        pass
+
+    def stage(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+NO_PROFILER = NullProfiler()
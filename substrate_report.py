@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the HTML summary reports of analysed EL runs. Instead of opening the 500 dpi figures of every
+device, one page per substrate (or one page for a whole batch) shows:
+	- the curves of all pixels overlaid: EQE against luminance, J and L against voltage, angular emission
+	- a table of the key metrics of every pixel (peak EQE Lambertian and non-Lambertian, LE, CE, luminance, CIE,
+	  lambda max, eFACTOR/vFACTOR if a results index is given) with the best value and the median of every column
+	- a small thumbnail (EQE and angular emission) of every pixel, linked to its full-resolution figures
+The pages are built from the processed text files ('processedEL'/'sample_name'_effdata_NONLAM.txt,
+_effdata_LAM.txt and _lamdata.txt), so runs analysed by analysis_queue.py (which does not write the results index)
+are included. The pixels of a substrate are the samples that only differ in the device number, e.g. S23D1 ... S23D6
+on substrate S23; the latest analysed run of every sample is used.
+
+The figures are small (low dpi, no full-resolution rendering) and cached in 'data'/'reports'/'thumbnails' under the
+SHA-1 of their input files and drawing settings: a figure is only drawn again when a processed file it shows changed,
+so rebuilding the reports of a batch after a few runs were analysed again only draws their figures.
+
+Usage:
+	python substrate_report.py [sample pattern] [substrate|batch]
+	e.g. python substrate_report.py '190812*' writes 'data'/'reports'/'190812 S23'.html, ... and an index.html
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import re
+import sys
+import time
+import hashlib
+import fnmatch
+import numpy as np
+import matplotlib
+import matplotlib.figure as mplfig
+import matplotlib.ticker as ticker
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import results_index
+from goniometer_run import read_table, read_header
+try:
+    from html import escape as html_escape
+except ImportError: # Python 2
+    from cgi import escape as html_escape
+
+"DEFAULT SETTINGS"
+DATA_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
+REPORT_DIRECTORY = os.path.join(DATA_DIRECTORY, 'reports')
+THUMBNAIL_FOLDER = 'thumbnails' # in the report directory
+SKIP = ['batch', 'queue', 'golden', 'columnar', 'reports'] # folders in 'data' that are not samples
+DEVICE = re.compile(r'^(.*?)[ _-]?D\d+$') # sample name -> substrate, e.g. 'S23D1' -> 'S23'
+OVERLAY_SIZE = (5.0, 3.6) # inches
+OVERLAY_DPI = 80
+THUMBNAIL_SIZE = (3.6, 1.5) # inches
+THUMBNAIL_DPI = 60
+VERSION = '1' # part of the cache key, change it when the drawing code changes
+# Metrics of the table: column, title, format; eFACTOR/vFACTOR are only known from the results index
+METRICS = [('peak_eqe', 'EQE (%)', '%.2f'), ('peak_eqe_lam', 'EQE Lam. (%)', '%.2f'), ('peak_le', 'LE (lm/W)', '%.2f'),
+           ('peak_ce', 'CE (cd/A)', '%.2f'), ('peak_lum', 'L (cd/m2)', '%.0f'), ('cie_x', 'CIE x', '%.3f'),
+           ('cie_y', 'CIE y', '%.3f'), ('lambda_max', 'lambda max (nm)', '%.1f'), ('efactor', 'eFACTOR', '%.4f'),
+           ('vfactor', 'vFACTOR', '%.4f')]
+FULL_FIGURES = [('eqe', 'EQE'), ('ivl', 'IVL'), ('lam', 'angular'), ('density', 'CE')] # 'sample_name'_<name>.png of EL_analysis.py
+
+"FUNCTIONS"
+def substrate(sample):
+    """
+    Substrate of a sample, the sample name without the device number (the sample itself if it has none).
+    """
+    match = DEVICE.match(sample)
+    return match.group(1) if match and match.group(1) else sample
+
+def find_processed(datadirectory=DATA_DIRECTORY, sample='*', latest=True):
+    """
+    Analysed runs (sample, datetime, processed folder) of the samples that match the pattern, the latest of every
+    sample if latest is True.
+    """
+    runs = []
+    for name in sorted(os.listdir(datadirectory)):
+        if name in SKIP or not fnmatch.fnmatch(name, sample) or not os.path.isdir(os.path.join(datadirectory, name)):
+            continue
+        found = []
+        for datetime in sorted(os.listdir(os.path.join(datadirectory, name))):
+            processdirectory = os.path.join(datadirectory, name, datetime, 'processedEL')
+            if os.path.isfile(os.path.join(processdirectory, name + '_effdata_NONLAM.txt')):
+                found.append((name, datetime, processdirectory))
+        runs.extend(found[-1:] if latest else found)
+    return runs
+
+def digest(paths, *settings):
+    """
+    SHA-1 of the contents of files and of some settings (the cache key of a figure).
+    """
+    sha = hashlib.sha1()
+    for setting in (VERSION,) + settings:
+        sha.update(repr(setting).encode('utf-8'))
+    for path in paths:
+        sha.update(os.path.basename(path).encode('utf-8'))
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+"RESULTS OF A RUN"
+class PixelResults(object):
+    """
+    Processed results of one run, read from its text files.
+
+    summary: dict
+        row of the results index of the run (eFACTOR/vFACTOR), None if the run is not in the index.
+    """
+
+    def __init__(self, sample, datetime, processdirectory, summary=None):
+        self.sample = sample
+        self.datetime = datetime
+        self.processdirectory = processdirectory
+        self.files = [os.path.join(processdirectory, sample + suffix) for suffix in ('_effdata_NONLAM.txt', '_effdata_LAM.txt', '_lamdata.txt')]
+        self.nonlam = np.atleast_2d(read_table(self.files[0])) # points x (V, I, J, |J|, L, EQE, LE, CE, PoD)
+        self.lam = np.atleast_2d(read_table(self.files[1])) if os.path.isfile(self.files[1]) else None
+        self.lamdata = np.atleast_2d(read_table(self.files[2])) if os.path.isfile(self.files[2]) else None # angle, Lambertian, actual, actual_v
+        self.metrics = {'peak_eqe': results_index.peak(self.nonlam[:, 5]), 'peak_le': results_index.peak(self.nonlam[:, 6]),
+                        'peak_ce': results_index.peak(self.nonlam[:, 7]), 'peak_lum': results_index.peak(self.nonlam[:, 4]),
+                        'peak_eqe_lam': None if self.lam is None else results_index.peak(self.lam[:, 5])}
+        for line in read_header(self.files[0]):
+            if line.startswith('Maximum intensity at:'):
+                self.metrics['lambda_max'] = float(line.split(':')[1].split()[0])
+            elif line.startswith('CIE coordinates:'):
+                self.metrics['cie_x'], self.metrics['cie_y'] = [float(v) for v in re.findall(r'[-\d.]+', line.split(':')[1])[:2]]
+        if summary is not None:
+            self.metrics['efactor'], self.metrics['vfactor'] = summary.get('efactor'), summary.get('vfactor')
+
+"FIGURES"
+def draw_eqe(axis, pixels, colours, fontsize):
+    for pixel, colour in zip(pixels, colours):
+        lit = pixel.nonlam[:, 4] > 0
+        axis.semilogx(pixel.nonlam[lit, 4], pixel.nonlam[lit, 5], color=colour, linewidth=1.0, label=pixel.sample)
+    axis.set_ylim(bottom=0)
+    axis.set_xlabel(u'Luminance (cd/m\u00b2)', fontsize=fontsize)
+    axis.set_ylabel('EQE (%)', fontsize=fontsize)
+
+def draw_ivl(axis, pixels, colours, fontsize):
+    luminance = axis.twinx()
+    for pixel, colour in zip(pixels, colours):
+        axis.semilogy(pixel.nonlam[:, 0], np.abs(pixel.nonlam[:, 3]) + 1e-12, color=colour, linewidth=1.0, label=pixel.sample)
+        lit = pixel.nonlam[:, 4] > 0
+        luminance.semilogy(pixel.nonlam[lit, 0], pixel.nonlam[lit, 4], color=colour, linewidth=1.0, dashes=[4, 2])
+    axis.set_xlabel('Voltage (V)', fontsize=fontsize)
+    axis.set_ylabel(u'|J| (mA/cm\u00b2), solid', fontsize=fontsize)
+    luminance.set_ylabel(u'L (cd/m\u00b2), dashed', fontsize=fontsize)
+    luminance.tick_params(axis='both', labelsize=fontsize)
+    plain_ticks(luminance)
+
+def draw_angular(axis, pixels, colours, fontsize):
+    for pixel, colour in zip(pixels, colours):
+        if pixel.lamdata is not None:
+            axis.plot(pixel.lamdata[:, 0], pixel.lamdata[:, 2], color=colour, linewidth=1.0, label=pixel.sample)
+    angles = np.linspace(0, 90, 91)
+    axis.plot(angles, np.cos(np.deg2rad(angles)), 'k:', linewidth=1.0, label='Lambertian')
+    axis.set_xlim(0, 90)
+    axis.set_xlabel('Angle (degrees)', fontsize=fontsize)
+    axis.set_ylabel('Intensity (a.u.)', fontsize=fontsize)
+
+OVERLAYS = [('eqe', 'EQE', draw_eqe), ('ivl', 'IVL', draw_ivl), ('angular', 'Angular emission', draw_angular)]
+
+def plain_ticks(axis):
+    """
+    Major ticks only, log axes labelled 1, 10, 100, ... without mathtext (the tick labels take most of the drawing time).
+    """
+    axis.minorticks_off()
+    for scale, which in ((axis.get_xscale(), axis.xaxis), (axis.get_yscale(), axis.yaxis)):
+        if scale == 'log':
+            which.set_major_formatter(ticker.FormatStrFormatter('%g'))
+
+def colours_of(count):
+    return matplotlib.cm.get_cmap('viridis')(np.linspace(0, 0.9, max(count, 1)))
+
+def save_figure(figure, path):
+    """
+    Write a figure (PNG) through a temporary file, an interrupted report never leaves a broken cached figure.
+    """
+    temporary = path + '.tmp.png'
+    figure.savefig(temporary, dpi=figure.dpi)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+def overlay(path, draw, pixels, title):
+    figure = mplfig.Figure(figsize=OVERLAY_SIZE, dpi=OVERLAY_DPI)
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(left=0.15, right=0.82, bottom=0.13, top=0.92) # fixed margins, tight_layout takes longer than drawing
+    axis = figure.add_subplot(111)
+    draw(axis, pixels, colours_of(len(pixels)), 9)
+    plain_ticks(axis)
+    axis.set_title(title, fontsize=10)
+    axis.tick_params(axis='both', labelsize=8)
+    if len(pixels) <= 12:
+        axis.legend(loc='upper right', fontsize=7)
+    save_figure(figure, path)
+
+def thumbnail(path, pixel):
+    """
+    EQE against luminance and angular emission of one pixel, without axis labels.
+    """
+    figure = mplfig.Figure(figsize=THUMBNAIL_SIZE, dpi=THUMBNAIL_DPI)
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(left=0.08, right=0.98, bottom=0.14, top=0.96, wspace=0.25)
+    for position, draw in ((121, draw_eqe), (122, draw_angular)):
+        axis = figure.add_subplot(position)
+        draw(axis, [pixel], ['C0'], 6)
+        axis.set_xlabel('')
+        axis.set_ylabel('')
+        plain_ticks(axis)
+        axis.locator_params(axis='y', nbins=3)
+        axis.tick_params(axis='both', labelsize=5)
+    save_figure(figure, path)
+
+"FIGURE CACHE"
+class FigureCache(object):
+    """
+    Folder of the report figures named after the SHA-1 of their inputs; a figure is only drawn if it is missing.
+
+    folder: str
+        'data'/'reports'/'thumbnails' by default.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.drawn = 0
+        self.reused = 0
+
+    def get(self, kind, paths, draw, *settings):
+        """
+        File name of the figure of some input files, draw(path) is called if it is not cached.
+        """
+        name = kind + '_' + digest(paths, kind, *settings)[:20] + '.png'
+        path = os.path.join(self.folder, name)
+        if os.path.isfile(path):
+            self.reused += 1
+        else:
+            draw(path)
+            self.drawn += 1
+        return name
+
+"HTML"
+STYLE = ('body{font-family:sans-serif;font-size:13px;margin:20px}table{border-collapse:collapse}'
+         'td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}th{background:#eee}td.name{text-align:left}'
+         'tr.best td{font-weight:bold}tr.median td{font-style:italic}img{vertical-align:middle}'
+         '.overlays img{margin-right:8px}')
+
+def escape(text):
+    return html_escape(text, True) # also quotes, the names are used in attributes
+
+def cell(value, fmt):
+    return '<td>' + ('' if value is None else escape(fmt % value)) + '</td>'
+
+def page(title, pixels, cache, reportdirectory):
+    """
+    HTML of the report of some pixels (one substrate or a batch).
+    """
+    lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>' + escape(title) + '</title>',
+             '<style>' + STYLE + '</style></head><body>',
+             '<h1>' + escape(title) + '</h1>',
+             '<p>' + str(len(pixels)) + ' pixels, report of ' + time.strftime('%Y-%m-%d %H:%M') + '</p>']
+
+    # Overlaid curves of all pixels
+    inputs = [path for pixel in pixels for path in pixel.files]
+    lines.append('<div class="overlays">')
+    for kind, name, draw in OVERLAYS:
+        filename = cache.get(kind, inputs, lambda path, draw=draw, name=name: overlay(path, draw, pixels, name), OVERLAY_SIZE, OVERLAY_DPI)
+        lines.append('<img src="' + THUMBNAIL_FOLDER + '/' + filename + '" alt="' + escape(name) + '">')
+    lines.append('</div>')
+
+    # Metrics of every pixel, the best value and the median of every column
+    shown = [(key, heading, fmt) for key, heading, fmt in METRICS if any(pixel.metrics.get(key) is not None for pixel in pixels)]
+    lines.append('<h2>Pixels</h2><table><tr><th>Sample</th><th>Measured</th>' +
+                 ''.join('<th>' + escape(heading) + '</th>' for key, heading, fmt in shown) + '<th>EQE, angular</th><th>Figures</th></tr>')
+    for pixel in pixels:
+        filename = cache.get('pixel', pixel.files, lambda path, pixel=pixel: thumbnail(path, pixel), THUMBNAIL_SIZE, THUMBNAIL_DPI)
+        folder = os.path.relpath(pixel.processdirectory, reportdirectory).replace(os.sep, '/')
+        links = ' '.join('<a href="' + escape(folder + '/' + pixel.sample + '_' + suffix + '.png') + '">' + escape(name) + '</a>'
+                         for suffix, name in FULL_FIGURES if os.path.isfile(os.path.join(pixel.processdirectory, pixel.sample + '_' + suffix + '.png')))
+        lines.append('<tr><td class="name"><a href="' + escape(folder) + '">' + escape(pixel.sample) + '</a></td><td>' + escape(pixel.datetime) + '</td>' +
+                     ''.join(cell(pixel.metrics.get(key), fmt) for key, heading, fmt in shown) +
+                     '<td><img src="' + THUMBNAIL_FOLDER + '/' + filename + '" alt="' + escape(pixel.sample) + '"></td><td>' + links + '</td></tr>')
+    for row, name, select in (('best', 'Best', max), ('median', 'Median', np.median)):
+        values = []
+        for key, heading, fmt in shown:
+            column = [pixel.metrics[key] for pixel in pixels if pixel.metrics.get(key) is not None]
+            ranked = key.startswith('peak') or row == 'median' # no best CIE, lambda max or eFACTOR
+            values.append(cell(float(select(column)) if column and ranked else None, fmt))
+        lines.append('<tr class="' + row + '"><td class="name">' + name + '</td><td></td>' + ''.join(values) + '<td></td><td></td></tr>')
+    lines.append('</table></body></html>')
+    return '\n'.join(lines)
+
+def write_page(path, text):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(text.encode('utf-8'))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+"REPORTS"
+def build(sample='*', group='substrate', datadirectory=DATA_DIRECTORY, reportdirectory=REPORT_DIRECTORY, index=None, latest=True):
+    """
+    Write the HTML reports of the analysed runs.
+
+    sample: str
+        sample name or glob pattern, e.g. '190812*' for a batch.
+    group: str
+        'substrate' for one page per substrate and an index.html linking them, 'batch' for one page of all pixels.
+    index: sqlite3.Connection
+        results index (see results_index.py) for eFACTOR/vFACTOR, None to leave them out.
+    latest: bool
+        only the latest analysed run of every sample.
+
+    returns:
+        paths: list of str
+            the written pages.
+    """
+    if not os.path.isdir(reportdirectory):
+        os.makedirs(reportdirectory)
+    cache = FigureCache(os.path.join(reportdirectory, THUMBNAIL_FOLDER))
+    summaries = {}
+    if index is not None:
+        for row in results_index.find_runs(index, sample=sample):
+            summaries[(row['sample'], row['datetime'])] = row
+    pixels = [PixelResults(name, datetime, processdirectory, summaries.get((name, datetime)))
+              for name, datetime, processdirectory in find_processed(datadirectory, sample, latest)]
+
+    if group == 'batch':
+        groups = [(sample.replace('*', '').strip() or 'batch', pixels)]
+    else:
+        groups = []
+        for pixel in pixels:
+            if not groups or groups[-1][0] != substrate(pixel.sample):
+                groups.append((substrate(pixel.sample), []))
+            groups[-1][1].append(pixel)
+    paths = []
+    for title, members in groups:
+        paths.append(os.path.join(reportdirectory, re.sub(r'[^\w. -]', '_', title) + '.html'))
+        write_page(paths[-1], page(title, members, cache, reportdirectory))
+    if group != 'batch':
+        lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Substrates</title><style>' + STYLE + '</style></head><body>',
+                 '<h1>Substrates</h1><table><tr><th>Substrate</th><th>Pixels</th><th>Best EQE (%)</th></tr>']
+        for (title, members), path in zip(groups, paths):
+            best = results_index.peak([pixel.metrics['peak_eqe'] for pixel in members if pixel.metrics['peak_eqe'] is not None])
+            lines.append('<tr><td class="name"><a href="' + escape(os.path.basename(path)) + '">' + escape(title) + '</a></td><td>' +
+                         str(len(members)) + '</td>' + cell(best, '%.2f') + '</tr>')
+        lines.append('</table></body></html>')
+        write_page(os.path.join(reportdirectory, 'index.html'), '\n'.join(lines))
+    print('Reports : ' + str(len(paths)) + ',  figures drawn : ' + str(cache.drawn) + ',  from the cache : ' + str(cache.reused))
+    return paths
+
+"WRITING THE REPORTS OF THE DATA FOLDER"
+if __name__ == '__main__':
+    index = results_index.connect() if os.path.isfile(results_index.DEFAULT_INDEX) else None
+    build(sys.argv[1] if len(sys.argv) > 1 else '*', sys.argv[2] if len(sys.argv) > 2 else 'substrate', index=index)
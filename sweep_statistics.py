@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the averaging of repeated goniometer sweeps on the same device. Instead of writing a new run
+folder for every repeat of the sweep, the spectra of all sweeps are accumulated with Welford's algorithm:
+	- the running mean and the sum of squared deviations are updated after every sweep, so the memory needed is
+	  fixed (a few (angles x pixels) arrays) no matter how many sweeps are taken
+	- the averaged spectra are written as Angle_.txt files with an extra column holding the standard error of the mean,
+	  so that EL_analysis.py and PL_analysis.py analyse the average like a single sweep
+	- the integrated intensity (all angles and pixels, background subtracted) of every sweep is accumulated as well;
+	  the repeats stop once the relative standard error of its mean is below the target
+
+Example:
+	sweeps = SweepAverage(angles, wavelengths, '202001011200', target_error=0.005)
+	sweeps.add(spectra, background)  # after every sweep
+	sweeps.save(spectrumdirectory, backgroundfilename, header_lines)
+	sweeps.converged()
+"""
+
+"IMPORTING REQUIRED MODULES"
+import os
+import numpy as np
+
+"FUNCTIONS"
+def angle_filename(angle):
+    """
+    Name of the spectrum file of an angle, as written by Goniometer_measurement.py.
+    """
+    return 'Angle' + str(angle).zfill(3) + '.txt'
+
+"ACCUMULATORS"
+class Welford(object):
+    """
+    Running mean and variance of arrays of a fixed shape (Welford's algorithm, numerically stable in one pass).
+
+    shape: tuple
+        shape of the accumulated arrays, () for numbers.
+    """
+
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, value):
+        """
+        Add one sample.
+        """
+        value = np.asarray(value, dtype=float)
+        if value.shape != self.mean.shape:
+            raise ValueError('Sample of shape ' + str(value.shape) + ' does not match the accumulated shape ' + str(self.mean.shape))
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        """
+        Sample variance (zero until two samples are added).
+        """
+        if self.count < 2:
+            return np.zeros(self.mean.shape)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def standard_error(self):
+        """
+        Standard error of the mean.
+        """
+        return self.std / np.sqrt(max(self.count, 1))
+
+class SweepAverage(object):
+    """
+    Average of repeated sweeps of one run.
+
+    angles: list
+        angles of the sweep as written into the file names (0 -> 180 or 0 -> 90).
+    wavelengths: np.array
+        wavelength axis of the spectrometer (nm).
+    datetime: str
+        datetime code of the run folder all sweeps are written to.
+    target_error: float
+        relative standard error of the mean integrated intensity at which the repeats stop (e.g. 0.01 for 1%).
+    max_sweeps: int
+        the repeats stop after this number of sweeps even if the target is not reached.
+    min_sweeps: int
+        minimum number of sweeps before the error estimate is trusted.
+    """
+
+    def __init__(self, angles, wavelengths, datetime, target_error=0.01, max_sweeps=20, min_sweeps=3):
+        self.angles = list(angles)
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.datetime = datetime
+        self.target_error = target_error
+        self.max_sweeps = max_sweeps
+        self.min_sweeps = max(min_sweeps, 2)
+        self.spectra = Welford((len(self.angles), len(self.wavelengths)))
+        self.background = Welford(len(self.wavelengths))
+        self.smu = Welford(len(self.angles))
+        self.integrated = Welford()
+
+    @property
+    def count(self):
+        return self.spectra.count
+
+    def add(self, spectra, background, smu=None):
+        """
+        Add one complete sweep.
+
+        spectra: (angles x pixels) raw counts of the sweep.
+        background: raw counts of the background spectrum taken before the sweep.
+        smu: optional sourcemeter reading of every angle.
+        """
+        spectra = np.asarray(spectra, dtype=float)
+        background = np.asarray(background, dtype=float)
+        self.spectra.add(spectra)
+        self.background.add(background)
+        if smu is not None:
+            self.smu.add(smu)
+        self.integrated.add(np.sum(spectra - background))
+
+    def relative_error(self):
+        """
+        Relative standard error of the mean integrated intensity (inf before two sweeps).
+        """
+        if self.count < 2 or self.integrated.mean == 0:
+            return np.inf
+        return float(self.integrated.standard_error / abs(self.integrated.mean))
+
+    def converged(self):
+        """
+        True if the target error is reached or the maximum number of sweeps is taken.
+        """
+        if self.count >= self.max_sweeps:
+            return True
+        return self.count >= self.min_sweeps and self.relative_error() <= self.target_error
+
+    def header(self, header_lines):
+        """
+        Header of the averaged files: the general lines of the run, the averaging and the column names.
+        """
+        return list(header_lines) + ['Sweeps averaged :  ' + str(self.count),
+                                     'Relative error of the integrated intensity :  ' + '%.3g' % (100 * self.relative_error()) + ' %',
+                                     'Wavelength   Intensity   Error', 'nm             -           - (standard error of the mean)']
+
+    def save(self, spectrumdirectory, backgroundfilename, header_lines):
+        """
+        Write the averaged spectra (Angle_.txt files in spectrumdirectory) and the averaged background.
+
+        header_lines: list of str
+            general header lines of the run (measurement code, integration time, ...).
+        """
+        if not os.path.isdir(spectrumdirectory):
+            os.makedirs(spectrumdirectory)
+        header = '\n'.join(self.header(header_lines))
+        np.savetxt(backgroundfilename, np.stack((self.wavelengths, self.background.mean, self.background.standard_error)).T,
+                   fmt='%.4f %.1f %.2f', delimiter='\t', header=header, comments='')
+        for angle, mean, error in zip(self.angles, self.spectra.mean, self.spectra.standard_error):
+            np.savetxt(os.path.join(spectrumdirectory, angle_filename(angle)), np.stack((self.wavelengths, mean, error)).T,
+                       fmt='%.3f %.1f %.2f', delimiter='\t', header=header, comments='')
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Created by Gather Lab
+
+This is the code for the uncertainty of the efficiency data of EL_analysis.py (J, L, EQE, LE, CE and PoD). The inputs
+of the calculation are only known within a tolerance, so they are drawn many times (Monte-Carlo):
+	- OLED area (pixel width), distance OLED - photodiode and photodiode area (relative standard uncertainties)
+	- resistance of the transimpedance amplifier of the photodiode (gain tolerance)
+	- spectrometer calibration: a linear tilt across 400-800nm; a constant factor cancels in all results, as the
+	  spectrum only enters through ratios of integrals (Integral1/Integral4, ..., eFACTOR, vFACTOR)
+	- photodiode noise: normal noise on every photodiode voltage, a fraction of the cutoff voltage of the gain
+Every sample is evaluated at all voltages in one array operation (samples x voltages), there is no loop over the
+samples. The percentiles of the samples give the confidence bands, which are written next to the _effdata tables.
+
+Example:
+	samples = draw_samples(nominal, 2000)
+	projections = factor_projections(factor_intensities, wavelength, Vlambda)
+	bands = confidence_bands(efficiency(samples, ...))
+"""
+
+"IMPORTING REQUIRED MODULES"
+import numpy as np
+
+"DEFAULT SETTINGS"
+SAMPLES = 2000
+OLED_WIDTH_REL = 0.01 # relative standard uncertainty of the OLED width (area twice that)
+DISTANCE_ABS = 1e-3 # m
+PD_AREA_REL = 0.01
+PD_RESISTANCE_REL = 0.01 # Thorlabs PDA100A2 gain tolerance
+CALIBRATION_TILT = 0.03 # relative change of the calibration between 600 and 400/800nm
+PD_NOISE = 0.3 # standard deviation of the photodiode noise as a fraction of the cutoff voltage
+PERCENTILES = (2.5, 50, 97.5) # 95% confidence band and median
+QUANTITIES = ['J', 'L', 'EQE', 'LE', 'CE', 'PoD']
+UNITS = ['mA/cm2', 'cd/m2', '%', 'lm/W', 'cd/A', 'mW/mm2']
+
+# Constants of EL_analysis.py
+Km = 683 # lm/W
+h = 6.62606896e-34 # Js
+c = 299792458 # m/s
+e = 1.602176462e-19 # As
+
+"SAMPLING"
+def draw_samples(nominal, count=SAMPLES, seed=None):
+    """
+    Random input parameters.
+
+    nominal: dict
+        'oled_area', 'distance', 'pd_area', 'pd_resistance', 'pd_cutoff' of the analysis.
+    count: int
+        number of samples.
+
+    returns:
+        samples: dict
+            arrays of shape (count, 1) for every parameter and 'calibration_tilt', so they broadcast against the
+            voltages; 'rng' draws the photodiode noise in efficiency(), once the number of voltages is known.
+    """
+    rng = np.random.RandomState(seed)
+    shape = (count, 1)
+    return {'oled_area': nominal['oled_area'] * (1 + OLED_WIDTH_REL * rng.standard_normal(shape))**2,
+            'distance': nominal['distance'] + DISTANCE_ABS * rng.standard_normal(shape),
+            'pd_area': nominal['pd_area'] * (1 + PD_AREA_REL * rng.standard_normal(shape)),
+            'pd_resistance': nominal['pd_resistance'] * (1 + PD_RESISTANCE_REL * rng.standard_normal(shape)),
+            'pd_cutoff': nominal['pd_cutoff'],
+            'calibration_tilt': CALIBRATION_TILT * rng.standard_normal(shape),
+            'rng': rng}
+
+def factor_projections(factor_intensities, wavelength, Vlambda):
+    """
+    Weighted sums of the spectra of the angles that enter eFACTOR and vFACTOR, so the spectra need not be kept.
+
+    factor_intensities: np.array
+        spectrum (wavelengths) or spectra (angles x wavelengths) on the wavelength axis.
+
+    returns:
+        projections: np.array
+            (angles x 4) sums of the spectra weighted by the wavelength and by V(lambda), each without and with the
+            calibration tilt (see tilted_integrals()).
+    """
+    x = (wavelength - 600.0) / 200.0
+    return np.dot(np.atleast_2d(factor_intensities), np.stack((wavelength, wavelength * x, Vlambda, Vlambda * x), axis=1))
+
+def tilted_integrals(perp_intensity, projections, factor_angles, step_angle, wavelength, Vlambda, Rlambda, tilt):
+    """
+    Integrals of the perpendicular spectrum and eFACTOR/vFACTOR for every calibration tilt.
+
+    perp_intensity: np.array
+        perpendicular spectrum (W/nm/sr) on the wavelength axis.
+    projections: np.array
+        (angles x 4) factor_projections() of the angles that enter eFACTOR and vFACTOR.
+    factor_angles: np.array
+        their angles in degrees, as in the sin() weights of eFACTOR in EL_analysis.py.
+    tilt: np.array
+        (samples x 1) relative tilt of the calibration.
+
+    returns:
+        integrals: list of np.array
+            Integral1 to Integral4 of EL_analysis.py, eFACTOR and vFACTOR, each (samples x 1).
+    """
+    x = (wavelength - 600.0) / 200.0
+    weights = np.stack((wavelength, np.ones(len(wavelength)), Vlambda, Rlambda)) # Integral1 to Integral4
+    # The calibration (1 + tilt x) is linear in the tilt, so every integral is a + tilt b
+    flat = np.dot(weights, perp_intensity)
+    sloped = np.dot(weights * x, perp_intensity)
+    integrals = [flat[k] + tilt * sloped[k] for k in range(4)]
+    solid = np.sin(np.deg2rad(factor_angles)) * np.deg2rad(step_angle)
+    factors = []
+    for k in (0, 2): # wavelength (Integral1) and V(lambda) (Integral3) weights
+        ratio = (projections[:, k] + tilt * projections[:, k + 1]) / integrals[k] # (samples x angles)
+        factors.append(np.sum(ratio * solid, axis=1, keepdims=True))
+    return integrals + factors
+
+def efficiency(samples, OLEDvoltage, OLEDcurrent, PDvoltage, integrals, lambertian=False):
+    """
+    Efficiency data of all samples at all voltages, the equations of EL_analysis.py as array operations.
+
+    samples: dict
+        see draw_samples().
+    OLEDvoltage, OLEDcurrent, PDvoltage: np.array
+        measured voltages (V), currents (A) and photodiode voltages (V).
+    integrals: list of np.array
+        see tilted_integrals().
+    lambertian: bool
+        True for the Lambertian (cos) emission, False for the measured angular distribution.
+
+    returns:
+        results: dict
+            (samples x voltages) arrays of QUANTITIES, zero where the photodiode voltage is below the cutoff.
+    """
+    Integral1, Integral2, Integral3, Integral4, eFACTOR, vFACTOR = integrals
+    if lambertian:
+        eFACTOR = vFACTOR = 1.0
+    count = samples['oled_area'].shape[0]
+    noise = PD_NOISE * samples['pd_cutoff'] * samples['rng'].standard_normal((count, len(PDvoltage)))
+    pd = PDvoltage[np.newaxis, :] + noise
+    radius2 = samples['pd_area'] / np.pi
+    sqsinalpha = radius2 / (samples['distance']**2 + radius2)
+    area = samples['oled_area']
+    lit = pd > samples['pd_cutoff']
+    eCoeff = pd / samples['pd_resistance'] / sqsinalpha * (1 if lambertian else 2)
+    vCoeff = Km * eCoeff
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Lum = 1 / np.pi / area * vCoeff / (1 if lambertian else 2) * Integral3 / Integral4
+        results = {'J': np.abs(OLEDcurrent * 1e3 / (area * 1e4)) * np.ones(pd.shape),
+                   'L': Lum,
+                   'EQE': 100 * (e / 1e9 / h / c / OLEDcurrent * eCoeff * Integral1 / Integral4 * eFACTOR),
+                   'LE': 1 / OLEDvoltage / OLEDcurrent * vCoeff * Integral3 / Integral4 * vFACTOR,
+                   'CE': area / OLEDcurrent * Lum,
+                   'PoD': 1 / (area * 1e6) * eCoeff * Integral2 / Integral4 * eFACTOR * 1e3}
+    for quantity in QUANTITIES[1:]:
+        results[quantity] = np.where(lit, results[quantity], 0)
+    return results
+
+"CONFIDENCE BANDS"
+def confidence_bands(results, percentiles=PERCENTILES):
+    """
+    Percentiles of every quantity over the samples.
+
+    returns:
+        bands: dict
+            (percentiles x voltages) array of every quantity.
+    """
+    return dict((quantity, np.percentile(results[quantity], percentiles, axis=0)) for quantity in QUANTITIES)
+
+def save_bands(filename, OLEDvoltage, bands, header_lines, count, percentiles=PERCENTILES):
+    """
+    Write the bands as a table: voltage, then the percentiles of every quantity.
+    """
+    names = ['V'] + [quantity + '_' + ('%g' % p) for quantity in QUANTITIES for p in percentiles]
+    units = ['V'] + [unit for unit in UNITS for p in percentiles]
+    header = list(header_lines) + ['Monte-Carlo samples :  ' + str(count) + '   percentiles :  ' + ', '.join('%g' % p for p in percentiles),
+                                   '   '.join(names), '   '.join(units)]
+    table = np.vstack([OLEDvoltage] + [bands[quantity] for quantity in QUANTITIES])
+    np.savetxt(filename, table.T, fmt='{: ^8}'.format('%.6e'), header='\n'.join(header), comments='')